@@ -0,0 +1,213 @@
+"""
+Control de admisión de requests y tamaño del threadpool.
+
+Las rutas son `def` sincrónicas: cada request ocupa un hilo del threadpool de
+AnyIO y una o más conexiones del pool del engine. El threadpool se dimensiona
+con el pool (DB_POOL_SIZE + DB_MAX_OVERFLOW, o THREADPOOL_SIZE).
+
+La capacidad de este middleware se cuenta en conexiones: las del pool menos
+ADMISSION_RESERVED_CONNECTIONS, que quedan para el worker de jobs (su sesión
+de la base global, la del shard y el latido de la tarea). Cada request toma
+las conexiones que usa a la vez (`connections`): las rutas que abren la base
+global y un shard toman dos, y las escrituras con Idempotency-Key una más por
+el latido de la clave. Lo que no entra espera en una cola acotada por clase de
+ruta y, si la cola está llena o la espera supera ADMISSION_QUEUE_TIMEOUT, se
+responde 503 con Retry-After en vez de dejar que el cliente espere hasta que
+venza el timeout del pool.
+
+Clases de ruta, en orden de prioridad:
+- lectura: GET baratos; pueden usar toda la capacidad.
+- escritura: altas, cambios y bajas.
+- pesada: recálculos y exportaciones; cupo chico y sin cola.
+
+Cuando se libera un lugar, entra primero quien espera en la clase más prioritaria.
+"""
+import asyncio
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional, Tuple
+
+import anyio.to_thread
+from fastapi.responses import JSONResponse
+
+from database import MAX_OVERFLOW, POOL_SIZE
+import idempotency
+
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", str(POOL_SIZE + MAX_OVERFLOW)))
+RESERVED_CONNECTIONS = int(os.getenv("ADMISSION_RESERVED_CONNECTIONS", "3"))
+CONNECTION_BUDGET = max(1, POOL_SIZE + MAX_OVERFLOW - RESERVED_CONNECTIONS)
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+
+LECTURA = "lectura"
+ESCRITURA = "escritura"
+PESADA = "pesada"
+
+HEAVY_ROUTES = [
+    re.compile(r"^/groups/\d+/recalculate-debts$"),
+    re.compile(r"^/groups/\d+/export$"),
+]
+# Rutas con una sesión de la base global y otra de shard abiertas a la vez
+TWO_CONNECTION_ROUTES = [
+    ("GET", re.compile(r"^/users/\d+/balances$")),
+    ("GET", re.compile(r"^/groups/?$")),
+    ("POST", re.compile(r"^/groups/?$")),
+    ("POST", re.compile(r"^/groups/accept/[^/]+$")),
+    ("GET", re.compile(r"^/groups/\d+/export$")),
+]
+EXEMPT_PATHS = {"/ready", "/docs", "/redoc", "/openapi.json"}
+READ_METHODS = {"GET", "HEAD"}
+
+
+@dataclass
+class RouteClass:
+    name: str
+    priority: int  # menor = más prioritaria
+    max_in_flight: int
+    max_queued: int
+    retry_after: int
+    in_flight: int = 0  # conexiones
+    waiters: Deque[Tuple[asyncio.Future, int]] = field(default_factory=deque)
+    rejected: int = 0
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Clase de la ruta, o None si no pasa por el control de admisión"""
+    if method == "OPTIONS" or path in EXEMPT_PATHS:
+        return None
+    if any(pattern.match(path) for pattern in HEAVY_ROUTES):
+        return PESADA
+    return LECTURA if method in READ_METHODS else ESCRITURA
+
+
+def connections(method: str, path: str, headers) -> int:
+    """Conexiones del pool que la request puede tener abiertas a la vez"""
+    count = 2 if any(method == m and pattern.match(path) for m, pattern in TWO_CONNECTION_ROUTES) else 1
+    if (
+        method in idempotency.MUTATING_METHODS
+        and path.startswith(idempotency.PATH_PREFIXES)
+        and any(name == idempotency.HEADER.encode() for name, _ in headers)
+    ):
+        count += 1
+    return count
+
+
+class AdmissionController:
+    def __init__(self, capacity: int = CONNECTION_BUDGET):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.classes: Dict[str, RouteClass] = {
+            LECTURA: RouteClass(LECTURA, 0, capacity, capacity * 2, retry_after=1),
+            ESCRITURA: RouteClass(ESCRITURA, 1, max(1, capacity * 3 // 4), capacity, retry_after=2),
+            PESADA: RouteClass(PESADA, 2, max(1, capacity // 4), 0, retry_after=10),
+        }
+        self._by_priority = sorted(self.classes.values(), key=lambda c: c.priority)
+
+    def _cost(self, route_class: RouteClass, cost: int) -> int:
+        # Una request que pide más de lo que entra igual tiene que poder pasar cuando todo está libre
+        return max(1, min(cost, route_class.max_in_flight))
+
+    def _has_room(self, route_class: RouteClass, cost: int) -> bool:
+        return (
+            self.in_flight + cost <= self.capacity
+            and route_class.in_flight + cost <= route_class.max_in_flight
+        )
+
+    def _grant(self, route_class: RouteClass, cost: int):
+        self.in_flight += cost
+        route_class.in_flight += cost
+
+    def _dispatch(self):
+        for route_class in self._by_priority:
+            while route_class.waiters and self._has_room(route_class, route_class.waiters[0][1]):
+                waiter, cost = route_class.waiters.popleft()
+                if not waiter.done():
+                    self._grant(route_class, cost)
+                    waiter.set_result(True)
+            if route_class.waiters and self.in_flight + route_class.waiters[0][1] > self.capacity:
+                # Las clases menos prioritarias no le sacan lugar a quien espera
+                return
+
+    async def acquire(self, name: str, cost: int = 1) -> bool:
+        route_class = self.classes[name]
+        cost = self._cost(route_class, cost)
+        # No se adelanta a nadie que espere en su clase o en una más prioritaria
+        ahead = any(c.waiters for c in self._by_priority if c.priority <= route_class.priority)
+        if not ahead and self._has_room(route_class, cost):
+            self._grant(route_class, cost)
+            return True
+
+        if len(route_class.waiters) >= route_class.max_queued:
+            route_class.rejected += 1
+            return False
+
+        entry = (asyncio.get_running_loop().create_future(), cost)
+        route_class.waiters.append(entry)
+        try:
+            return await asyncio.wait_for(entry[0], QUEUE_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if entry[0].done() and not entry[0].cancelled():
+                # Se le dio el lugar justo cuando vencía la espera
+                self.release(name, cost)
+            try:
+                route_class.waiters.remove(entry)
+            except ValueError:
+                pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            route_class.rejected += 1
+            return False
+
+    def release(self, name: str, cost: int = 1):
+        route_class = self.classes[name]
+        cost = self._cost(route_class, cost)
+        self.in_flight -= cost
+        route_class.in_flight -= cost
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,  # en conexiones
+            "reserved": RESERVED_CONNECTIONS,
+            "in_flight": self.in_flight,
+            "classes": {
+                c.name: {"in_flight": c.in_flight, "queued": len(c.waiters), "rejected": c.rejected}
+                for c in self._by_priority
+            },
+        }
+
+
+def configure_threadpool(size: int = THREADPOOL_SIZE):
+    """Fija la cantidad de hilos para rutas sincrónicas; llamar dentro del event loop"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = size
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI: no lee el body ni envuelve la respuesta, solo la cuenta"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        name = classify(scope["method"], scope["path"])
+        if name is None:
+            return await self.app(scope, receive, send)
+
+        cost = connections(scope["method"], scope["path"], scope["headers"])
+        if not await self.controller.acquire(name, cost):
+            response = JSONResponse(
+                {"detail": "Servidor sobrecargado; reintentar más tarde"},
+                status_code=503,
+                headers={"Retry-After": str(self.controller.classes[name].retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name, cost)
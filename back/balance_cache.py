@@ -0,0 +1,72 @@
+"""
+Cache en proceso de los saldos por usuario (GET /users/{id}/balances).
+
+Cualquier escritura de una Deuda hecha a través del ORM invalida, al hacer
+commit, la entrada del deudor y del acreedor. Las escrituras masivas (UPDATE/
+DELETE sin pasar por objetos) tienen que llamar a `invalidate` a mano. El TTL
+acota cuánto puede quedar desactualizada otra réplica del backend.
+"""
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from models import Deuda
+
+TTL_SECONDS = float(os.getenv("BALANCE_CACHE_TTL", "30"))
+MAX_ENTRIES = int(os.getenv("BALANCE_CACHE_SIZE", "10000"))
+
+_entries = {}  # user_id -> (expires_at, value)
+_lock = threading.Lock()
+
+
+def get(user_id: int) -> Optional[Any]:
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _entries[user_id]
+            return None
+        return entry[1]
+
+
+def put(user_id: int, value: Any):
+    with _lock:
+        if len(_entries) >= MAX_ENTRIES:
+            _entries.clear()
+        _entries[user_id] = (time.monotonic() + TTL_SECONDS, value)
+
+
+def invalidate(*user_ids: int):
+    with _lock:
+        for user_id in user_ids:
+            _entries.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_debt_writes(session, flush_context):
+    touched = session.info.setdefault("balance_users", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Deuda):
+            touched.update((obj.deudor_id, obj.acreedor_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    touched = session.info.pop("balance_users", None)
+    if touched:
+        invalidate(*touched)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("balance_users", None)
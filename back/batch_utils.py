@@ -0,0 +1,31 @@
+from typing import List
+from fastapi import HTTPException
+
+# Máximo de IDs aceptados por una consulta batch (?ids=1,2,3)
+MAX_BATCH_IDS = 200
+
+
+def parse_ids(raw: str) -> List[int]:
+    """Parse a comma separated id list, dropping duplicates but keeping request order"""
+    ids = []
+    seen = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            value = int(part)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"ID inválido: {part}")
+        if value not in seen:
+            seen.add(value)
+            ids.append(value)
+
+    if not ids:
+        raise HTTPException(status_code=400, detail="No se proporcionaron IDs")
+    if len(ids) > MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Se permiten como máximo {MAX_BATCH_IDS} IDs por consulta"
+        )
+    return ids
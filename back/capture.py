@@ -0,0 +1,215 @@
+"""
+Captura de tráfico real para reproducirlo después con scripts/replay_traffic.py.
+
+Si TRAFFIC_CAPTURE_FILE está definida, TrafficCaptureMiddleware agrega al
+archivo una línea JSON por request (o por una fracción, con
+TRAFFIC_CAPTURE_SAMPLE_RATE):
+
+    {"t": 1760000000.123, "m": "GET", "r": "/expenses/debts/{user_id}",
+     "p": "/expenses/debts/3", "q": {"grupo_id": "1"}, "b": null, "s": 200, "ms": 4.1}
+
+Anonimización:
+- Números (ids, montos), booleanos y fechas ISO se guardan tal cual: hacen
+  falta para pegarle a los mismos grupos y usuarios al reproducir.
+- Los parámetros de ruta o query con datos personales (PRIVATE_PARAMS, o
+  cualquier valor con "@") se reemplazan por un hash con sal.
+- Los códigos de invitación (G<grupo>-<secreto>) se reemplazan por
+  invite-<grupo>-<hash>: el mismo código da siempre el mismo reemplazo, y
+  replay_traffic.py genera una invitación nueva del grupo para cada uno.
+- Del body JSON se guarda solo la forma: las claves, los números y, de cada
+  texto, su largo ({"$str": 8}). Los bodies que no son JSON (fotos de
+  comprobantes) se guardan como {"$bytes": tamaño}.
+
+Como en logs.py, la request solo encola el registro: un hilo aparte lo
+serializa y lo escribe, y si la cola se llena se descarta.
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, quote
+
+import warmup
+
+CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE")
+SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1"))
+# Sal del hash; si no se fija, cambia en cada arranque (los hashes solo se comparan dentro de un archivo)
+SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "").encode() or os.urandom(16)
+MAX_BODY_BYTES = 64 * 1024
+QUEUE_SIZE = 10000
+EXEMPT_PATHS = {"/ready", "/docs", "/redoc", "/openapi.json"}
+
+PRIVATE_PARAMS = {
+    "email", "mail", "nombre", "apellido", "password", "titulo", "descripcion", "autor", "code", "name",
+}
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}([T ][\d:.]+)?$")
+# Formato de routers.groups._gen_code; el id del grupo no es secreto
+_INVITE_CODE = re.compile(r"^G(\d+)-")
+
+
+def _hash(value: str) -> str:
+    return "anon-" + hashlib.blake2s(value.encode(), key=SALT[:32], digest_size=6).hexdigest()
+
+
+def _anonymize_param(key: str, value: str) -> str:
+    invite = _INVITE_CODE.match(value) if key == "code" else None
+    if invite:
+        return f"invite-{invite.group(1)}-{_hash(value)}"
+    if key in PRIVATE_PARAMS or "@" in value:
+        return _hash(value)
+    return value
+
+
+def body_shape(value):
+    """Forma del body: claves y números tal cual, textos reducidos a su largo"""
+    if isinstance(value, dict):
+        return {k: body_shape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [body_shape(v) for v in value]
+    if isinstance(value, str):
+        return value if _ISO_DATE.match(value) else {"$str": len(value)}
+    return value
+
+
+def _body_record(content_type: str, body: bytes, size: int):
+    if not size:
+        return None
+    if len(body) == size and content_type.startswith("application/json"):
+        try:
+            return body_shape(json.loads(body))
+        except ValueError:
+            pass
+    return {"$bytes": size, "$type": content_type.split(";")[0]}
+
+
+class TraceWriter:
+    """Hilo que agrega los registros al archivo de captura"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def put(self, record: dict):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                lines = [record]
+                # Lo que ya está en la cola se escribe junto, con un solo flush
+                while len(lines) < 500:
+                    try:
+                        lines.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = lines[-1] is None
+                f.writelines(json.dumps(r, separators=(",", ":"), ensure_ascii=False) + "\n" for r in lines if r)
+                f.flush()
+                if stop:
+                    break
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join(timeout=10)
+
+
+_writer: Optional[TraceWriter] = None
+
+
+def start(path: str) -> TraceWriter:
+    global _writer
+    if _writer is None or _writer.path != path:
+        shutdown()
+        _writer = TraceWriter(path)
+    return _writer
+
+
+def shutdown():
+    """Escribe lo que quede en la cola y cierra el archivo"""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def _path_record(scope) -> Optional[str]:
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return None
+    path = template
+    for key, value in (scope.get("path_params") or {}).items():
+        path = path.replace("{" + key + "}", quote(_anonymize_param(key, str(value)), safe=""))
+    return path
+
+
+class TrafficCaptureMiddleware:
+    """Middleware ASGI: mira el body a medida que pasa, sin leerlo antes que la ruta"""
+
+    def __init__(self, app, path: str = CAPTURE_FILE, sample_rate: float = SAMPLE_RATE):
+        self.app = app
+        self.path = path
+        self.sample_rate = sample_rate
+        start(path)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] in EXEMPT_PATHS
+            or scope["method"] == "OPTIONS"
+            or (scope.get("state") or {}).get(warmup.WARMUP_STATE)
+            or random.random() >= self.sample_rate
+        ):
+            return await self.app(scope, receive, send)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        chunks, size, status = [], 0, {"code": 500}
+
+        async def receive_and_copy():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                size += len(body)
+                if size <= MAX_BODY_BYTES:
+                    chunks.append(body)
+            return message
+
+        async def send_and_watch(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_copy, send_and_watch)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            # start() vuelve a abrir el archivo si un cierre de la app lo cerró
+            start(self.path).put({
+                "t": round(started_at, 3),
+                "m": scope["method"],
+                "r": getattr(scope.get("route"), "path", None),
+                "p": _path_record(scope),
+                "q": {
+                    key: _anonymize_param(key, value)
+                    for key, value in parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+                } or None,
+                "b": _body_record(headers.get(b"content-type", b"").decode("latin-1"), b"".join(chunks), size),
+                "s": status["code"],
+                "ms": round((time.perf_counter() - started) * 1000, 2),
+            })
@@ -0,0 +1,190 @@
+"""
+Registro de cambios por grupo para sincronización incremental
+(GET /groups/{id}/changes?since=).
+
+Toda escritura hecha a través del ORM de un gasto, una deuda o una membresía
+agrega en el mismo flush una fila en `cambios` con el siguiente `seq` del grupo
+(las bajas quedan como tombstones). El `seq` se asigna con el lock del grupo
+tomado, así se confirma en el mismo orden en que se numera y un cliente que
+leyó hasta N nunca se pierde un cambio con seq menor.
+
+Los cambios más viejos que CHANGES_RETENTION_DAYS se purgan, así que desde
+0 (o desde un cursor anterior a lo purgado) ya no se puede reproducir la
+historia: en esos casos la respuesta es una foto (`snapshot: true`) con todos
+los gastos, deudas y miembros actuales y el cursor desde el cual seguir.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func
+from sqlmodel import Session, select
+
+from database import lock_group
+from models import Cambio, Deuda, Gasto, UsuarioGrupo
+import jobs
+import shards
+
+RETENTION = timedelta(days=float(os.getenv("CHANGES_RETENTION_DAYS", "30")))
+PURGE_INTERVAL_SECONDS = 6 * 3600
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Entidades registradas: clase -> nombre en el feed
+ENTITIES = {Gasto: "gasto", Deuda: "deuda", UsuarioGrupo: "miembro"}
+
+# Sesiones creadas con Session(..., info={SKIP: True}) no registran cambios
+SKIP = "changes_skip"
+
+
+def _entity(obj) -> Optional[str]:
+    entidad = ENTITIES.get(type(obj))
+    if entidad is None or obj.grupo_id is None:
+        return None
+    return entidad
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_deletes(session, flush_context, instances):
+    # Se leen antes del DELETE, mientras el objeto todavía se puede cargar
+    if session.info.get(SKIP):
+        return
+    deleted = session.info.setdefault("changes_deleted", [])
+    for obj in session.deleted:
+        entidad = _entity(obj)
+        if entidad:
+            deleted.append((obj.grupo_id, entidad, obj.id, DELETE))
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    if session.info.get(SKIP):
+        return
+    pending: List[Tuple[int, str, int, str]] = session.info.pop("changes_deleted", [])
+    for obj in session.new:
+        entidad = _entity(obj)
+        if entidad:
+            pending.append((obj.grupo_id, entidad, obj.id, UPSERT))
+    for obj in session.dirty:
+        entidad = _entity(obj)
+        if entidad and session.is_modified(obj):
+            pending.append((obj.grupo_id, entidad, obj.id, UPSERT))
+    if not pending:
+        return
+
+    now = datetime.now()
+    conn = session.connection()
+    rows = []
+    for grupo_id in sorted({p[0] for p in pending}):
+        lock_group(session, grupo_id)
+        seq = conn.execute(select(func.coalesce(func.max(Cambio.seq), 0)).where(Cambio.grupo_id == grupo_id)).scalar()
+        for p_grupo, entidad, entidad_id, operacion in pending:
+            if p_grupo == grupo_id:
+                seq += 1
+                rows.append({
+                    "grupo_id": grupo_id, "seq": seq, "entidad": entidad,
+                    "entidad_id": entidad_id, "operacion": operacion, "creado_en": now,
+                })
+    conn.execute(Cambio.__table__.insert(), rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("changes_deleted", None)
+
+
+def snapshot(session: Session, grupo_id: int) -> Dict:
+    """Estado actual completo del grupo, con el cursor desde el cual pedir cambios"""
+    # El cursor se lee antes que las filas: lo que se confirme entre medio puede venir
+    # en la foto y otra vez en el próximo pedido, pero nunca se pierde
+    cursor = session.exec(
+        select(func.coalesce(func.max(Cambio.seq), 0)).where(Cambio.grupo_id == grupo_id)
+    ).one()
+    result = {
+        entidad: [obj.model_dump() for obj in session.exec(
+            select(model).where(model.grupo_id == grupo_id).order_by(model.id)
+        ).all()]
+        for model, entidad in ENTITIES.items()
+    }
+    return {
+        "snapshot": True,
+        "gastos": result["gasto"],
+        "deudas": result["deuda"],
+        "miembros": result["miembro"],
+        "eliminados": [],
+        "cursor": cursor,
+        "has_more": False,
+    }
+
+
+def changes_since(session: Session, grupo_id: int, since: int, limit: int) -> Dict:
+    """
+    Cambios del grupo con seq > `since`, como filas actuales (upserts) y
+    tombstones (bajas). Si la entidad cambió varias veces, solo va su último estado.
+    Con `since` 0 o anterior a lo purgado devuelve la foto completa (snapshot).
+    """
+    if since == 0:
+        return snapshot(session, grupo_id)
+    first = session.exec(select(func.min(Cambio.seq)).where(Cambio.grupo_id == grupo_id)).one()
+    if first is not None and since < first - 1:
+        return snapshot(session, grupo_id)
+
+    cambios = session.exec(
+        select(Cambio)
+        .where((Cambio.grupo_id == grupo_id) & (Cambio.seq > since))
+        .order_by(Cambio.seq)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(cambios) > limit
+    cambios = cambios[:limit]
+
+    latest: Dict[Tuple[str, int], str] = {}
+    for cambio in cambios:
+        latest[(cambio.entidad, cambio.entidad_id)] = cambio.operacion
+
+    result = {name: [] for name in ENTITIES.values()}
+    deleted = []
+    for model, entidad in ENTITIES.items():
+        ids = [eid for (ent, eid), op in latest.items() if ent == entidad and op == UPSERT]
+        found = session.exec(select(model).where(model.id.in_(ids))).all() if ids else []
+        result[entidad] = [obj.model_dump() for obj in found]
+        # Lo que ya no existe se borró en un cambio posterior a esta página
+        missing = set(ids) - {obj.id for obj in found}
+        deleted += [{"entidad": entidad, "id": eid} for eid in sorted(missing)]
+        deleted += [
+            {"entidad": entidad, "id": eid}
+            for (ent, eid), op in latest.items() if ent == entidad and op == DELETE
+        ]
+
+    return {
+        "snapshot": False,
+        "gastos": result["gasto"],
+        "deudas": result["deuda"],
+        "miembros": result["miembro"],
+        "eliminados": deleted,
+        "cursor": cambios[-1].seq if cambios else since,
+        "has_more": has_more,
+    }
+
+
+def purge_old():
+    """Borra los cambios vencidos, conservando el último de cada grupo"""
+    limite = datetime.now() - RETENTION
+    for shard_engine in shards.engines:
+        with Session(shard_engine) as session:
+            ultimo = (
+                select(Cambio.grupo_id, func.max(Cambio.seq).label("seq"))
+                .group_by(Cambio.grupo_id)
+                .subquery()
+            )
+            session.exec(
+                delete(Cambio).where(
+                    (Cambio.creado_en < limite)
+                    & (Cambio.seq < select(ultimo.c.seq).where(ultimo.c.grupo_id == Cambio.grupo_id).scalar_subquery())
+                )
+            )
+            session.commit()
+
+
+jobs.register_periodic(PURGE_INTERVAL_SECONDS, purge_old)
@@ -0,0 +1,156 @@
+"""
+Compactación de deudas pendientes fragmentadas.
+
+El neteo solo junta deudas en sentido opuesto: cada gasto nuevo en el mismo
+sentido agrega otra fila pendiente para el mismo (grupo, deudor, acreedor).
+El worker de jobs revisa cada DEBT_COMPACTION_MINUTES los pares con al menos
+COMPACTION_MIN_ROWS filas pendientes y las junta en una sola.
+
+La deuda consolidada conserva como `gasto_id` el del gasto más reciente y la
+parte de cada gasto queda en `deuda_gastos`, así las vistas por gasto (listado,
+borrado y edición de gastos, exportación) siguen funcionando.
+"""
+import os
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from database import lock_group
+from models import Deuda, DeudaGasto
+import jobs
+import shards
+from split_engine import from_cents, to_cents
+
+COMPACTION_INTERVAL_SECONDS = float(os.getenv("DEBT_COMPACTION_MINUTES", "30")) * 60
+COMPACTION_MIN_ROWS = int(os.getenv("DEBT_COMPACTION_MIN_ROWS", "5"))
+
+
+def compact_group(session: Session, grupo_id: int, min_rows: int = COMPACTION_MIN_ROWS) -> int:
+    """
+    Junta las deudas pendientes del mismo sentido de cada par del grupo.
+    Devuelve cuántas filas se eliminaron. Hace commit de la sesión.
+    """
+    lock_group(session, grupo_id)
+    pending = (Deuda.grupo_id == grupo_id) & (Deuda.estado == 0)
+    pairs = session.exec(
+        select(Deuda.deudor_id, Deuda.acreedor_id)
+        .where(pending)
+        .group_by(Deuda.deudor_id, Deuda.acreedor_id)
+        .having(func.count(Deuda.id) >= min_rows)
+    ).all()
+
+    removed = 0
+    for deudor_id, acreedor_id in pairs:
+        debts = session.exec(
+            select(Deuda)
+            .where(pending & (Deuda.deudor_id == deudor_id) & (Deuda.acreedor_id == acreedor_id))
+            .order_by(Deuda.id)
+        ).all()
+        keep = debts[-1]
+        ids = [d.id for d in debts]
+
+        # Las que ya eran consolidadas traen su reparto por gasto; las demás aportan su monto
+        partes = session.exec(select(DeudaGasto).where(DeudaGasto.deuda_id.in_(ids))).all()
+        consolidated = {p.deuda_id for p in partes}
+        for parte in partes:
+            parte.deuda_id = keep.id
+            session.add(parte)
+        for debt in debts:
+            if debt.id not in consolidated:
+                session.add(DeudaGasto(deuda_id=keep.id, gasto_id=debt.gasto_id, grupo_id=grupo_id, monto=debt.monto))
+
+        keep.monto = from_cents(sum(to_cents(d.monto) for d in debts))
+        session.add(keep)
+        session.flush()
+        for debt in debts[:-1]:
+            session.delete(debt)
+        removed += len(debts) - 1
+
+    session.commit()
+    return removed
+
+
+def sync_parts(session: Session, deuda: Deuda, partes=None) -> list:
+    """
+    Ajusta las partes de una deuda consolidada para que sumen su monto. El
+    neteo descuenta de la deuda sin tocar sus partes: lo que sobra se descuenta
+    de las partes más viejas. Devuelve las partes que quedan. No hace commit.
+    """
+    if partes is None:
+        partes = session.exec(
+            select(DeudaGasto).where(DeudaGasto.deuda_id == deuda.id).order_by(DeudaGasto.id)
+        ).all()
+    sobrante = sum(to_cents(p.monto) for p in partes) - to_cents(deuda.monto)
+    vigentes = []
+    for parte in partes:
+        if sobrante > 0:
+            cents = to_cents(parte.monto)
+            quita = min(cents, sobrante)
+            sobrante -= quita
+            if quita == cents:
+                session.delete(parte)
+                continue
+            parte.monto = from_cents(cents - quita)
+            session.add(parte)
+        vigentes.append(parte)
+    return vigentes
+
+
+def detach_expense(session: Session, gasto_id: int):
+    """
+    Saca de las deudas todo lo que corresponde al gasto: borra sus deudas propias
+    y de las consolidadas descuenta solo su parte; lo que queda de la deuda es la
+    suma de las partes de los otros gastos. No hace commit.
+    """
+    deuda_ids = session.exec(
+        select(DeudaGasto.deuda_id).where(DeudaGasto.gasto_id == gasto_id).distinct()
+    ).all()
+    for deuda_id in deuda_ids:
+        deuda = session.get(Deuda, deuda_id)
+        partes = session.exec(
+            select(DeudaGasto).where(DeudaGasto.deuda_id == deuda_id).order_by(DeudaGasto.id)
+        ).all()
+        if deuda is None:
+            # Partes de una deuda que ya no existe
+            for parte in partes:
+                session.delete(parte)
+            continue
+
+        # Las deudas neteadas antes de que el neteo ajustara las partes pueden venir desfasadas
+        otras = []
+        for parte in sync_parts(session, deuda, partes):
+            if parte.gasto_id == gasto_id:
+                session.delete(parte)
+            else:
+                otras.append(parte)
+        if not otras:
+            session.delete(deuda)
+            continue
+
+        deuda.monto = from_cents(sum(to_cents(p.monto) for p in otras))
+        if deuda.gasto_id == gasto_id:
+            deuda.gasto_id = max(p.gasto_id for p in otras)
+        session.add(deuda)
+
+    session.flush()
+    for deuda in session.exec(select(Deuda).where(Deuda.gasto_id == gasto_id)).all():
+        session.delete(deuda)
+
+
+def compact_all():
+    """Compacta los grupos de todos los shards que tengan pares fragmentados"""
+    for shard_engine in shards.engines:
+        with Session(shard_engine) as session:
+            fragmented = (
+                select(Deuda.grupo_id, Deuda.deudor_id, Deuda.acreedor_id)
+                .where(Deuda.estado == 0)
+                .group_by(Deuda.grupo_id, Deuda.deudor_id, Deuda.acreedor_id)
+                .having(func.count(Deuda.id) >= COMPACTION_MIN_ROWS)
+                .subquery()
+            )
+            grupo_ids = session.exec(select(fragmented.c.grupo_id).distinct()).all()
+            for grupo_id in grupo_ids:
+                compact_group(session, grupo_id)
+
+
+jobs.register_periodic(COMPACTION_INTERVAL_SECONDS, compact_all)
@@ -1,12 +1,56 @@
 from sqlmodel import create_engine, SQLModel, Session
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from typing import Generator
 import os
 
-# Database URL configuration
-DATABASE_URL = f"postgresql://{os.getenv('DB_USER', 'gestionuser')}:{os.getenv('DB_PASSWORD', 'gestionpass')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', 'gestionapp')}"
+from db_pool import MeteredQueuePool
+
+# Database URL configuration (DATABASE_URL, si está definida, tiene prioridad: tests, otros entornos)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{os.getenv('DB_USER', 'gestionuser')}:{os.getenv('DB_PASSWORD', 'gestionpass')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', 'gestionapp')}"
+
+# Conexiones por engine; el threadpool de las rutas se dimensiona con esto (ver admission.py).
+# Cada réplica del backend abre hasta DB_POOL_SIZE + DB_MAX_OVERFLOW por base: dimensionar
+# contra max_connections de Postgres (o de PgBouncer) multiplicando por la cantidad de réplicas.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Segundos que una request espera una conexión libre antes de fallar
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Conexiones más viejas que esto se cierran y se reabren (después de un failover
+# o de un corte de la red, las viejas pueden estar muertas sin saberlo)
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Verifica cada conexión con un ping liviano al sacarla del pool y la reemplaza si murió
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# Modo PgBouncer (pool_mode = transaction): la conexión del servidor puede cambiar
+# entre transacciones, así que no se puede dejar estado de sesión. El código solo usa
+# locks de transacción (pg_advisory_xact_lock) y no hace SET ni LISTEN; con el driver
+# psycopg (3) además se desactivan los prepared statements del lado del servidor.
+PGBOUNCER = os.getenv("DB_PGBOUNCER", "0") == "1"
+
+# Con DB_ECHO=1 SQLAlchemy escribe cada consulta a stdout (solo para depurar);
+# en producción usar SQL_LOG_SAMPLE_RATE (ver logs.py)
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+
+
+def engine_options(url: str) -> dict:
+    """Opciones de create_engine comunes a la base global y a los shards"""
+    options = {
+        "poolclass": MeteredQueuePool,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+    if PGBOUNCER and make_url(url).get_driver_name() == "psycopg":
+        # Un statement preparado en una conexión del servidor no existe en la siguiente;
+        # psycopg2 no prepara del lado del servidor, así que ahí no hace falta nada
+        options["connect_args"] = {"prepare_threshold": None}
+    return options
+
 
 # Create engine
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, echo=DB_ECHO, **engine_options(DATABASE_URL))
 
 def create_db_and_tables():
     """Create database tables. This is optional since you already have init.sql"""
@@ -16,3 +60,34 @@ def get_session() -> Generator[Session, None, None]:
     """Dependency to get database session"""
     with Session(engine) as session:
         yield session
+
+
+# Espacios de nombres para los advisory locks de PostgreSQL (primer argumento de pg_advisory_xact_lock)
+LOCK_NAMESPACE_GRUPO = 1
+
+
+def lock_group(session: Session, grupo_id: int):
+    """
+    Serializa las escrituras de deudas de un grupo hasta el fin de la transacción.
+    Grupos distintos no se bloquean entre sí. En motores sin advisory locks
+    (SQLite en desarrollo) no hace nada: ahí las escrituras ya son serializadas.
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    session.exec(
+        text("SELECT pg_advisory_xact_lock(:ns, :key)"),
+        params={"ns": LOCK_NAMESPACE_GRUPO, "key": grupo_id},
+    )
+
+
+def try_lock_group(session: Session, grupo_id: int) -> bool:
+    """
+    Como lock_group, pero sin esperar: devuelve False si otra transacción ya
+    tiene el lock del grupo. Sin advisory locks siempre devuelve True.
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        return True
+    return session.exec(
+        text("SELECT pg_try_advisory_xact_lock(:ns, :key)"),
+        params={"ns": LOCK_NAMESPACE_GRUPO, "key": grupo_id},
+    ).scalar()
@@ -0,0 +1,91 @@
+"""
+Pool de conexiones con métricas.
+
+MeteredQueuePool es el QueuePool de SQLAlchemy que además mide cuánto espera
+cada checkout (incluye abrir la conexión cuando hace falta una nueva) y cuenta
+timeouts e invalidaciones (conexiones muertas que descarta el pre-ping o un
+error de la base). `stats(engine)` devuelve eso junto con el uso actual del
+pool; main.py lo publica en /ready.
+"""
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Un checkout que espera más que esto cuenta como lento
+SLOW_CHECKOUT_SECONDS = 0.1
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+        self.invalidated = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if seconds >= SLOW_CHECKOUT_SECONDS:
+                self.slow_checkouts += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_invalidation(self, *args):
+        with self._lock:
+            self.invalidated += 1
+
+
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # engine.dispose() recrea el pool: las métricas arrancan de cero
+        self.metrics = PoolMetrics()
+        event.listen(self, "invalidate", self.metrics.record_invalidation)
+        event.listen(self, "soft_invalidate", self.metrics.record_invalidation)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - started)
+
+
+def stats(engine) -> dict:
+    """Uso y métricas del pool del engine"""
+    pool = engine.pool
+    data = {"url": engine.url.render_as_string(hide_password=True), "pool": type(pool).__name__}
+    if not isinstance(pool, QueuePool):
+        return data
+    data.update({
+        "size": pool.size(),
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # overflow() es negativo mientras no se abrieron todas las conexiones base
+        "overflow": max(0, pool.overflow()),
+        "max_overflow": pool._max_overflow,
+    })
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        with metrics._lock:
+            data.update({
+                "checkouts": metrics.checkouts,
+                "slow_checkouts": metrics.slow_checkouts,
+                "timeouts": metrics.timeouts,
+                "invalidated": metrics.invalidated,
+                "wait_ms_avg": round(metrics.wait_total / metrics.checkouts * 1000, 3) if metrics.checkouts else 0,
+                "wait_ms_max": round(metrics.wait_max * 1000, 3),
+            })
+    return data
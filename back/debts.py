@@ -0,0 +1,97 @@
+"""
+Neteo de deudas pendientes entre dos miembros de un grupo.
+
+Todo lo que genera deudas a partir de gastos (alta y edición de gastos,
+recálculo del grupo, gastos recurrentes) pasa por `net_or_create_debt`, así
+entre dos personas no quedan deudas pendientes en los dos sentidos. Quien
+escribe tiene que tener tomado el lock del grupo (database.lock_group).
+
+Si la deuda neteada es consolidada (compaction.py), sus partes por gasto se
+ajustan junto con el monto para que sigan sumándolo.
+"""
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from models import Deuda, DeudaGasto
+import compaction
+from split_engine import from_cents, to_cents
+
+
+# (deudor, acreedor) -> [[centavos, gasto_id], ...] en orden de creación
+PendingDebts = Dict[Tuple[int, int], List[List[int]]]
+
+
+def _delete_debt(session: Session, deuda: Deuda):
+    session.exec(delete(DeudaGasto).where(DeudaGasto.deuda_id == deuda.id))
+    session.delete(deuda)
+
+
+def net_or_create_debt(
+    *,
+    session: Session,
+    grupo_id: int,
+    deudor_id: int,
+    acreedor_id: int,
+    monto: Decimal,
+    gasto_id: Optional[int] = None,
+):
+    """
+    Registra que `deudor_id` le debe `monto` a `acreedor_id`. Si hay una deuda
+    pendiente en sentido contrario se netean: se descuenta de ellas y, si las
+    supera, queda una sola deuda nueva por la diferencia. No hace commit.
+    """
+    if monto <= 0:
+        return
+
+    stmt_opuestas = select(Deuda).where(
+        (Deuda.grupo_id == grupo_id)
+        & (Deuda.deudor_id == acreedor_id)
+        & (Deuda.acreedor_id == deudor_id)
+        & (Deuda.estado == 0)
+    ).order_by(Deuda.id)
+
+    # Puede haber varias en sentido contrario: se descuenta de todas antes de
+    # crear una en este sentido
+    new_c = to_cents(monto)
+    for opuesta in session.exec(stmt_opuestas).all():
+        opp_c = to_cents(opuesta.monto)
+        if opp_c > new_c:
+            opuesta.monto = from_cents(opp_c - new_c)
+            session.add(opuesta)
+            compaction.sync_parts(session, opuesta)
+            return
+        _delete_debt(session, opuesta)
+        new_c -= opp_c
+        if new_c == 0:
+            return
+
+    session.add(Deuda(
+        gasto_id=gasto_id,
+        deudor_id=deudor_id,
+        acreedor_id=acreedor_id,
+        grupo_id=grupo_id,
+        monto=from_cents(new_c),
+        estado=0
+    ))
+
+
+def net_in_memory(pending: PendingDebts, deudor_id: int, acreedor_id: int, cents: int, gasto_id: Optional[int] = None):
+    """
+    La misma regla que net_or_create_debt sobre deudas que todavía no se
+    escribieron (recálculo de un grupo): se descuenta de las opuestas, de la más
+    vieja a la más nueva, y solo lo que sobra queda en este sentido.
+    """
+    if cents <= 0:
+        return
+    opuestas = pending.get((acreedor_id, deudor_id), [])
+    while opuestas:
+        if opuestas[0][0] > cents:
+            opuestas[0][0] -= cents
+            return
+        cents -= opuestas.pop(0)[0]
+        if cents == 0:
+            return
+    pending.setdefault((deudor_id, acreedor_id), []).append([cents, gasto_id])
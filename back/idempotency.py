@@ -0,0 +1,287 @@
+"""
+Soporte del header Idempotency-Key en las rutas que escriben gastos y deudas.
+
+El primer request con una clave la reserva en `claves_idempotencia` (base
+global) y se ejecuta normalmente; su respuesta queda guardada ahí. Los
+reintentos con la misma clave y el mismo request reciben la respuesta guardada
+sin volver a ejecutar nada; si el request es distinto se rechaza. Las claves
+vencen a las IDEMPOTENCY_TTL_HOURS horas y el worker de jobs las purga
+periódicamente.
+
+Mientras el primero corre, los reintentos reciben 409 con Retry-After. El
+request en curso renueva `latido_en` cada HEARTBEAT_SECONDS, así que un
+request lento conserva su clave el tiempo que tarde; solo una clave sin latido
+durante STALE_AFTER (se cayó el proceso) la puede tomar un reintento.
+
+La escritura va al shard del grupo, que puede ser otra base que la de la
+clave. Para que no quede a medias, cada transacción del request que escribe en
+un shard inserta ahí, antes de confirmar, una fila en `claves_aplicadas` con
+la clave como PK:
+- si el proceso se cae después de escribir y antes de guardar la respuesta,
+  el reintento encuentra la marca y responde 409 en vez de repetir la escritura;
+- si dos requests llegaran a ejecutar con la misma clave, la marca del segundo
+  choca con la del primero y toda su transacción se deshace.
+"""
+import asyncio
+import hashlib
+import os
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, event, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from database import engine
+from models import ClaveAplicada, ClaveIdempotencia
+import jobs
+import shards
+
+HEADER = "idempotency-key"
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+PATH_PREFIXES = ("/expenses",)
+TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+HEARTBEAT_SECONDS = float(os.getenv("IDEMPOTENCY_HEARTBEAT_SECONDS", "10"))
+# Sin latido por más que esto, el request "en curso" se considera abandonado (proceso caído)
+STALE_AFTER = timedelta(seconds=HEARTBEAT_SECONDS * 3)
+PURGE_INTERVAL_SECONDS = 15 * 60
+
+NUEVA = "nueva"
+EN_CURSO = "en_curso"
+COMPLETADA = "completada"
+APLICADA = "aplicada"  # escribió, pero su respuesta no quedó guardada
+
+# Sesiones propias del módulo (Session(..., info={SKIP: True})): no marcan la clave
+SKIP = "idempotency_skip"
+
+# Request con clave en curso: {"clave": str, "shards": engines en los que ya quedó marcada}
+_current: ContextVar[Optional[dict]] = ContextVar("idempotency_current", default=None)
+
+
+def _request_hash(method: str, path: str, query: str, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query.encode(), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _applied_anywhere(clave: str) -> bool:
+    for shard_engine in shards.engines:
+        with Session(shard_engine, info={SKIP: True}) as session:
+            if session.get(ClaveAplicada, clave) is not None:
+                return True
+    return False
+
+
+def _begin(clave: str, request_hash: str) -> Tuple[str, Optional[ClaveIdempotencia]]:
+    """
+    Reserva la clave para este request. Devuelve (NUEVA, None) si hay que
+    ejecutarlo, o (estado, registro) si ya existía.
+    """
+    now = datetime.now()
+    with Session(engine, info={SKIP: True}) as session:
+        registro = session.get(ClaveIdempotencia, clave)
+        if registro and registro.expira_en < now:
+            session.delete(registro)
+            session.commit()
+            registro = None
+
+        if (
+            registro
+            and registro.estado == EN_CURSO
+            and registro.request_hash == request_hash
+            and registro.latido_en < now - STALE_AFTER
+        ):
+            # El proceso que la tenía se cayó: si llegó a escribir, no se repite
+            if _applied_anywhere(clave):
+                registro.estado = APLICADA
+                session.add(registro)
+                session.commit()
+                return APLICADA, None
+            else:
+                # Se toma la clave solo si ningún otro reintento la tomó entre medio
+                taken = session.connection().execute(
+                    update(ClaveIdempotencia)
+                    .where((ClaveIdempotencia.clave == clave) & (ClaveIdempotencia.latido_en == registro.latido_en))
+                    .values(latido_en=now)
+                ).rowcount
+                session.commit()
+                return (NUEVA, None) if taken else (EN_CURSO, None)
+
+        if registro:
+            session.expunge(registro)
+            return registro.estado, registro
+
+        session.add(ClaveIdempotencia(clave=clave, request_hash=request_hash, latido_en=now, expira_en=now + TTL))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Otro reintento con la misma clave llegó al mismo tiempo
+            session.rollback()
+            return EN_CURSO, None
+    return NUEVA, None
+
+
+def _heartbeat(clave: str):
+    with Session(engine, info={SKIP: True}) as session:
+        session.connection().execute(
+            update(ClaveIdempotencia)
+            .where((ClaveIdempotencia.clave == clave) & (ClaveIdempotencia.estado == EN_CURSO))
+            .values(latido_en=datetime.now())
+        )
+        session.commit()
+
+
+async def _keep_alive(clave: str):
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        await run_in_threadpool(_heartbeat, clave)
+
+
+def _complete(clave: str, status_code: int, body: bytes):
+    with Session(engine, info={SKIP: True}) as session:
+        registro = session.get(ClaveIdempotencia, clave)
+        if not registro:
+            return
+        registro.estado = COMPLETADA
+        registro.status_code = status_code
+        registro.respuesta = body.decode("utf-8", errors="replace")
+        session.add(registro)
+        session.commit()
+
+
+def _release(clave: str, wrote: bool):
+    """Libera la clave de un request que falló; si ya escribió, queda como aplicada"""
+    with Session(engine, info={SKIP: True}) as session:
+        if wrote:
+            session.connection().execute(
+                update(ClaveIdempotencia).where(ClaveIdempotencia.clave == clave).values(estado=APLICADA)
+            )
+        else:
+            session.exec(delete(ClaveIdempotencia).where(ClaveIdempotencia.clave == clave))
+        session.commit()
+
+
+def purge_expired():
+    now = datetime.now()
+    with Session(engine, info={SKIP: True}) as session:
+        session.exec(delete(ClaveIdempotencia).where(ClaveIdempotencia.expira_en < now))
+        session.commit()
+    for shard_engine in shards.engines:
+        with Session(shard_engine, info={SKIP: True}) as session:
+            session.exec(delete(ClaveAplicada).where(ClaveAplicada.expira_en < now))
+            session.commit()
+
+
+jobs.register_periodic(PURGE_INTERVAL_SECONDS, purge_expired)
+
+
+@event.listens_for(Session, "after_flush")
+def _note_write(session, flush_context):
+    if _current.get() is not None and not session.info.get(SKIP):
+        session.info["idempotency_wrote"] = True
+
+
+@event.listens_for(Session, "before_commit")
+def _mark_applied(session):
+    # Corre antes del último flush del commit: la marca se confirma junto con la escritura
+    actual = _current.get()
+    if actual is None or session.info.get(SKIP):
+        return
+    if not (session.new or session.dirty or session.deleted or session.info.get("idempotency_wrote")):
+        return
+    bind = session.get_bind()
+    if bind in actual["shards"]:
+        return
+    session.add(ClaveAplicada(clave=actual["clave"], expira_en=datetime.now() + TTL))
+    session.info["idempotency_marking"] = bind
+
+
+@event.listens_for(Session, "after_commit")
+def _applied(session):
+    session.info.pop("idempotency_wrote", None)
+    bind = session.info.pop("idempotency_marking", None)
+    actual = _current.get()
+    if bind is not None and actual is not None:
+        actual["shards"].add(bind)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("idempotency_wrote", None)
+    session.info.pop("idempotency_marking", None)
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        clave = request.headers.get(HEADER)
+        if (
+            not clave
+            or request.method not in MUTATING_METHODS
+            or not request.url.path.startswith(PATH_PREFIXES)
+        ):
+            return await call_next(request)
+
+        if len(clave) > 255:
+            return JSONResponse({"detail": "Idempotency-Key demasiado larga"}, status_code=400)
+
+        body = await request.body()
+        request_hash = _request_hash(request.method, request.url.path, request.url.query, body)
+        estado, registro = await run_in_threadpool(_begin, clave, request_hash)
+
+        if registro is not None and registro.request_hash != request_hash:
+            return JSONResponse(
+                {"detail": "La Idempotency-Key ya se usó con otro request"},
+                status_code=422,
+            )
+        if estado == EN_CURSO:
+            return JSONResponse(
+                {"detail": "Hay un request con esta Idempotency-Key en curso"},
+                status_code=409,
+                headers={"Retry-After": "1"},
+            )
+        if estado == APLICADA:
+            return JSONResponse(
+                {"detail": "El request con esta Idempotency-Key ya se aplicó, pero su respuesta no quedó "
+                           "guardada; consultá el estado actual en vez de reintentar"},
+                status_code=409,
+            )
+        if estado == COMPLETADA:
+            return Response(
+                content=registro.respuesta,
+                status_code=registro.status_code,
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        actual = {"clave": clave, "shards": set()}
+        token = _current.set(actual)
+        latido = asyncio.create_task(_keep_alive(clave))
+        try:
+            response = await call_next(request)
+            content = b"".join([chunk async for chunk in response.body_iterator])
+        except BaseException:
+            await run_in_threadpool(_release, clave, bool(actual["shards"]))
+            raise
+        finally:
+            latido.cancel()
+            _current.reset(token)
+
+        if response.status_code >= 500:
+            # Los errores del servidor no se guardan: el reintento tiene que poder ejecutarse
+            # (salvo que ya haya escrito algo)
+            await run_in_threadpool(_release, clave, bool(actual["shards"]))
+        else:
+            await run_in_threadpool(_complete, clave, response.status_code, content)
+
+        return Response(
+            content=content,
+            status_code=response.status_code,
+            headers=dict(response.headers),
+            media_type=response.media_type,
+        )
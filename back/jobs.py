@@ -0,0 +1,273 @@
+"""
+Cola de trabajos en segundo plano respaldada por la tabla `tareas`.
+
+Los pedidos se encolan en la base (sobreviven a reinicios) y un worker en un
+hilo del proceso los ejecuta. Mientras un trabajo sigue pendiente, los pedidos
+nuevos del mismo tipo y grupo se coalescen sobre él en vez de crear otro.
+
+Cada réplica del backend tiene su worker. El que toma un trabajo lo firma con
+su WORKER_ID y renueva `latido_en` mientras lo ejecuta; un trabajo en curso
+vuelve a la cola solo si su latido venció (la réplica que lo tenía se cayó) o
+si es del mismo WORKER_ID al arrancar (este proceso se reinició), nunca si lo
+está ejecutando otra réplica viva.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from database import engine
+from models import Tarea
+import shards
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADA = "completada"
+ERROR = "error"
+
+RECALCULAR_DEUDAS = "recalcular_deudas"
+
+POLL_INTERVAL_SECONDS = 5
+# Un trabajo en curso sin latido por más que esto se considera abandonado
+LEASE = timedelta(seconds=float(os.getenv("JOBS_LEASE_SECONDS", "60")))
+HEARTBEAT_SECONDS = LEASE.total_seconds() / 3
+# Estable entre reinicios del mismo contenedor (mismo hostname y, como proceso principal, mismo pid)
+WORKER_ID = os.getenv("JOBS_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+logger = logging.getLogger("gestionapp.jobs")
+
+# tipo -> handler(session, grupo_id, on_progress)
+_handlers: Dict[str, Callable] = {}
+# [intervalo_segundos, función, próxima_ejecución] de las tareas periódicas
+_periodic: List[list] = []
+_wakeup = threading.Event()
+_stop = threading.Event()
+_worker: Optional[threading.Thread] = None
+
+
+def register_handler(tipo: str, handler: Callable):
+    """Registra la función que ejecuta los trabajos de un tipo"""
+    _handlers[tipo] = handler
+
+
+def register_periodic(interval_seconds: float, fn: Callable):
+    """Registra una función sin argumentos que el worker corre cada `interval_seconds`"""
+    _periodic.append([interval_seconds, fn, time.monotonic() + interval_seconds])
+
+
+def _run_periodic() -> float:
+    """Corre las tareas periódicas vencidas; devuelve los segundos hasta la próxima"""
+    now = time.monotonic()
+    wait = POLL_INTERVAL_SECONDS
+    for entry in _periodic:
+        interval, fn, next_run = entry
+        if next_run <= now:
+            try:
+                fn()
+            except Exception:
+                logger.exception("Falló la tarea periódica %s", fn.__name__)
+            entry[2] = next_run = now + interval
+        wait = min(wait, next_run - now)
+    return max(wait, 0)
+
+
+def enqueue(session: Session, tipo: str, grupo_id: Optional[int] = None) -> Tarea:
+    """
+    Encola un trabajo, o devuelve el pendiente que ya existe para (tipo, grupo).
+    Hace commit de la sesión.
+    """
+    stmt = select(Tarea).where(
+        (Tarea.tipo == tipo) & (Tarea.grupo_id == grupo_id) & (Tarea.estado == PENDIENTE)
+    )
+    tarea = session.exec(stmt).first()
+    if tarea:
+        tarea.solicitudes += 1
+        session.add(tarea)
+        session.commit()
+        session.refresh(tarea)
+        return tarea
+
+    tarea = Tarea(tipo=tipo, grupo_id=grupo_id)
+    session.add(tarea)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Otro request encoló el mismo trabajo entre el select y el insert
+        session.rollback()
+        return enqueue(session, tipo, grupo_id)
+
+    session.refresh(tarea)
+    _wakeup.set()
+    return tarea
+
+
+def _update(tarea_id: int, **fields):
+    """Actualiza un trabajo tomado por este worker; si otro lo retomó, no lo pisa"""
+    with Session(engine) as session:
+        tarea = session.get(Tarea, tarea_id)
+        if not tarea or tarea.worker_id != WORKER_ID:
+            return
+        for key, value in fields.items():
+            setattr(tarea, key, value)
+        tarea.actualizado_en = datetime.now()
+        session.add(tarea)
+        session.commit()
+
+
+def _claim_next() -> Optional[Tarea]:
+    """Toma el trabajo pendiente más antiguo y lo marca en curso"""
+    with Session(engine) as session:
+        stmt = (
+            select(Tarea)
+            .where(Tarea.estado == PENDIENTE)
+            .order_by(Tarea.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        tarea = session.exec(stmt).first()
+        if not tarea:
+            return None
+        tarea.estado = EN_CURSO
+        tarea.worker_id = WORKER_ID
+        tarea.latido_en = tarea.actualizado_en = datetime.now()
+        session.add(tarea)
+        session.commit()
+        session.refresh(tarea)
+        session.expunge(tarea)
+        return tarea
+
+
+def _run(tarea: Tarea):
+    handler = _handlers.get(tarea.tipo)
+    if handler is None:
+        _update(tarea.id, estado=ERROR, error=f"Tipo de trabajo desconocido: {tarea.tipo}")
+        return
+
+    last = {"progreso": 0}
+
+    def on_progress(done: int, total: int):
+        progreso = int(done * 100 / total) if total else 100
+        # Solo escribir cada 5% para no pisar la base con updates
+        if progreso - last["progreso"] >= 5:
+            last["progreso"] = progreso
+            _update(tarea.id, progreso=progreso)
+
+    stop_heartbeat = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(tarea.id, stop_heartbeat), name=f"jobs-heartbeat-{tarea.id}", daemon=True
+    ).start()
+    try:
+        # Los datos del grupo viven en su shard; la tabla de tareas, en la base global
+        handler_engine = engine if tarea.grupo_id is None else shards.engine_for_group(tarea.grupo_id)
+        with Session(handler_engine) as session:
+            handler(session, tarea.grupo_id, on_progress=on_progress)
+        _update(tarea.id, estado=COMPLETADA, progreso=100)
+    except Exception as e:
+        logger.exception("Falló el trabajo %d", tarea.id, extra={"grupo_id": tarea.grupo_id, "tipo": tarea.tipo})
+        _update(tarea.id, estado=ERROR, error=str(e))
+    finally:
+        stop_heartbeat.set()
+
+
+def _heartbeat(tarea_id: int, stop: threading.Event):
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            _update(tarea_id, latido_en=datetime.now())
+        except Exception:
+            logger.exception("No se pudo renovar el latido del trabajo %d", tarea_id)
+
+
+def run_pending():
+    """Ejecuta todos los trabajos pendientes hasta vaciar la cola"""
+    while not _stop.is_set():
+        tarea = _claim_next()
+        if tarea is None:
+            return
+        _run(tarea)
+
+
+def _requeue_interrupted(own: bool = False):
+    """
+    Vuelven a la cola los trabajos en curso cuyo latido venció y, con `own`
+    (al arrancar), los que había tomado este mismo WORKER_ID antes de reiniciarse.
+    """
+    # Trabajos tomados antes de que existiera el latido: cuenta su última actualización
+    latido = func.coalesce(Tarea.latido_en, Tarea.actualizado_en)
+    abandonada = latido < datetime.now() - LEASE
+    if own:
+        abandonada |= Tarea.worker_id == WORKER_ID
+    with Session(engine) as session:
+        interrumpidas = session.exec(
+            select(Tarea).where((Tarea.estado == EN_CURSO) & abandonada).with_for_update(skip_locked=True)
+        ).all()
+        for tarea in interrumpidas:
+            pendiente = session.exec(
+                select(Tarea).where(
+                    (Tarea.tipo == tarea.tipo)
+                    & (Tarea.grupo_id == tarea.grupo_id)
+                    & (Tarea.estado == PENDIENTE)
+                )
+            ).first()
+            # Si ya hay uno pendiente para el mismo grupo, ese lo cubre
+            logger.warning(
+                "Trabajo interrumpido", extra={"tarea_id": tarea.id, "worker_id": tarea.worker_id, "tipo": tarea.tipo}
+            )
+            tarea.estado = ERROR if pendiente else PENDIENTE
+            tarea.worker_id = None
+            if pendiente:
+                tarea.error = "Interrumpida; cubierta por la tarea %d" % pendiente.id
+            session.add(tarea)
+            session.flush()
+        session.commit()
+
+
+def _recover_own():
+    # Dentro del hilo: si la base no responde al arrancar, el proceso igual empieza a
+    # atender y esto se reintenta; mientras tanto el worker no toma trabajos nuevos
+    espera = 1
+    while not _stop.is_set():
+        try:
+            _requeue_interrupted(own=True)
+            return
+        except Exception:
+            logger.exception("No se pudieron recuperar los trabajos interrumpidos; se reintenta en %ds", espera)
+            _stop.wait(espera)
+            espera = min(espera * 2, 30)
+
+
+def _loop():
+    _recover_own()
+    while not _stop.is_set():
+        try:
+            run_pending()
+        except Exception:
+            logger.exception("Error en el worker de jobs")
+        _wakeup.wait(_run_periodic())
+        _wakeup.clear()
+
+
+def start_worker():
+    global _worker
+    if _worker and _worker.is_alive():
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=_loop, name="jobs-worker", daemon=True)
+    _worker.start()
+
+
+def stop_worker(timeout: float = 10):
+    _stop.set()
+    _wakeup.set()
+    if _worker:
+        _worker.join(timeout)
+
+
+# Los trabajos de réplicas que se cayeron sin volver a arrancar
+register_periodic(LEASE.total_seconds(), _requeue_interrupted)
@@ -0,0 +1,174 @@
+"""
+Libro de movimientos de deudas y saldos de un grupo a una fecha.
+
+Toda escritura de una Deuda hecha a través del ORM (alta, neteo, pago o baja)
+agrega en el mismo flush una fila en `movimientos_deuda` con cuánto cambió lo
+pendiente; las filas nunca se modifican. El worker de jobs guarda cada
+BALANCE_SNAPSHOT_HOURS un snapshot de los saldos de los grupos con movimientos
+nuevos, así el saldo a una fecha sale del snapshot anterior más cercano más
+los movimientos posteriores, sin recorrer toda la historia.
+
+Igual que en balance_cache, las escrituras masivas (UPDATE/DELETE sin pasar
+por objetos) no quedan registradas.
+
+Las deudas que ya existían antes del libro entran con un movimiento de
+apertura que agrega scripts/backfill_ledger.py (una vez, al desplegar).
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import event, func, inspect, union_all
+from sqlmodel import Session, select
+
+from models import Deuda, MovimientoDeuda, SaldoSnapshot
+import jobs
+import shards
+from split_engine import to_cents
+
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("BALANCE_SNAPSHOT_HOURS", "24")) * 3600
+# Un snapshot cubre hasta hace SNAPSHOT_LAG: una transacción abierta puede confirmar
+# después movimientos con fecha anterior, y quedarían afuera del snapshot
+SNAPSHOT_LAG = timedelta(minutes=10)
+
+CREADA = "creada"
+NETEADA = "neteada"
+SALDADA = "saldada"
+ELIMINADA = "eliminada"
+# Saldo inicial de una deuda anterior al libro (scripts/backfill_ledger.py)
+APERTURA = "apertura"
+
+# Sesiones creadas con Session(..., info={SKIP: True}) no registran movimientos
+# (p. ej. al copiar deudas y su historia entre shards)
+SKIP = "ledger_skip"
+
+
+def _pending_cents(monto, estado) -> int:
+    return to_cents(monto) if estado == 0 else 0
+
+
+def _before(obj, attr: str):
+    """Valor del atributo antes de este flush"""
+    history = inspect(obj).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(obj, attr)
+
+
+def _movimiento(deuda: Deuda, tipo: str, delta: int, now: datetime) -> dict:
+    return {
+        "grupo_id": deuda.grupo_id,
+        "deuda_id": deuda.id,
+        "gasto_id": deuda.gasto_id,
+        "deudor_id": deuda.deudor_id,
+        "acreedor_id": deuda.acreedor_id,
+        "tipo": tipo,
+        "delta_centavos": delta,
+        "creado_en": now,
+    }
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_debt_deletes(session, flush_context, instances):
+    # Las bajas se leen antes del DELETE: después una deuda vencida ya no se podría cargar
+    if session.info.get(SKIP):
+        return
+    now = datetime.now()
+    deleted = session.info.setdefault("ledger_deleted", [])
+    for obj in session.deleted:
+        if isinstance(obj, Deuda):
+            before = _pending_cents(_before(obj, "monto"), _before(obj, "estado"))
+            deleted.append(_movimiento(obj, ELIMINADA, -before, now))
+
+
+@event.listens_for(Session, "after_flush")
+def _record_debt_writes(session, flush_context):
+    if session.info.get(SKIP):
+        return
+    now = datetime.now()
+    rows = session.info.pop("ledger_deleted", [])
+    for obj in session.new:
+        if isinstance(obj, Deuda):
+            rows.append(_movimiento(obj, CREADA, _pending_cents(obj.monto, obj.estado), now))
+
+    for obj in session.dirty:
+        if isinstance(obj, Deuda) and session.is_modified(obj):
+            before = _pending_cents(_before(obj, "monto"), _before(obj, "estado"))
+            after = _pending_cents(obj.monto, obj.estado)
+            if before != after:
+                tipo = SALDADA if obj.estado != 0 and _before(obj, "estado") == 0 else NETEADA
+                rows.append(_movimiento(obj, tipo, after - before, now))
+
+    if rows:
+        session.connection().execute(MovimientoDeuda.__table__.insert(), rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("ledger_deleted", None)
+
+
+def balances_as_of(session: Session, grupo_id: int, as_of: datetime) -> Dict[int, int]:
+    """
+    Saldo neto en centavos de cada usuario del grupo a la fecha `as_of`
+    (positivo: le deben). Parte del último snapshot anterior a `as_of`.
+    """
+    hasta = session.exec(
+        select(func.max(SaldoSnapshot.hasta))
+        .where((SaldoSnapshot.grupo_id == grupo_id) & (SaldoSnapshot.hasta <= as_of))
+    ).one()
+
+    movimientos = (MovimientoDeuda.grupo_id == grupo_id) & (MovimientoDeuda.creado_en <= as_of)
+    if hasta is not None:
+        movimientos &= MovimientoDeuda.creado_en > hasta
+
+    parts = [
+        select(MovimientoDeuda.acreedor_id.label("usuario_id"), MovimientoDeuda.delta_centavos.label("saldo"))
+        .where(movimientos),
+        select(MovimientoDeuda.deudor_id.label("usuario_id"), (-MovimientoDeuda.delta_centavos).label("saldo"))
+        .where(movimientos),
+    ]
+    if hasta is not None:
+        parts.append(
+            select(SaldoSnapshot.usuario_id, SaldoSnapshot.saldo_centavos.label("saldo"))
+            .where((SaldoSnapshot.grupo_id == grupo_id) & (SaldoSnapshot.hasta == hasta))
+        )
+
+    signed = union_all(*parts).subquery()
+    stmt = (
+        select(signed.c.usuario_id, func.sum(signed.c.saldo))
+        .group_by(signed.c.usuario_id)
+        .order_by(signed.c.usuario_id)
+    )
+    return {usuario_id: int(saldo) for usuario_id, saldo in session.exec(stmt).all()}
+
+
+def snapshot_group(session: Session, grupo_id: int, hasta: datetime):
+    """Guarda los saldos del grupo a `hasta`; no hace commit"""
+    for usuario_id, saldo in balances_as_of(session, grupo_id, hasta).items():
+        session.add(SaldoSnapshot(grupo_id=grupo_id, usuario_id=usuario_id, hasta=hasta, saldo_centavos=saldo))
+
+
+def take_snapshots():
+    """Snapshot de cada grupo con movimientos posteriores a su último snapshot"""
+    hasta = datetime.now() - SNAPSHOT_LAG
+    for shard_engine in shards.engines:
+        with Session(shard_engine) as session:
+            ultimo = (
+                select(SaldoSnapshot.grupo_id, func.max(SaldoSnapshot.hasta).label("hasta"))
+                .group_by(SaldoSnapshot.grupo_id)
+                .subquery()
+            )
+            pendientes = (
+                select(MovimientoDeuda.grupo_id)
+                .outerjoin(ultimo, ultimo.c.grupo_id == MovimientoDeuda.grupo_id)
+                .where(
+                    (MovimientoDeuda.creado_en <= hasta)
+                    & (ultimo.c.hasta.is_(None) | (MovimientoDeuda.creado_en > ultimo.c.hasta))
+                )
+                .distinct()
+            )
+            for grupo_id in session.exec(pendientes).all():
+                snapshot_group(session, grupo_id, hasta)
+                session.commit()
+
+
+jobs.register_periodic(SNAPSHOT_INTERVAL_SECONDS, take_snapshots)
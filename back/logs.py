@@ -0,0 +1,203 @@
+"""
+Logging estructurado (JSON) sin bloquear los hilos de las requests.
+
+Los hilos que loguean solo encolan el registro (QueueHandler); un único hilo
+(QueueListener) lo formatea y lo escribe. Cada registro sale como una línea
+JSON con el request id, la ruta y el grupo de la request en curso, que
+RequestLogMiddleware guarda en contextvars (AnyIO los copia a los hilos de
+las rutas sincrónicas).
+
+Configuración:
+- LOG_LEVEL: nivel de los logs de la app (INFO por defecto).
+- SQL_LOG_SAMPLE_RATE: fracción de consultas SQL que se loguean con su
+  duración (0 por defecto). Reemplaza a `echo=True`, que escribía cada
+  consulta a stdout desde el hilo de la request.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+SQL_LOG_SAMPLE_RATE = float(os.getenv("SQL_LOG_SAMPLE_RATE", "0"))
+SQL_MAX_LENGTH = 500
+QUEUE_SIZE = 10000
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+route_var = contextvars.ContextVar("route", default=None)
+grupo_id_var = contextvars.ContextVar("grupo_id", default=None)
+
+logger = logging.getLogger("gestionapp")
+sql_logger = logging.getLogger("gestionapp.sql")
+request_logger = logging.getLogger("gestionapp.request")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Atributos estándar de LogRecord: el resto viene de `extra=` y va al JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class _ContextFilter(logging.Filter):
+    """Copia el contexto de la request al registro en el hilo que loguea"""
+
+    def filter(self, record):
+        for name, var in (("request_id", request_id_var), ("route", route_var), ("grupo_id", grupo_id_var)):
+            if not hasattr(record, name):
+                setattr(record, name, var.get())
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # El formateo (y el traceback) se hace en el hilo del listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Con la cola llena se descarta antes que frenar a la request
+            pass
+
+
+def configure(stream=None, level: str = LOG_LEVEL, sql_sample_rate: float = SQL_LOG_SAMPLE_RATE):
+    """Instala el pipeline en el logger raíz; se puede llamar más de una vez"""
+    global _listener, SQL_LOG_SAMPLE_RATE
+    shutdown()
+    SQL_LOG_SAMPLE_RATE = sql_sample_rate
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(QUEUE_SIZE)
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, _NonBlockingQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(logging.WARNING)
+    logger.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown():
+    """Vacía la cola y detiene el hilo escritor"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _sample_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and SQL_LOG_SAMPLE_RATE > 0 and random.random() < SQL_LOG_SAMPLE_RATE:
+        context._sql_log_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _log_sampled_sql(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_sql_log_started", None)
+    if started is not None:
+        sql_logger.info(
+            "sql",
+            extra={
+                "sql": statement[:SQL_MAX_LENGTH],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                "executemany": executemany,
+            },
+        )
+
+
+_GROUP_PATH = re.compile(r"^/groups/(\d+)")
+
+
+def _grupo_id(scope) -> Optional[int]:
+    params = scope.get("path_params") or {}
+    value = params.get("group_id") or params.get("grupo_id")
+    if value is None:
+        match = _GROUP_PATH.match(scope["path"])
+        value = match.group(1) if match else None
+    if value is None:
+        for part in scope.get("query_string", b"").decode("latin-1").split("&"):
+            key, _, raw = part.partition("=")
+            if key == "grupo_id":
+                value = raw
+                break
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RequestLogMiddleware:
+    """Middleware ASGI: asigna el request id y loguea cada request con su duración"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        tokens = [request_id_var.set(request_id), route_var.set(scope["path"]), grupo_id_var.set(_grupo_id(scope))]
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # El router deja la ruta resuelta y sus parámetros en el scope
+            route = scope.get("route")
+            request_logger.info(
+                "request",
+                extra={
+                    "method": scope["method"],
+                    "route": getattr(route, "path", scope["path"]),
+                    "grupo_id": _grupo_id(scope),
+                    "status": status["code"],
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                },
+            )
+            for var, token in zip((request_id_var, route_var, grupo_id_var), tokens):
+                var.reset(token)
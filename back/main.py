@@ -1,28 +1,120 @@
 # main.py
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from routers import users, expenses, auth, groups
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:5173",
-        "http://127.0.0.1:5173",
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-)
-
-app.include_router(users.router)
-app.include_router(expenses.router)
-app.include_router(auth.router)
-app.include_router(groups.router)
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from routers import users, expenses, auth, groups, receipts, recurring, jobs as jobs_router
+import admission
+import capture
+import db_pool
+import idempotency
+import jobs
+import logs
+import shards
+import storage
+import warmup
+
+logger = logging.getLogger("gestionapp.main")
+
+
+WARMUP_RETRY_MAX_SECONDS = 30
+
+
+async def _warm_up(app: FastAPI):
+    """Precalienta una vez, en segundo plano; si falla (p. ej. la base no está) reintenta con espera creciente"""
+    delay = 1
+    while not app.state.shutting_down:
+        try:
+            app.state.warmup_seconds = await warmup.run(app)
+        except Exception:
+            logger.exception("Falló el precalentamiento; se reintenta en %s s", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+        else:
+            app.state.ready = True
+            return
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    logs.configure()
+    admission.configure_threadpool()
+    storage.start()
+    warming_up = asyncio.create_task(_warm_up(app))
+    jobs.start_worker()
+    app.state.startup_seconds = time.perf_counter() - started
+    yield
+    # Dejar de recibir tráfico del balanceador antes de cerrar
+    app.state.ready = False
+    app.state.shutting_down = True
+    warming_up.cancel()
+    jobs.stop_worker()
+    storage.shutdown()
+    capture.shutdown()
+    logs.shutdown()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.state.ready = False
+    app.state.shutting_down = False
+    app.state.warmup_seconds = None
+    app.state.startup_seconds = None
+
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    # Antes que idempotencia: lo que se rechaza por carga no llega a tocar la base
+    app.state.admission = admission.AdmissionController()
+    app.add_middleware(admission.AdmissionMiddleware, controller=app.state.admission)
+    # Envuelve todo lo anterior para que el log de cada request incluya también los 503 por carga
+    app.add_middleware(logs.RequestLogMiddleware)
+    if capture.CAPTURE_FILE:
+        # Por fuera de admisión: la captura incluye los 503 por carga, como el log
+        app.add_middleware(capture.TrafficCaptureMiddleware, path=capture.CAPTURE_FILE)
+    # CORS queda por fuera para que también las respuestas repetidas lleven sus headers
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:5173",
+            "http://127.0.0.1:5173",
+            "http://localhost:3000",
+            "http://127.0.0.1:3000",
+        ],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["*"],
+    )
+
+    app.include_router(users.router)
+    app.include_router(expenses.router)
+    app.include_router(auth.router)
+    app.include_router(groups.router)
+    app.include_router(jobs_router.router)
+    app.include_router(receipts.router)
+    app.include_router(recurring.router)
+
+    @app.get("/ready", tags=["health"])
+    async def ready(request: Request):
+        """Readiness: 200 solo después del precalentamiento (que corre solo, ver _warm_up)"""
+        state = request.app.state
+        body = {
+            "ready": state.ready,
+            "startup_seconds": state.startup_seconds,
+            "warmup_seconds": state.warmup_seconds,
+            "admission": state.admission.stats(),
+            "pools": [db_pool.stats(shard_engine) for shard_engine in shards.engines],
+        }
+        return JSONResponse(body, status_code=200 if state.ready else 503)
+
+    return app
+
+
+app = create_app()
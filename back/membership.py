@@ -0,0 +1,141 @@
+"""
+Cache en proceso (LRU) de los miembros de cada grupo.
+
+Los miembros casi nunca cambian y se leen en cada alta o edición de gasto,
+así que se guardan por grupo junto con la versión de membresía del grupo
+(`grupos.version_miembros`, en el shard del grupo). Para usar una entrada
+alcanza con leer la versión (una fila por clave primaria) y compararla: si
+coincide, no se consulta usuario_grupos ni usuarios.
+
+Toda alta, baja o cambio de un UsuarioGrupo o de un Grupo hecho a través del
+ORM incrementa la versión del grupo en el mismo flush, así que las demás
+réplicas del backend ven el cambio en cuanto se confirma. Las escrituras
+masivas (UPDATE/DELETE sin objetos) tienen que llamar a `bump` a mano.
+
+Junto con los ids se guardan el nombre y el mail de cada miembro, para
+mostrarlos sin ir a usuarios. Por eso un cambio de nombre o mail de un Usuario
+hecho a través del ORM (incluida la copia que `shards.replicate` deja en cada
+shard) también sube la versión de todos sus grupos en ese flush.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, update
+from sqlmodel import Session, select
+
+from models import Grupo, Usuario, UsuarioGrupo
+
+MAX_ENTRIES = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "5000"))
+# Campos de Usuario que guarda el cache
+USER_FIELDS = ("nombre", "mail")
+
+
+@dataclass(frozen=True)
+class Miembros:
+    version: int
+    ids: Tuple[int, ...]  # ordenados
+    detalles: Tuple[Dict, ...]  # id, nombre y mail de cada miembro, en el mismo orden
+
+
+_entries: "OrderedDict[int, Miembros]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version(session: Session, grupo_id: int) -> Optional[int]:
+    return session.exec(select(Grupo.version_miembros).where(Grupo.id == grupo_id)).first()
+
+
+def _load(session: Session, grupo_id: int, version: int) -> Miembros:
+    rows = session.exec(
+        select(Usuario.id, Usuario.nombre, Usuario.mail)
+        .join(UsuarioGrupo, Usuario.id == UsuarioGrupo.usuario_id)
+        .where(UsuarioGrupo.grupo_id == grupo_id)
+        .order_by(Usuario.id)
+    ).all()
+    return Miembros(
+        version=version,
+        ids=tuple(row[0] for row in rows),
+        detalles=tuple({"id": row[0], "nombre": row[1], "mail": row[2]} for row in rows),
+    )
+
+
+def get(session: Session, grupo_id: int) -> Optional[Miembros]:
+    """Miembros del grupo, o None si el grupo no existe en el shard de la sesión"""
+    version = _version(session, grupo_id)
+    if version is None:
+        return None
+
+    with _lock:
+        cached = _entries.get(grupo_id)
+        if cached is not None and cached.version == version:
+            _entries.move_to_end(grupo_id)
+            return cached
+
+    miembros = _load(session, grupo_id, version)
+    with _lock:
+        _entries[grupo_id] = miembros
+        _entries.move_to_end(grupo_id)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return miembros
+
+
+def member_ids(session: Session, grupo_id: int) -> List[int]:
+    miembros = get(session, grupo_id)
+    return list(miembros.ids) if miembros else []
+
+
+def bump(session: Session, *grupo_ids: int):
+    """Incrementa la versión de membresía de los grupos dentro de la transacción de la sesión"""
+    if grupo_ids:
+        session.connection().execute(
+            update(Grupo)
+            .where(Grupo.id.in_(sorted(set(grupo_ids))))
+            .values(version_miembros=Grupo.version_miembros + 1)
+        )
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def _user_fields_changed(session: Session, obj: Usuario) -> bool:
+    if obj in session.deleted:
+        return True
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in USER_FIELDS)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_membership_writes(session, flush_context, instances):
+    touched = session.info.setdefault("membership_groups", set())
+    usuarios = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, UsuarioGrupo) and obj.grupo_id is not None:
+            touched.add(obj.grupo_id)
+        elif isinstance(obj, Grupo) and obj.id is not None and obj not in session.new:
+            touched.add(obj.id)
+        elif isinstance(obj, Usuario) and obj.id is not None and obj not in session.new and _user_fields_changed(session, obj):
+            usuarios.add(obj.id)
+    if usuarios:
+        # Sus grupos en esta base (en un shard, los del shard)
+        with session.no_autoflush:
+            touched.update(session.exec(
+                select(UsuarioGrupo.grupo_id).where(UsuarioGrupo.usuario_id.in_(sorted(usuarios)))
+            ).all())
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_versions(session, flush_context):
+    touched = session.info.pop("membership_groups", None)
+    if touched:
+        bump(session, *touched)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("membership_groups", None)
@@ -1,7 +1,12 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, text
 from typing import Optional, List
 from datetime import date, datetime
 
+# Tablas que viven en los shards: con AUTOINCREMENT, SQLite respeta el rango de ids
+# asignado a cada shard (ver scripts/manage_shards.py)
+SHARDED_TABLE_ARGS = {"sqlite_autoincrement": True}
+
 
 class Usuario(SQLModel, table=True):
     __tablename__ = "usuarios"
@@ -24,6 +29,8 @@ class Grupo(SQLModel, table=True):
     nombre: str = Field(max_length=255)
     direccion: Optional[str] = None
     descripcion: Optional[str] = None
+    shard: int = Field(default=0)  # base donde viven gastos, deudas y miembros del grupo (ver shards.py)
+    version_miembros: int = Field(default=0)  # sube con cada cambio de miembros (ver membership.py)
     creado_en: Optional[datetime] = Field(default_factory=datetime.now)
     actualizado_en: Optional[datetime] = Field(default_factory=datetime.now)
 
@@ -33,6 +40,11 @@ class Grupo(SQLModel, table=True):
 
 class Gasto(SQLModel, table=True):
     __tablename__ = "gastos"
+    __table_args__ = (
+        # Una sola ocurrencia por plantilla y fecha, aunque corran varios schedulers
+        Index("uq_gastos_recurrente_fecha", "recurrente_id", "fecha", unique=True),
+        SHARDED_TABLE_ARGS,
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     titulo: str = Field(max_length=255)
@@ -43,6 +55,8 @@ class Gasto(SQLModel, table=True):
     usuario_id: int = Field(foreign_key="usuarios.id", index=True)
     grupo_id: Optional[int] = Field(foreign_key="grupos.id", index=True)
     comprobante: Optional[str] = Field(default=None, max_length=500)
+    reparto: Optional[str] = None  # JSON de la estrategia de reparto (ver split_engine.py); None = partes iguales
+    recurrente_id: Optional[int] = Field(default=None, foreign_key="gastos_recurrentes.id")
     creado_en: Optional[datetime] = Field(default_factory=datetime.now)
     actualizado_en: Optional[datetime] = Field(default_factory=datetime.now)
 
@@ -50,8 +64,33 @@ class Gasto(SQLModel, table=True):
     usuario: Optional[Usuario] = Relationship(back_populates="gastos")
     grupo: Optional["Grupo"] = Relationship()
 
+class GastoRecurrente(SQLModel, table=True):
+    """Plantilla de un gasto que se repite (ver recurring.py)"""
+    __tablename__ = "gastos_recurrentes"
+    __table_args__ = SHARDED_TABLE_ARGS
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    grupo_id: int = Field(foreign_key="grupos.id", index=True)
+    usuario_id: int = Field(foreign_key="usuarios.id")
+    titulo: str = Field(max_length=255)
+    descripcion: Optional[str] = None
+    valor: float
+    autor: str = Field(max_length=100)
+    reparto: Optional[str] = None
+    frecuencia: str = Field(max_length=10)  # semanal, mensual
+    intervalo: int = Field(default=1)  # cada cuántas semanas o meses
+    fecha_inicio: date
+    fecha_fin: Optional[date] = None
+    proxima_fecha: date = Field(index=True)  # próxima ocurrencia sin crear
+    activo: bool = Field(default=True)
+    error: Optional[str] = None  # por qué se desactivó sola (reparto que ya no se puede aplicar)
+    creado_en: Optional[datetime] = Field(default_factory=datetime.now)
+    actualizado_en: Optional[datetime] = Field(default_factory=datetime.now)
+
+
 class Deuda(SQLModel, table=True):
     __tablename__ = "deudas"
+    __table_args__ = SHARDED_TABLE_ARGS
 
     id: Optional[int] = Field(default=None, primary_key=True)
     gasto_id: int = Field(foreign_key="gastos.id", index=True)
@@ -73,6 +112,21 @@ class Deuda(SQLModel, table=True):
     grupo: Optional["Grupo"] = Relationship()
 
 
+class DeudaGasto(SQLModel, table=True):
+    """
+    Parte de una deuda consolidada que corresponde a cada gasto (ver compaction.py).
+    Solo existen filas para las deudas consolidadas; el resto sigue usando Deuda.gasto_id.
+    """
+    __tablename__ = "deuda_gastos"
+    __table_args__ = SHARDED_TABLE_ARGS
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    deuda_id: int = Field(foreign_key="deudas.id", index=True)
+    gasto_id: int = Field(foreign_key="gastos.id", index=True)
+    grupo_id: int = Field(foreign_key="grupos.id", index=True)
+    monto: float
+
+
 # DTOs for API endpoints
 class UsuarioCreate(SQLModel):
     nombre: str
@@ -103,6 +157,7 @@ class GastoCreate(SQLModel):
     usuario_id: int
     grupo_id: int
     comprobante: Optional[str] = None
+    reparto: Optional[dict] = None
 
 
 class GastoUpdate(SQLModel):
@@ -112,6 +167,7 @@ class GastoUpdate(SQLModel):
     fecha: Optional[date] = None
     autor: Optional[str] = None
     comprobante: Optional[str] = None
+    reparto: Optional[dict] = None
 
 
 class GastoPublic(SQLModel):
@@ -123,8 +179,40 @@ class GastoPublic(SQLModel):
     autor: str
     usuario_id: int
     comprobante: Optional[str]
+    reparto: Optional[str] = None
     creado_en: datetime
 
+class GastoRecurrenteCreate(SQLModel):
+    grupo_id: int
+    usuario_id: int
+    titulo: str
+    descripcion: Optional[str] = None
+    valor: float
+    autor: str
+    reparto: Optional[dict] = None
+    frecuencia: str
+    intervalo: int = 1
+    fecha_inicio: date
+    fecha_fin: Optional[date] = None
+
+
+class GastoRecurrentePublic(SQLModel):
+    id: int
+    grupo_id: int
+    usuario_id: int
+    titulo: str
+    descripcion: Optional[str]
+    valor: float
+    autor: str
+    reparto: Optional[str]
+    frecuencia: str
+    intervalo: int
+    fecha_inicio: date
+    fecha_fin: Optional[date]
+    proxima_fecha: date
+    activo: bool
+    error: Optional[str] = None
+
 class GrupoCreate(SQLModel):
     name: str
     email: str
@@ -145,6 +233,7 @@ class GrupoPublic(SQLModel):
 
 class UsuarioGrupo(SQLModel, table=True):
     __tablename__ = "usuario_grupos"
+    __table_args__ = SHARDED_TABLE_ARGS
 
     id: Optional[int] = Field(default=None, primary_key=True)
     usuario_id: int = Field(foreign_key="usuarios.id", index=True)
@@ -154,3 +243,114 @@ class UsuarioGrupo(SQLModel, table=True):
     # Relationships
     usuario: Optional["Usuario"] = Relationship()
     grupo: Optional["Grupo"] = Relationship()
+
+
+class Tarea(SQLModel, table=True):
+    """Trabajo en segundo plano (p. ej. recálculo de deudas de un grupo)"""
+    __tablename__ = "tareas"
+    __table_args__ = (
+        # Un solo trabajo pendiente por (tipo, grupo): los pedidos repetidos se coalescen
+        Index(
+            "uq_tareas_pendiente",
+            "tipo", "grupo_id",
+            unique=True,
+            postgresql_where=text("estado = 'pendiente'"),
+            sqlite_where=text("estado = 'pendiente'"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tipo: str = Field(max_length=50)
+    grupo_id: Optional[int] = Field(default=None, foreign_key="grupos.id", index=True)
+    estado: str = Field(default="pendiente", max_length=20, index=True)  # pendiente, en_curso, completada, error
+    progreso: int = Field(default=0)  # 0 - 100
+    error: Optional[str] = None
+    solicitudes: int = Field(default=1)  # cantidad de pedidos coalescidos en este trabajo
+    worker_id: Optional[str] = Field(default=None, max_length=255)  # worker que lo tomó (ver jobs.py)
+    latido_en: Optional[datetime] = None  # lo renueva el worker mientras lo ejecuta
+    creado_en: Optional[datetime] = Field(default_factory=datetime.now)
+    actualizado_en: Optional[datetime] = Field(default_factory=datetime.now)
+
+
+class MovimientoDeuda(SQLModel, table=True):
+    """
+    Evento del libro de deudas (solo se agregan filas, nunca se modifican).
+    `delta_centavos` es cuánto cambió lo pendiente de la deuda: sumando los
+    movimientos hasta una fecha se obtienen los saldos a esa fecha.
+    """
+    __tablename__ = "movimientos_deuda"
+    __table_args__ = (
+        Index("ix_movimientos_deuda_grupo_creado", "grupo_id", "creado_en"),
+        SHARDED_TABLE_ARGS,
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    grupo_id: int = Field(foreign_key="grupos.id")
+    deuda_id: int  # sin FK: la deuda puede haberse borrado
+    gasto_id: Optional[int] = None
+    deudor_id: int
+    acreedor_id: int
+    tipo: str = Field(max_length=20)  # creada, neteada, saldada, eliminada
+    delta_centavos: int
+    creado_en: datetime = Field(default_factory=datetime.now)
+
+
+class Cambio(SQLModel, table=True):
+    """
+    Entrada del registro de cambios de un grupo (ver changes.py). `seq` es
+    correlativo por grupo y sirve de cursor para la sincronización incremental.
+    """
+    __tablename__ = "cambios"
+    __table_args__ = (
+        Index("uq_cambios_grupo_seq", "grupo_id", "seq", unique=True),
+        SHARDED_TABLE_ARGS,
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    grupo_id: int = Field(foreign_key="grupos.id")
+    seq: int
+    entidad: str = Field(max_length=20)  # gasto, deuda, miembro
+    entidad_id: int
+    operacion: str = Field(max_length=10)  # upsert, delete
+    creado_en: datetime = Field(default_factory=datetime.now, index=True)
+
+
+class SaldoSnapshot(SQLModel, table=True):
+    """Saldo neto de cada usuario de un grupo con los movimientos hasta `hasta`"""
+    __tablename__ = "saldos_snapshot"
+    __table_args__ = (
+        Index("ix_saldos_snapshot_grupo_hasta", "grupo_id", "hasta"),
+        SHARDED_TABLE_ARGS,
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    grupo_id: int = Field(foreign_key="grupos.id")
+    usuario_id: int
+    hasta: datetime
+    saldo_centavos: int  # positivo: le deben; negativo: debe
+
+
+class ClaveIdempotencia(SQLModel, table=True):
+    """Respuesta guardada de un request con header Idempotency-Key"""
+    __tablename__ = "claves_idempotencia"
+
+    clave: str = Field(primary_key=True, max_length=255)
+    request_hash: str = Field(max_length=64)
+    estado: str = Field(default="en_curso", max_length=20)  # en_curso, completada, aplicada
+    status_code: Optional[int] = None
+    respuesta: Optional[str] = None
+    creado_en: Optional[datetime] = Field(default_factory=datetime.now)
+    latido_en: Optional[datetime] = Field(default_factory=datetime.now)  # lo renueva el request en curso
+    expira_en: datetime = Field(index=True)
+
+
+class ClaveAplicada(SQLModel, table=True):
+    """
+    Marca de que el request de una Idempotency-Key ya escribió en este shard;
+    se inserta en la misma transacción que la escritura (ver idempotency.py).
+    """
+    __tablename__ = "claves_aplicadas"
+
+    clave: str = Field(primary_key=True, max_length=255)
+    creado_en: Optional[datetime] = Field(default_factory=datetime.now)
+    expira_en: datetime = Field(index=True)
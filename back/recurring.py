@@ -0,0 +1,174 @@
+"""
+Gastos recurrentes: plantillas por grupo (alquiler, servicios) que el worker
+de jobs convierte en gastos cuando vencen.
+
+Cada RECURRING_INTERVAL_MINUTES se recorren los grupos con plantillas vencidas
+de cada shard; por grupo, en una transacción, se insertan en lote todas las
+ocurrencias pendientes hasta hoy (si el proceso estuvo caído, se ponen al día)
+con sus deudas, neteadas como las de cualquier gasto (debts.py), y se avanza
+`proxima_fecha`. Una plantilla cuyo reparto ya no se puede aplicar (p. ej.
+montos fijos que no suman el valor) se desactiva con el motivo en `error`, y
+las demás del grupo se crean igual.
+
+Varios workers pueden correrlo a la vez: cada grupo se toma con el lock del
+grupo sin esperar (si otro lo tiene, lo saltea), y el índice único
+(recurrente_id, fecha) de gastos impide duplicar una ocurrencia aunque algo
+falle entre medio.
+"""
+import calendar
+import logging
+import os
+from datetime import date, timedelta
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from database import try_lock_group
+from debts import net_or_create_debt
+from models import Gasto, GastoRecurrente
+import jobs
+import membership
+import shards
+import split_engine
+from split_engine import from_cents, to_cents
+
+RECURRING_INTERVAL_SECONDS = float(os.getenv("RECURRING_INTERVAL_MINUTES", "60")) * 60
+# Tope de ocurrencias por plantilla en una pasada (p. ej. semanal tras años sin correr)
+MAX_OCCURRENCES_PER_RUN = 400
+
+SEMANAL = "semanal"
+MENSUAL = "mensual"
+FRECUENCIAS = (SEMANAL, MENSUAL)
+
+logger = logging.getLogger("gestionapp.recurring")
+
+
+def next_date(plantilla: GastoRecurrente, current: date) -> date:
+    """Fecha de la ocurrencia siguiente a `current`"""
+    if plantilla.frecuencia == SEMANAL:
+        return current + timedelta(weeks=plantilla.intervalo)
+    # Mensual: siempre el día de fecha_inicio, o el último del mes si no existe (31 -> 30, 28)
+    month_index = current.year * 12 + current.month - 1 + plantilla.intervalo
+    year, month = divmod(month_index, 12)
+    day = min(plantilla.fecha_inicio.day, calendar.monthrange(year, month + 1)[1])
+    return date(year, month + 1, day)
+
+
+def due_dates(plantilla: GastoRecurrente, today: date) -> List[date]:
+    """Ocurrencias vencidas de la plantilla, desde proxima_fecha hasta hoy"""
+    fechas = []
+    current = plantilla.proxima_fecha
+    while (
+        current <= today
+        and (plantilla.fecha_fin is None or current <= plantilla.fecha_fin)
+        and len(fechas) < MAX_OCCURRENCES_PER_RUN
+    ):
+        fechas.append(current)
+        current = next_date(plantilla, current)
+    return fechas
+
+
+def materialize_group(session: Session, grupo_id: int, today: Optional[date] = None) -> int:
+    """
+    Crea las ocurrencias vencidas de las plantillas del grupo, con sus deudas,
+    en una transacción. Devuelve cuántos gastos creó (0 si otro worker tiene el grupo).
+    """
+    today = today or date.today()
+    if not try_lock_group(session, grupo_id):
+        session.rollback()
+        return 0
+
+    plantillas = session.exec(
+        select(GastoRecurrente).where(
+            (GastoRecurrente.grupo_id == grupo_id)
+            & GastoRecurrente.activo.is_(True)
+            & (GastoRecurrente.proxima_fecha <= today)
+        )
+    ).all()
+    members = membership.member_ids(session, grupo_id)  # ordenados
+    creados = 0
+    for plantilla in plantillas:
+        fechas = due_dates(plantilla, today)
+        matrix = None
+        if len(members) > 1 and fechas:
+            try:
+                # Mismo monto y reparto en todas las ocurrencias: una sola pasada para todas
+                matrix = split_engine.split_many(
+                    [to_cents(plantilla.valor)] * len(fechas),
+                    members,
+                    split_engine.parse(plantilla.reparto),
+                ).tolist()
+            except ValueError as e:
+                logger.warning(
+                    "Plantilla recurrente desactivada: su reparto ya no se puede aplicar",
+                    extra={"grupo_id": grupo_id, "recurrente_id": plantilla.id, "error": str(e)},
+                )
+                plantilla.activo = False
+                plantilla.error = str(e)
+                session.add(plantilla)
+                continue
+
+        gastos = [
+            Gasto(
+                titulo=plantilla.titulo,
+                descripcion=plantilla.descripcion,
+                valor=plantilla.valor,
+                fecha=fecha,
+                autor=plantilla.autor,
+                usuario_id=plantilla.usuario_id,
+                grupo_id=grupo_id,
+                reparto=plantilla.reparto,
+                recurrente_id=plantilla.id,
+            )
+            for fecha in fechas
+        ]
+        session.add_all(gastos)
+        session.flush()
+
+        for gasto, row in zip(gastos, matrix or []):
+            for member_id, cents in zip(members, row):
+                if member_id != plantilla.usuario_id:
+                    net_or_create_debt(
+                        session=session,
+                        grupo_id=grupo_id,
+                        deudor_id=member_id,
+                        acreedor_id=plantilla.usuario_id,
+                        monto=from_cents(cents),
+                        gasto_id=gasto.id,
+                    )
+
+        if fechas:
+            plantilla.proxima_fecha = next_date(plantilla, fechas[-1])
+        if plantilla.fecha_fin is not None and plantilla.proxima_fecha > plantilla.fecha_fin:
+            plantilla.activo = False
+        session.add(plantilla)
+        creados += len(gastos)
+
+    session.commit()
+    return creados
+
+
+def materialize_due(today: Optional[date] = None):
+    """Materializa las plantillas vencidas de todos los grupos, un grupo por transacción"""
+    today = today or date.today()
+    for shard_engine in shards.engines:
+        with Session(shard_engine) as session:
+            grupo_ids = session.exec(
+                select(GastoRecurrente.grupo_id)
+                .where(GastoRecurrente.activo.is_(True) & (GastoRecurrente.proxima_fecha <= today))
+                .distinct()
+            ).all()
+            for grupo_id in grupo_ids:
+                try:
+                    creados = materialize_group(session, grupo_id, today)
+                except IntegrityError:
+                    # Ocurrencia ya creada por otro worker
+                    session.rollback()
+                    logger.exception("No se pudieron crear los gastos recurrentes", extra={"grupo_id": grupo_id})
+                    continue
+                if creados:
+                    logger.info("Gastos recurrentes creados", extra={"grupo_id": grupo_id, "creados": creados})
+
+
+jobs.register_periodic(RECURRING_INTERVAL_SECONDS, materialize_due)
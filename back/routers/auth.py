@@ -4,6 +4,7 @@ from sqlmodel import Session, select
 
 from models import Usuario, UsuarioCreate, UsuarioLogin, UsuarioPublic
 from database import get_session
+import shards
 from auth_utils import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(
@@ -30,6 +31,8 @@ def register(user: UsuarioCreate, session: Session = Depends(get_session)):
         session.add(db_user)
         session.commit()
         session.refresh(db_user)
+        # Copia de referencia en cada shard para los joins con gastos y deudas
+        shards.replicate(db_user)
 
         return db_user
     except Exception as e:
@@ -1,151 +1,140 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Response
 from sqlmodel import Session, select
+from sqlalchemy import and_, exists, or_
 from sqlalchemy.orm import aliased
 from typing import List, Optional
 from datetime import date
-from decimal import Decimal, ROUND_HALF_UP
-
-from database import get_session
-from models import Deuda, Gasto, GastoCreate, GastoUpdate, GastoPublic, Usuario, UsuarioGrupo
+from decimal import Decimal
+import json
+
+from database import lock_group
+from debts import net_or_create_debt
+import compaction
+import membership
+import shards
+import split_engine
+from batch_utils import parse_ids
+from models import Deuda, DeudaGasto, Gasto, GastoCreate, GastoUpdate, GastoPublic, Usuario
+from split_engine import from_cents, to_cents
 
 router = APIRouter(prefix="/expenses", tags=["expenses"])
 
 
-def _to_cents(x) -> int:
-    d = x if isinstance(x, Decimal) else Decimal(str(x))
-    return int((d * Decimal("100")).to_integral_value(rounding=ROUND_HALF_UP))
-
-
-def _from_cents(c: int) -> Decimal:
-    return (Decimal(c) / Decimal("100")).quantize(Decimal("0.01"))
-
-
-def _net_or_create_debt(
-    *,
-    session: Session,
-    grupo_id: int,
-    deudor_id: int,
-    acreedor_id: int,
-    monto: Decimal,
-    gasto_id: Optional[int] = None,
-):
-    if monto <= 0:
-        return
-
-    stmt_opuesta = select(Deuda).where(
-        (Deuda.grupo_id == grupo_id)
-        & (Deuda.deudor_id == acreedor_id)
-        & (Deuda.acreedor_id == deudor_id)
-        & (Deuda.estado == 0)
-    )
-    opuesta = session.exec(stmt_opuesta).first()
-
-    new_c = _to_cents(monto)
-
-    if opuesta:
-        opp_c = _to_cents(opuesta.monto)
-
-        if opp_c > new_c:
-            opuesta.monto = _from_cents(opp_c - new_c)
-            session.add(opuesta)
-            return
-        elif opp_c < new_c:
-            session.delete(opuesta)
-            remain = new_c - opp_c
-            if remain > 0:
-                session.add(Deuda(
-                    gasto_id=gasto_id,
-                    deudor_id=deudor_id,
-                    acreedor_id=acreedor_id,
-                    grupo_id=grupo_id,
-                    monto=_from_cents(remain),
-                    estado=0
-                ))
-            return
-        else:
-            session.delete(opuesta)
-            return
-
-    session.add(Deuda(
-        gasto_id=gasto_id,
-        deudor_id=deudor_id,
-        acreedor_id=acreedor_id,
-        grupo_id=grupo_id,
-        monto=monto,
-        estado=0
-    ))
+@router.post("/", response_model=GastoPublic)
+def create_expense(expense: GastoCreate):
+    with shards.group_session(expense.grupo_id) as session:
+        return _create_expense(session, expense)
 
 
-@router.post("/", response_model=GastoPublic)
-def create_expense(expense: GastoCreate, session: Session = Depends(get_session)):
+def _create_expense(session: Session, expense: GastoCreate):
     try:
-        db_expense = Gasto(**expense.model_dump())
-        session.add(db_expense)
-        session.commit()
-        session.refresh(db_expense)
+        # El neteo lee y reescribe deudas pendientes del grupo: una escritura por grupo a la vez
+        lock_group(session, expense.grupo_id)
 
-        statement = select(Usuario).join(UsuarioGrupo).where(
-            UsuarioGrupo.grupo_id == expense.grupo_id
+        db_expense = Gasto(
+            **expense.model_dump(exclude={"reparto"}),
+            reparto=json.dumps(expense.reparto) if expense.reparto else None,
         )
-        group_members = session.exec(statement).all()
-
-        total_members = len(group_members)
-        if total_members > 1:
-            amount_cents = _to_cents(expense.valor)
-            base = amount_cents // total_members
-            remainder = amount_cents % total_members
-
-            members_sorted = sorted(group_members, key=lambda u: u.id)
-            shares = {}
-            for idx, m in enumerate(members_sorted):
-                cents = base + (1 if idx < remainder else 0)
-                shares[m.id] = _from_cents(cents)
-
-            for member in group_members:
-                if member.id != expense.usuario_id:
-                    _net_or_create_debt(
+        session.add(db_expense)
+        session.flush()
+
+        member_ids = membership.member_ids(session, expense.grupo_id)
+
+        if len(member_ids) > 1:
+            shares = split_engine.split_one(
+                to_cents(expense.valor), member_ids, split_engine.from_spec(expense.reparto)
+            )
+            for member_id, cents in shares.items():
+                if member_id != expense.usuario_id:
+                    net_or_create_debt(
                         session=session,
                         grupo_id=expense.grupo_id,
-                        deudor_id=member.id,
+                        deudor_id=member_id,
                         acreedor_id=expense.usuario_id,
-                        monto=shares[member.id],
+                        monto=from_cents(cents),
                         gasto_id=db_expense.id,
                     )
 
-            session.commit()
-
+        session.commit()
+        session.refresh(db_expense)
         return db_expense
+    except ValueError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        session.rollback()
         raise HTTPException(status_code=500, detail=f"Error al crear el gasto - {e}")
 
 
+PAGE_SIZE = 50
+
+
+def _parse_cursor(cursor: str):
+    try:
+        fecha_str, id_str = cursor.split("_", 1)
+        return date.fromisoformat(fecha_str), int(id_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
 @router.get("/", response_model=List[GastoPublic])
 def list_expenses(
+    response: Response,
     grupo_id: int = Query(..., description="ID del grupo"),
     usuario_id: int = Query(..., description="ID del usuario"),
-    session: Session = Depends(get_session)
+    pending_only: bool = Query(False, description="Solo gastos con deudas pendientes del usuario"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description=f"Tamaño de página ({PAGE_SIZE} si solo viene cursor)"),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    session: Session = Depends(shards.get_group_session)
 ):
-    stmt_autor = select(Gasto).where(
-        (Gasto.grupo_id == grupo_id) & (Gasto.usuario_id == usuario_id)
+    """
+    Gastos del grupo en los que participa el usuario (como autor o deudor), del más
+    reciente al más viejo. Sin limit ni cursor devuelve todos, como siempre; con
+    alguno de los dos pagina y, si hay más resultados, el header X-Next-Cursor
+    trae el cursor para pedir la página siguiente.
+    """
+    # Deudas del gasto: las propias y las consolidadas que tienen una parte suya
+    of_expense = or_(
+        Deuda.gasto_id == Gasto.id,
+        exists().where((DeudaGasto.deuda_id == Deuda.id) & (DeudaGasto.gasto_id == Gasto.id)),
     )
+    if pending_only:
+        involved = exists().where(
+            of_expense
+            & (Deuda.estado == 0)
+            & ((Deuda.deudor_id == usuario_id) | (Deuda.acreedor_id == usuario_id))
+        )
+    else:
+        involved = or_(
+            Gasto.usuario_id == usuario_id,
+            exists().where(of_expense & (Deuda.deudor_id == usuario_id)),
+        )
 
-    stmt_deudas = select(Gasto).join(Deuda).where(
-        (Deuda.deudor_id == usuario_id) & (Deuda.grupo_id == grupo_id)
-    )
+    stmt = select(Gasto).where((Gasto.grupo_id == grupo_id) & involved)
+    if cursor:
+        fecha, last_id = _parse_cursor(cursor)
+        stmt = stmt.where(or_(Gasto.fecha < fecha, and_(Gasto.fecha == fecha, Gasto.id < last_id)))
+
+    stmt = stmt.order_by(Gasto.fecha.desc(), Gasto.id.desc())
+    if limit is None and cursor is None:
+        return session.exec(stmt).all()
 
-    gastos_autor = session.exec(stmt_autor).all()
-    gastos_deudor = session.exec(stmt_deudas).all()
+    limit = limit or PAGE_SIZE
+    gastos = session.exec(stmt.limit(limit + 1)).all()
 
-    gastos_totales = {g.id: g for g in gastos_autor + gastos_deudor}.values()
+    if len(gastos) > limit:
+        gastos = gastos[:limit]
+        last = gastos[-1]
+        response.headers["X-Next-Cursor"] = f"{last.fecha.isoformat()}_{last.id}"
 
-    return sorted(gastos_totales, key=lambda g: g.fecha, reverse=True)
+    return gastos
 
 
 @router.get("/credits/{user_id}", response_model=List[dict])
 def get_credits(
     user_id: int,
     grupo_id: Optional[int] = Query(None),
-    session: Session = Depends(get_session)
+    sessions: List[Session] = Depends(shards.get_shard_sessions)
 ):
     UDeudor = aliased(Usuario)
     UAcreedor = aliased(Usuario)
@@ -159,7 +148,7 @@ def get_credits(
     if grupo_id is not None:
         stmt = stmt.where(Deuda.grupo_id == grupo_id)
 
-    rows = session.exec(stmt).all()
+    rows = [row for session in sessions for row in session.exec(stmt).all()]
     out = []
     for deuda, deudor_nombre, acreedor_nombre in rows:
         out.append({
@@ -180,7 +169,7 @@ def get_credits(
 def get_debts(
     user_id: int,
     grupo_id: Optional[int] = Query(None),
-    session: Session = Depends(get_session)
+    sessions: List[Session] = Depends(shards.get_shard_sessions)
 ):
     UDeudor = aliased(Usuario)
     UAcreedor = aliased(Usuario)
@@ -194,7 +183,7 @@ def get_debts(
     if grupo_id is not None:
         stmt = stmt.where(Deuda.grupo_id == grupo_id)
 
-    rows = session.exec(stmt).all()
+    rows = [row for session in sessions for row in session.exec(stmt).all()]
     out = []
     for deuda, deudor_nombre, acreedor_nombre in rows:
         out.append({
@@ -215,7 +204,7 @@ def get_debts(
 def debts_summary(
     grupo_id: int = Query(..., description="ID del grupo"),
     usuario_id: int = Query(..., description="ID del usuario"),
-    session: Session = Depends(get_session)
+    session: Session = Depends(shards.get_group_session)
 ):
     try:
         stmt_recv = select(Deuda).where(
@@ -245,7 +234,7 @@ def debts_summary(
 @router.get("/settlements")
 def compute_settlements(
     grupo_id: int = Query(..., description="ID del grupo"),
-    session: Session = Depends(get_session)
+    session: Session = Depends(shards.get_group_session)
 ):
     stmt = select(Deuda).where((Deuda.grupo_id == grupo_id) & (Deuda.estado == 0))
     debts = session.exec(stmt).all()
@@ -254,7 +243,7 @@ def compute_settlements(
 
     net = {}
     for d in debts:
-        cents = _to_cents(d.monto)
+        cents = to_cents(d.monto)
         net[d.acreedor_id] = net.get(d.acreedor_id, 0) + cents
         net[d.deudor_id] = net.get(d.deudor_id, 0) - cents
 
@@ -274,7 +263,7 @@ def compute_settlements(
         transfers.append({
             "from": debtor_id,
             "to": creditor_id,
-            "amount": str(_from_cents(transfer_cents))
+            "amount": str(from_cents(transfer_cents))
         })
         debtor_amt -= transfer_cents
         creditor_amt -= transfer_cents
@@ -292,22 +281,20 @@ def compute_settlements(
         "settlements": transfers,
         "summary": {
             "total_transfers": len(transfers),
-            "total_amount": str(_from_cents(total_amount_cents))
+            "total_amount": str(from_cents(total_amount_cents))
         }
     }
 
 
 @router.delete("/{expense_id}")
-def delete_expense(expense_id: int, session: Session = Depends(get_session)):
-    statement = select(Deuda).where(Deuda.gasto_id == expense_id)
-    debts = session.exec(statement).all()
-    for debt in debts:
-        session.delete(debt)
-
+def delete_expense(expense_id: int, session: Session = Depends(shards.get_expense_session)):
     expense = session.get(Gasto, expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
 
+    lock_group(session, expense.grupo_id)
+    compaction.detach_expense(session, expense_id)
+
     session.delete(expense)
     session.commit()
     return {"message": f"Gasto con ID {expense_id} eliminado exitosamente"}
@@ -317,7 +304,7 @@ def delete_expense(expense_id: int, session: Session = Depends(get_session)):
 def update_expense(
     expense_id: int,
     expense_update: GastoUpdate,
-    session: Session = Depends(get_session)
+    session: Session = Depends(shards.get_expense_session)
 ):
     expense = session.get(Gasto, expense_id)
     if not expense:
@@ -327,36 +314,35 @@ def update_expense(
     if not update_data:
         raise HTTPException(status_code=400, detail="No se proporcionaron campos para actualizar")
 
-    if "valor" in update_data:
-        statement = select(Deuda).where(Deuda.gasto_id == expense_id)
-        debts = session.exec(statement).all()
-        for d in debts:
-            session.delete(d)
-
-        members_stmt = select(Usuario).join(UsuarioGrupo).where(
-            UsuarioGrupo.grupo_id == expense.grupo_id
-        )
-        members = session.exec(members_stmt).all()
-        total_members = len(members)
-
-        if total_members > 1:
-            amount_cents = _to_cents(update_data["valor"])
-            base = amount_cents // total_members
-            remainder = amount_cents % total_members
-            members_sorted = sorted(members, key=lambda u: u.id)
-            shares = {}
-            for idx, m in enumerate(members_sorted):
-                cents = base + (1 if idx < remainder else 0)
-                shares[m.id] = _from_cents(cents)
-
-            for m in members:
-                if m.id != expense.usuario_id:
-                    _net_or_create_debt(
+    if "reparto" in update_data:
+        update_data["reparto"] = json.dumps(update_data["reparto"]) if update_data["reparto"] else None
+
+    if "valor" in update_data or "reparto" in update_data:
+        lock_group(session, expense.grupo_id)
+        compaction.detach_expense(session, expense_id)
+
+        member_ids = membership.member_ids(session, expense.grupo_id)
+
+        if len(member_ids) > 1:
+            try:
+                shares = split_engine.split_one(
+                    to_cents(update_data.get("valor", expense.valor)),
+                    member_ids,
+                    # Un reparto nuevo se valida contra los miembros; el guardado tolera a los que se fueron
+                    split_engine.parse(update_data.get("reparto", expense.reparto), strict="reparto" in update_data),
+                )
+            except ValueError as e:
+                session.rollback()
+                raise HTTPException(status_code=400, detail=str(e))
+
+            for member_id, cents in shares.items():
+                if member_id != expense.usuario_id:
+                    net_or_create_debt(
                         session=session,
                         grupo_id=expense.grupo_id,
-                        deudor_id=m.id,
+                        deudor_id=member_id,
                         acreedor_id=expense.usuario_id,
-                        monto=shares[m.id],
+                        monto=from_cents(cents),
                         gasto_id=expense_id,
                     )
 
@@ -369,15 +355,22 @@ def update_expense(
     return expense
 
 
+def _gather_sorted(sessions: List[Session], statement):
+    """Ejecuta la consulta en cada shard y une los resultados por fecha descendente"""
+    if len(sessions) == 1:
+        return sessions[0].exec(statement).all()
+    gastos = [g for session in sessions for g in session.exec(statement).all()]
+    return sorted(gastos, key=lambda g: g.fecha, reverse=True)
+
+
 @router.get("/user/{user_id}", response_model=List[GastoPublic])
-def get_expenses_by_user(user_id: int, session: Session = Depends(get_session)):
+def get_expenses_by_user(user_id: int, sessions: List[Session] = Depends(shards.get_shard_sessions)):
     statement = select(Gasto).where(Gasto.usuario_id == user_id).order_by(Gasto.fecha.desc())
-    expenses = session.exec(statement).all()
-    return expenses
+    return _gather_sorted(sessions, statement)
 
 
 @router.get("/group/{group_id}", response_model=List[GastoPublic])
-def get_expenses_by_group(group_id: int, session: Session = Depends(get_session)):
+def get_expenses_by_group(group_id: int, session: Session = Depends(shards.get_group_session)):
     statement = (
         select(Gasto)
         .where(Gasto.grupo_id == group_id)
@@ -390,30 +383,30 @@ def get_expenses_by_group(group_id: int, session: Session = Depends(get_session)
 @router.get("/filter/date", response_model=List[GastoPublic])
 def filter_expenses_by_date(
     fecha: date = Query(..., description="Fecha (YYYY-MM-DD)"),
-    session: Session = Depends(get_session)
+    sessions: List[Session] = Depends(shards.get_shard_sessions)
 ):
     statement = select(Gasto).where(Gasto.fecha == fecha).order_by(Gasto.fecha.desc())
-    expenses = session.exec(statement).all()
-    return expenses
+    return _gather_sorted(sessions, statement)
 
 
 @router.get("/filter/title", response_model=List[GastoPublic])
 def filter_expenses_by_title(
     titulo: str = Query(..., description="Texto a buscar en el título"),
-    session: Session = Depends(get_session)
+    sessions: List[Session] = Depends(shards.get_shard_sessions)
 ):
     statement = select(Gasto).where(Gasto.titulo.ilike(f"%{titulo}%")).order_by(Gasto.fecha.desc())
-    expenses = session.exec(statement).all()
-    return expenses
+    return _gather_sorted(sessions, statement)
 
 
 @router.patch("/debts/{debt_id}/settle")
-def settle_debt(debt_id: int, session: Session = Depends(get_session)):
+def settle_debt(debt_id: int, session: Session = Depends(shards.get_debt_session)):
     """Marca una deuda específica como pagada"""
     debt = session.get(Deuda, debt_id)
     if not debt:
         raise HTTPException(status_code=404, detail="Deuda no encontrada")
 
+    lock_group(session, debt.grupo_id)
+    session.refresh(debt)
     if debt.estado == 1:
         raise HTTPException(status_code=400, detail="Esta deuda ya está saldada")
 
@@ -434,9 +427,10 @@ def settle_all_debts_with_creditor(
     deudor_id: int = Query(..., description="ID del deudor que paga"),
     acreedor_id: int = Query(..., description="ID del acreedor que recibe"),
     grupo_id: int = Query(..., description="ID del grupo"),
-    session: Session = Depends(get_session)
+    session: Session = Depends(shards.get_group_session)
 ):
     """Salda todas las deudas pendientes entre un deudor y un acreedor en un grupo específico"""
+    lock_group(session, grupo_id)
     stmt = select(Deuda).where(
         (Deuda.deudor_id == deudor_id) &
         (Deuda.acreedor_id == acreedor_id) &
@@ -466,9 +460,38 @@ def settle_all_debts_with_creditor(
     }
 
 
+@router.get("/batch", response_model=dict)
+def get_expenses_batch(
+    ids: str = Query(..., description="IDs de gastos separados por coma"),
+    sessions: List[Session] = Depends(shards.get_shard_sessions)
+):
+    """Devuelve varios gastos en una sola consulta, como mapa id -> gasto en el orden pedido"""
+    expense_ids = parse_ids(ids)
+    stmt = select(
+        Gasto.id, Gasto.titulo, Gasto.descripcion, Gasto.valor,
+        Gasto.fecha, Gasto.usuario_id, Gasto.grupo_id
+    ).where(Gasto.id.in_(expense_ids))
+    rows = {row.id: row for session in sessions for row in session.exec(stmt).all()}
+
+    out = {}
+    for expense_id in expense_ids:
+        row = rows.get(expense_id)
+        if row is None:
+            continue
+        out[str(expense_id)] = {
+            "titulo": row.titulo,
+            "descripcion": row.descripcion,
+            "valor": float(row.valor),
+            "fecha": row.fecha.isoformat(),
+            "usuario_id": row.usuario_id,
+            "grupo_id": row.grupo_id,
+        }
+    return out
+
+
 # Ruta dinámica al final para no pisar /summary o /settlements
 @router.get("/{expense_id}", response_model=GastoPublic)
-def get_expense(expense_id: int, session: Session = Depends(get_session)):
+def get_expense(expense_id: int, session: Session = Depends(shards.get_expense_session)):
     expense = session.get(Gasto, expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Gasto no encontrado")
@@ -1,13 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
+from sqlalchemy import delete, func, union_all
+from sqlalchemy.orm import aliased
 from typing import List, Optional
-from models import Grupo, Usuario, UsuarioGrupo, GrupoCreate, Gasto, Deuda
-from database import get_session
+from models import Grupo, Usuario, UsuarioGrupo, GrupoCreate, Gasto, Deuda, DeudaGasto
+from database import get_session, lock_group
+from debts import PendingDebts, net_in_memory, net_or_create_debt
+from split_engine import from_cents, to_cents
+import changes
+import jobs
+import ledger
+import membership
+import shards
+import split_engine
 from datetime import datetime, timedelta, timezone
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
+import csv
+import io
+import json
+import logging
 import secrets
+import tempfile
 
 router = APIRouter(prefix="/groups", tags=["groups"])
+logger = logging.getLogger("gestionapp.groups")
 
 # Invitaciones en memoria (puedes migrarlo a DB luego)
 INVITES = {}  # code -> {"group_id": int, "expires_at": datetime|None, "max_uses": int|None, "used": int}
@@ -19,123 +36,91 @@ def _gen_code(group_id: int) -> str:
     return f"G{group_id}-{secrets.token_urlsafe(8)}"
 
 
-def _to_cents(x) -> int:
-    d = x if isinstance(x, Decimal) else Decimal(str(x))
-    return int((d * Decimal("100")).to_integral_value(rounding=ROUND_HALF_UP))
-
-
-def _from_cents(c: int) -> Decimal:
-    return (Decimal(c) / Decimal("100")).quantize(Decimal("0.01"))
-
-
-def _net_or_create_debt(
-    *,
-    session: Session,
-    grupo_id: int,
-    deudor_id: int,
-    acreedor_id: int,
-    monto: Decimal,
-    gasto_id: Optional[int] = None,
-):
-    if monto <= 0:
-        return
-
-    stmt_opuesta = select(Deuda).where(
-        (Deuda.grupo_id == grupo_id)
-        & (Deuda.deudor_id == acreedor_id)
-        & (Deuda.acreedor_id == deudor_id)
-        & (Deuda.estado == 0)
-    )
-    opuesta = session.exec(stmt_opuesta).first()
-
-    new_c = _to_cents(monto)
-
-    if opuesta:
-        opp_c = _to_cents(opuesta.monto)
-
-        if opp_c > new_c:
-            opuesta.monto = _from_cents(opp_c - new_c)
-            session.add(opuesta)
-            return
-        elif opp_c < new_c:
-            session.delete(opuesta)
-            remain = new_c - opp_c
-            if remain > 0:
-                session.add(Deuda(
-                    gasto_id=gasto_id,
-                    deudor_id=deudor_id,
-                    acreedor_id=acreedor_id,
-                    grupo_id=grupo_id,
-                    monto=_from_cents(remain),
-                    estado=0
-                ))
-            return
-        else:
-            session.delete(opuesta)
-            return
-
-    session.add(Deuda(
-        gasto_id=gasto_id,
-        deudor_id=deudor_id,
-        acreedor_id=acreedor_id,
-        grupo_id=grupo_id,
-        monto=monto,
-        estado=0
-    ))
-
-
-def _recalculate_debts_for_group(session: Session, group_id: int):
+def _recalculate_debts_for_group(session: Session, group_id: int, on_progress=None):
     """
-    Recalcula todas las deudas para todos los gastos del grupo.
+    Recalcula las deudas pendientes de todos los gastos del grupo; las pagadas
+    no se tocan y lo que cubren se descuenta de las nuevas (_discount_settled).
     Se debe llamar cuando se agrega un nuevo miembro al grupo.
+    `on_progress(hechos, total)` se llama después de cada gasto, si se pasa.
+
+    Los gastos de los que participaba alguien que dejó el grupo tienen un
+    reparto fijo que escribió la baja (remove_group_member), así que el
+    recálculo reproduce la reasignación en vez de deshacerla.
     """
-    # Obtener todos los miembros del grupo
-    statement = select(Usuario).join(UsuarioGrupo).where(
-        UsuarioGrupo.grupo_id == group_id
-    )
-    group_members = session.exec(statement).all()
-    total_members = len(group_members)
+    lock_group(session, group_id)
 
-    if total_members <= 1:
-        return  # No hay nada que recalcular
+    member_ids = membership.member_ids(session, group_id)
 
-    # Obtener todos los gastos del grupo
+    # Obtener todos los gastos del grupo (con uno solo o ningún miembro igual puede
+    # haber deudas con ex miembros que conservan su parte)
     gastos = session.exec(select(Gasto).where(Gasto.grupo_id == group_id)).all()
 
-    for gasto in gastos:
-        # Eliminar deudas existentes para este gasto
-        deudas_existentes = session.exec(
-            select(Deuda).where(Deuda.gasto_id == gasto.id)
-        ).all()
-        for deuda in deudas_existentes:
-            session.delete(deuda)
-
-        # Recalcular shares con todos los miembros actuales
-        amount_cents = _to_cents(gasto.valor)
-        base = amount_cents // total_members
-        remainder = amount_cents % total_members
-
-        members_sorted = sorted(group_members, key=lambda u: u.id)
-        shares = {}
-        for idx, m in enumerate(members_sorted):
-            cents = base + (1 if idx < remainder else 0)
-            shares[m.id] = _from_cents(cents)
-
-        # Crear nuevas deudas para todos los miembros (excepto el que pagó)
-        for member in group_members:
-            if member.id != gasto.usuario_id:
-                _net_or_create_debt(
-                    session=session,
-                    grupo_id=group_id,
-                    deudor_id=member.id,
-                    acreedor_id=gasto.usuario_id,
-                    monto=shares[member.id],
-                    gasto_id=gasto.id,
-                )
-
+    # Shares de todos los gastos con los miembros actuales, en una pasada por tipo de reparto
+    all_shares = split_engine.split_expenses(gastos, member_ids)
+
+    # El neteo se hace en memoria desde cero: las pendientes actuales se reemplazan
+    # enteras (las pagadas quedan como están) y se escriben de una vez al final
+    pending: PendingDebts = {}
+    for done, (gasto, shares) in enumerate(zip(gastos, all_shares), start=1):
+        # Deudas para todos los miembros (excepto el que pagó)
+        for member_id, cents in shares.items():
+            if member_id != gasto.usuario_id:
+                net_in_memory(pending, member_id, gasto.usuario_id, cents, gasto.id)
+
+        if on_progress:
+            on_progress(done, len(gastos))
+
+    _discount_settled(session, group_id, pending)
+
+    pendientes = session.exec(select(Deuda).where((Deuda.grupo_id == group_id) & (Deuda.estado == 0))).all()
+    if pendientes:
+        session.exec(delete(DeudaGasto).where(DeudaGasto.deuda_id.in_([d.id for d in pendientes])))
+    for deuda in pendientes:
+        session.delete(deuda)
+    session.flush()
+    session.add_all([
+        Deuda(gasto_id=gasto_id, deudor_id=deudor_id, acreedor_id=acreedor_id, grupo_id=group_id,
+              monto=from_cents(cents), estado=0)
+        for (deudor_id, acreedor_id), filas in pending.items()
+        for cents, gasto_id in filas
+    ])
     session.commit()
 
 
+def _discount_settled(session: Session, group_id: int, pending: PendingDebts):
+    """
+    Descuenta de las deudas pendientes recién calculadas (`pending`, ver
+    _recalculate_debts_for_group) lo que ya se pagó, par por par: así las
+    pendientes más las pagadas vuelven a sumar lo que sale de los gastos. Si se
+    pagó más de lo que ahora corresponde, queda una deuda en sentido contrario
+    por la diferencia.
+    """
+    pagado = {}  # (deudor, acreedor) -> [centavos, gasto_id de la última pagada]
+    pagadas = session.exec(
+        select(Deuda.deudor_id, Deuda.acreedor_id, Deuda.monto, Deuda.gasto_id)
+        .where((Deuda.grupo_id == group_id) & (Deuda.estado != 0))
+        .order_by(Deuda.id)
+    ).all()
+    for deudor_id, acreedor_id, monto, gasto_id in pagadas:
+        par = pagado.setdefault((deudor_id, acreedor_id), [0, gasto_id])
+        par[0] += to_cents(monto)
+        par[1] = gasto_id
+
+    for (deudor_id, acreedor_id), (restante, gasto_id) in pagado.items():
+        mismas = pending.get((deudor_id, acreedor_id), [])
+        while mismas and restante > 0:
+            if mismas[0][0] > restante:
+                mismas[0][0] -= restante
+                restante = 0
+            else:
+                restante -= mismas.pop(0)[0]
+        if restante > 0:
+            net_in_memory(pending, acreedor_id, deudor_id, restante, gasto_id)
+
+
+jobs.register_handler(jobs.RECALCULAR_DEUDAS, _recalculate_debts_for_group)
+
+
 @router.get("/", response_model=List[dict])
 def get_user_groups(email: str, session: Session = Depends(get_session)):
     """
@@ -146,23 +131,25 @@ def get_user_groups(email: str, session: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
+    # Las membresías viven en el shard de cada grupo: se consulta cada shard
+    mis_grupos = select(UsuarioGrupo.grupo_id).where(UsuarioGrupo.usuario_id == user.id)
     statement = (
-        select(Grupo)
+        select(Grupo.id, Grupo.nombre, func.count(UsuarioGrupo.id))
         .join(UsuarioGrupo, UsuarioGrupo.grupo_id == Grupo.id)
-        .where(UsuarioGrupo.usuario_id == user.id)
+        .where(Grupo.id.in_(mis_grupos))
+        .group_by(Grupo.id, Grupo.nombre)
+        .order_by(Grupo.id)
     )
-    grupos = session.exec(statement).all()
 
     result = []
-    for grupo in grupos:
-        miembros_count = len(session.exec(
-            select(UsuarioGrupo).where(UsuarioGrupo.grupo_id == grupo.id)
-        ).all())
-        result.append({
-            "id": grupo.id,
-            "name": grupo.nombre,
-            "members": miembros_count
-        })
+    for shard_engine in shards.engines:
+        with Session(shard_engine) as shard_session:
+            for grupo_id, nombre, miembros_count in shard_session.exec(statement).all():
+                result.append({
+                    "id": grupo_id,
+                    "name": nombre,
+                    "members": miembros_count
+                })
 
     return result
 
@@ -176,14 +163,15 @@ def create_group(data: GrupoCreate, session: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    nuevo_grupo = Grupo(nombre=data.name)
+    nuevo_grupo = Grupo(nombre=data.name, shard=shards.pick_shard_for_new_group())
     session.add(nuevo_grupo)
     session.commit()
     session.refresh(nuevo_grupo)
+    shards.replicate(nuevo_grupo, [nuevo_grupo.shard])
 
-    user_grupo = UsuarioGrupo(usuario_id=user.id, grupo_id=nuevo_grupo.id)
-    session.add(user_grupo)
-    session.commit()
+    with shards.group_session(nuevo_grupo.id) as group_session:
+        group_session.add(UsuarioGrupo(usuario_id=user.id, grupo_id=nuevo_grupo.id))
+        group_session.commit()
 
     return {
         "id": nuevo_grupo.id,
@@ -193,31 +181,347 @@ def create_group(data: GrupoCreate, session: Session = Depends(get_session)):
 
 
 @router.get("/{group_id}/members", response_model=list[dict])
-def get_group_members(group_id: int, session: Session = Depends(get_session)):
+def get_group_members(group_id: int, session: Session = Depends(shards.get_group_session)):
     """
     Devuelve los miembros del grupo especificado.
     """
-    group = session.get(Grupo, group_id)
-    if not group:
+    miembros = membership.get(session, group_id)
+    if miembros is None:
         raise HTTPException(status_code=404, detail="Grupo no encontrado")
 
-    miembros = (
-        session.query(Usuario)
-        .join(UsuarioGrupo, Usuario.id == UsuarioGrupo.usuario_id)
-        .filter(UsuarioGrupo.grupo_id == group_id)
-        .all()
-    )
-
     return [
         {
-            "id": u.id,
-            "nombre": u.nombre,
-            "correo": u.mail,
-            "avatar": f"https://ui-avatars.com/api/?name={u.nombre.replace(' ', '+')}"
+            "id": u["id"],
+            "nombre": u["nombre"],
+            "correo": u["mail"],
+            "avatar": f"https://ui-avatars.com/api/?name={u['nombre'].replace(' ', '+')}"
         }
-        for u in miembros
+        for u in miembros.detalles
+    ]
+
+
+def _freeze_shares(session: Session, group_id: int, user_id: int, member_ids, saldo: dict) -> int:
+    """
+    Pasa a reparto fijo cada gasto en el que participa `user_id` (o que pagó),
+    con sus shares de ahora. Lo que el usuario le debe a cada acreedor (`saldo`,
+    en centavos) sale de su parte en los gastos que pagó ese acreedor, los más
+    nuevos primero, y se reparte en partes iguales entre los que quedan (mismo
+    criterio que las deudas nuevas). El usuario queda en `ex_miembros` con lo
+    que conserva. Devuelve cuántos gastos cambió.
+    """
+    gastos = session.exec(select(Gasto).where(Gasto.grupo_id == group_id).order_by(Gasto.id)).all()
+    restantes = [m for m in member_ids if m != user_id]
+    afectados = [
+        (gasto, dict(shares))
+        for gasto, shares in zip(gastos, split_engine.split_expenses(gastos, member_ids))
+        if shares.get(user_id, 0) > 0 or gasto.usuario_id == user_id
     ]
 
+    for acreedor_id, debe in saldo.items():
+        if debe <= 0:
+            continue
+        tomas = []
+        for gasto, shares in reversed(afectados):
+            if debe == 0:
+                break
+            if gasto.usuario_id == acreedor_id and shares.get(user_id, 0) > 0:
+                toma = min(shares[user_id], debe)
+                shares[user_id] -= toma
+                debe -= toma
+                tomas.append((shares, toma))
+        # Cada miembro recibe su cupo repartido en los gastos de los que se tomó
+        cupos = [[m, c] for m, c in _equal_cents(sum(t for _, t in tomas), restantes).items() if c > 0]
+        for shares, toma in tomas:
+            while toma:
+                miembro = cupos[0]
+                parte = min(miembro[1], toma)
+                shares[miembro[0]] = shares.get(miembro[0], 0) + parte
+                miembro[1] -= parte
+                toma -= parte
+                if miembro[1] == 0:
+                    cupos.pop(0)
+
+    for gasto, shares in afectados:
+        montos = {m: c for m, c in sorted(shares.items()) if c > 0}
+        spec = {"tipo": "fijo", "montos": {str(m): str(from_cents(c)) for m, c in montos.items()}}
+        ex_miembros = [m for m in montos if m not in restantes]
+        if ex_miembros:
+            spec["ex_miembros"] = ex_miembros
+        gasto.reparto = json.dumps(spec)
+        session.add(gasto)
+    return len(afectados)
+
+
+def _equal_cents(total: int, member_ids) -> dict:
+    """`total` en partes iguales, el resto de a un centavo por id ascendente (como split_engine)"""
+    return split_engine.split_one(total, member_ids, split_engine.EqualSplit())
+
+
+@router.delete("/{group_id}/members/{user_id}", response_model=dict)
+def remove_group_member(
+    group_id: int,
+    user_id: int,
+    session: Session = Depends(shards.get_group_session)
+):
+    """
+    Saca a un usuario del grupo.
+
+    - Lo que el usuario todavía debe (su saldo pendiente neto con cada acreedor)
+      lo absorben los miembros que quedan en partes iguales, cada uno frente al
+      mismo acreedor; la parte del propio acreedor se cancela. Si el acreedor es
+      el único que queda, la deuda desaparecería: la baja se rechaza con 409
+      hasta que se salde.
+    - Lo que le deben a él sigue pendiente hasta que se salde.
+    - Las deudas ya pagadas no se tocan.
+
+    Los gastos en los que participaba pasan a un reparto fijo con las partes
+    que resultan (_freeze_shares), así un recálculo del grupo da lo mismo que
+    la baja. Las deudas reasignadas pasan por el neteo como las de un gasto.
+    """
+    group = session.get(Grupo, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Grupo no encontrado")
+
+    lock_group(session, group_id)
+    membresia = session.exec(
+        select(UsuarioGrupo).where((UsuarioGrupo.grupo_id == group_id) & (UsuarioGrupo.usuario_id == user_id))
+    ).first()
+    if not membresia:
+        raise HTTPException(status_code=404, detail="El usuario no es miembro del grupo")
+
+    member_ids = membership.member_ids(session, group_id)
+    restantes = [m for m in member_ids if m != user_id]
+
+    pendientes = session.exec(
+        select(Deuda)
+        .where(
+            (Deuda.grupo_id == group_id)
+            & (Deuda.estado == 0)
+            & ((Deuda.deudor_id == user_id) | (Deuda.acreedor_id == user_id))
+        )
+        .order_by(Deuda.id)
+    ).all()
+    por_contraparte = {}  # contraparte -> deudas pendientes con el usuario
+    saldo = {}  # contraparte -> centavos que el usuario le debe (negativo: se los debe a él)
+    for deuda in pendientes:
+        deudor = deuda.deudor_id == user_id
+        contraparte = deuda.acreedor_id if deudor else deuda.deudor_id
+        por_contraparte.setdefault(contraparte, []).append(deuda)
+        saldo[contraparte] = saldo.get(contraparte, 0) + (1 if deudor else -1) * to_cents(deuda.monto)
+
+    for acreedor_id, debe in saldo.items():
+        if debe > 0 and not set(restantes) - {acreedor_id}:
+            raise HTTPException(
+                status_code=409,
+                detail=f"El usuario todavía le debe {from_cents(debe)} al usuario {acreedor_id} y no queda "
+                       "nadie más en el grupo que absorba la deuda: hay que saldarla antes de la baja",
+            )
+
+    try:
+        gastos_actualizados = _freeze_shares(session, group_id, user_id, member_ids, saldo)
+
+        # Con cada contraparte, sus deudas pendientes se reemplazan por el saldo neto: si el
+        # usuario debe, lo absorben los que quedan; si le deben, queda una sola deuda a su favor
+        reasignadas = 0
+        for contraparte, deudas in por_contraparte.items():
+            debe = saldo[contraparte]
+            if debe < 0 and all(d.acreedor_id == user_id for d in deudas):
+                continue
+            session.exec(delete(DeudaGasto).where(DeudaGasto.deuda_id.in_([d.id for d in deudas])))
+            for deuda in deudas:
+                session.delete(deuda)
+            session.flush()
+            gasto_id = deudas[-1].gasto_id
+            if debe < 0:
+                net_or_create_debt(
+                    session=session, grupo_id=group_id, deudor_id=contraparte, acreedor_id=user_id,
+                    monto=from_cents(-debe), gasto_id=gasto_id,
+                )
+            elif debe > 0:
+                reasignadas += 1
+                for miembro, cents in _equal_cents(debe, restantes).items():
+                    if miembro != contraparte and cents > 0:
+                        net_or_create_debt(
+                            session=session, grupo_id=group_id, deudor_id=miembro, acreedor_id=contraparte,
+                            monto=from_cents(cents), gasto_id=gasto_id,
+                        )
+        session.delete(membresia)
+        session.commit()
+    except ValueError as e:
+        # Un reparto guardado que ya no se puede aplicar
+        session.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=500, detail=f"Error al quitar el miembro: {str(e)}")
+
+    return {
+        "group_id": group_id,
+        "usuario_id": user_id,
+        "deudas_reasignadas": reasignadas,
+        "gastos_actualizados": gastos_actualizados,
+    }
+
+
+@router.get("/{group_id}/balances", response_model=dict)
+def get_group_balances(
+    group_id: int,
+    as_of: Optional[datetime] = Query(None, description="Fecha y hora de los saldos; por defecto, ahora"),
+    session: Session = Depends(shards.get_group_session)
+):
+    """
+    Saldo neto de cada usuario del grupo a la fecha `as_of` (positivo: le deben),
+    a partir del libro de movimientos de deudas.
+    """
+    group = session.get(Grupo, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Grupo no encontrado")
+
+    if as_of is None:
+        as_of = datetime.now()
+    elif as_of.tzinfo is not None:
+        # Los movimientos se guardan en hora local sin zona
+        as_of = as_of.astimezone().replace(tzinfo=None)
+
+    saldos = ledger.balances_as_of(session, group_id, as_of)
+    nombres = dict(session.exec(select(Usuario.id, Usuario.nombre).where(Usuario.id.in_(saldos))).all())
+
+    return {
+        "grupo_id": group_id,
+        "as_of": as_of.isoformat(),
+        "balances": [
+            {"usuario_id": usuario_id, "nombre": nombres.get(usuario_id), "saldo": str(from_cents(saldo))}
+            for usuario_id, saldo in saldos.items()
+        ],
+    }
+
+
+@router.get("/{group_id}/changes", response_model=dict)
+def get_group_changes(
+    group_id: int,
+    since: int = Query(0, ge=0, description="Cursor devuelto por la llamada anterior; 0 trae todo"),
+    limit: int = Query(500, ge=1, le=5000),
+    session: Session = Depends(shards.get_group_session)
+):
+    """
+    Gastos, deudas y miembros del grupo que cambiaron desde el cursor `since`.
+    Los borrados vienen en `eliminados`. Si `has_more` es true, hay que volver a
+    llamar con el `cursor` devuelto.
+
+    Con `since` 0 o un cursor más viejo que los cambios que se conservan, la
+    respuesta trae `snapshot: true` y el estado completo del grupo: el cliente
+    reemplaza lo que tenía y sigue desde el `cursor` devuelto.
+    """
+    group = session.get(Grupo, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Grupo no encontrado")
+
+    return changes.changes_since(session, group_id, since, limit)
+
+
+EXPORT_COLUMNS = [
+    "gasto_id", "fecha", "titulo", "valor", "autor_id", "autor",
+    "deuda_id", "deudor_id", "deudor", "acreedor_id", "monto", "estado",
+]
+EXPORT_BATCH_SIZE = 1000
+
+
+def _export_rows(group_id: int):
+    """
+    Recorre gastos + autor + deudas del grupo con un cursor del lado del servidor.
+    Abre su propia sesión porque la respuesta se sigue generando después de que
+    la sesión de la request se cerró.
+    """
+    Autor = aliased(Usuario)
+    Deudor = aliased(Usuario)
+    # Parte de cada gasto en cada deuda: las consolidadas se reparten según deuda_gastos
+    partes = union_all(
+        select(DeudaGasto.gasto_id, DeudaGasto.deuda_id, DeudaGasto.monto)
+        .where(DeudaGasto.grupo_id == group_id),
+        select(Deuda.gasto_id, Deuda.id.label("deuda_id"), Deuda.monto)
+        .where((Deuda.grupo_id == group_id) & ~Deuda.id.in_(
+            select(DeudaGasto.deuda_id).where(DeudaGasto.grupo_id == group_id)
+        )),
+    ).subquery()
+    stmt = (
+        select(
+            Gasto.id, Gasto.fecha, Gasto.titulo, Gasto.valor,
+            Autor.id, Autor.nombre,
+            Deuda.id, Deuda.deudor_id, Deudor.nombre, Deuda.acreedor_id, partes.c.monto, Deuda.estado,
+        )
+        .join(Autor, Gasto.usuario_id == Autor.id)
+        .outerjoin(partes, partes.c.gasto_id == Gasto.id)
+        .outerjoin(Deuda, Deuda.id == partes.c.deuda_id)
+        .outerjoin(Deudor, Deuda.deudor_id == Deudor.id)
+        .where(Gasto.grupo_id == group_id)
+        .order_by(Gasto.fecha.desc(), Gasto.id, Deuda.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    with shards.group_session(group_id) as session:
+        for row in session.exec(stmt):
+            yield row
+
+
+def _export_csv(group_id: int):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+    for row in _export_rows(group_id):
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    yield buffer.getvalue()
+
+
+def _export_xlsx(group_id: int):
+    # openpyxl en modo write_only va volcando las filas a disco; el zip final
+    # recién se puede enviar cuando el libro está cerrado.
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("gastos")
+    sheet.append(EXPORT_COLUMNS)
+    for row in _export_rows(group_id):
+        sheet.append([float(v) if isinstance(v, Decimal) else v for v in row])
+
+    with tempfile.TemporaryFile() as tmp:
+        workbook.save(tmp)
+        tmp.seek(0)
+        while chunk := tmp.read(64 * 1024):
+            yield chunk
+
+
+@router.get("/{group_id}/export")
+def export_group(
+    group_id: int,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|xlsx)$"),
+    session: Session = Depends(get_session)
+):
+    """
+    Exporta los gastos del grupo junto a sus deudas (una fila por deuda).
+    """
+    group = session.get(Grupo, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Grupo no encontrado")
+
+    if export_format == "xlsx":
+        content = _export_xlsx(group_id)
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        content = _export_csv(group_id)
+        media_type = "text/csv; charset=utf-8"
+
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="grupo_{group_id}.{export_format}"'},
+    )
+
 
 @router.post("/{group_id}/invites", response_model=dict)
 def create_invite(
@@ -256,7 +560,7 @@ def create_invite(
 @router.post("/{group_id}/recalculate-debts", response_model=dict)
 def recalculate_group_debts(
     group_id: int,
-    session: Session = Depends(get_session)
+    session: Session = Depends(shards.get_group_session)
 ):
     """
     Endpoint manual para recalcular todas las deudas del grupo.
@@ -304,33 +608,31 @@ def accept_invite(
     if not group:
         raise HTTPException(status_code=404, detail="Grupo no encontrado")
 
-    ya_miembro = session.exec(
-        select(UsuarioGrupo).where(
-            (UsuarioGrupo.usuario_id == user_id) &
-            (UsuarioGrupo.grupo_id == meta["group_id"])
-        )
-    ).first()
-    if ya_miembro:
-        return {"joined": True, "group_id": meta["group_id"], "message": "Ya es miembro"}
+    with shards.group_session(meta["group_id"]) as group_session:
+        miembros = membership.get(group_session, meta["group_id"])
+        if miembros and user_id in miembros.ids:
+            return {"joined": True, "group_id": meta["group_id"], "message": "Ya es miembro"}
 
-    # Agregar el usuario al grupo
-    session.add(UsuarioGrupo(usuario_id=user_id, grupo_id=meta["group_id"]))
-    session.commit()
+        # Agregar el usuario al grupo (el flush sube la versión de membresía)
+        group_session.add(UsuarioGrupo(usuario_id=user_id, grupo_id=meta["group_id"]))
+        group_session.commit()
 
-    # Recalcular todas las deudas del grupo con el nuevo miembro
-    print(f"🔄 Recalculando deudas para el grupo {meta['group_id']} con el nuevo miembro {user_id}")
-    _recalculate_debts_for_group(session, meta["group_id"])
+        miembros_count = len(membership.member_ids(group_session, meta["group_id"]))
 
     meta["used"] += 1
 
-    miembros_count = len(session.exec(
-        select(UsuarioGrupo).where(UsuarioGrupo.grupo_id == meta["group_id"])
-    ).all())
+    # El recálculo corre en segundo plano; varios ingresos seguidos comparten un solo trabajo
+    logger.info(
+        "Encolando recálculo de deudas por nuevo miembro",
+        extra={"grupo_id": meta["group_id"], "usuario_id": user_id},
+    )
+    tarea = jobs.enqueue(session, jobs.RECALCULAR_DEUDAS, meta["group_id"])
 
     return {
         "joined": True,
         "group_id": meta["group_id"],
         "members": miembros_count,
         "used_count": meta["used"],
-        "message": "Deudas recalculadas con el nuevo miembro"
+        "job_id": tarea.id,
+        "message": "Recálculo de deudas encolado"
     }
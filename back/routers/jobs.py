@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session
+from database import get_session
+from models import Tarea
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"]
+)
+
+@router.get("/{job_id}", response_model=dict)
+def get_job(job_id: int, session: Session = Depends(get_session)):
+    """Estado y progreso de un trabajo en segundo plano"""
+    tarea = session.get(Tarea, job_id)
+    if not tarea:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return {
+        "id": tarea.id,
+        "tipo": tarea.tipo,
+        "grupo_id": tarea.grupo_id,
+        "estado": tarea.estado,
+        "progreso": tarea.progreso,
+        "solicitudes": tarea.solicitudes,
+        "error": tarea.error,
+        "creado_en": tarea.creado_en,
+        "actualizado_en": tarea.actualizado_en,
+    }
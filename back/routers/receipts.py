@@ -0,0 +1,186 @@
+import os
+import re
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+import storage
+
+router = APIRouter(
+    prefix="/receipts",
+    tags=["receipts"]
+)
+
+# El contenido de cada URL nunca cambia (el nombre es su hash)
+CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable", "Accept-Ranges": "bytes"}
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Lo que agrega el multipart alrededor del archivo (boundaries, headers de la parte)
+MULTIPART_OVERHEAD = 16 * 1024
+UPLOAD_BODY = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}},
+    }}},
+}
+
+
+class _FilePart:
+    """
+    Parser incremental del multipart: junta en `chunks` lo que llega del campo
+    `file` (el primero, los demás campos se ignoran) para escribirlo a disco
+    sin guardar el body entero en memoria ni en un archivo temporal.
+    """
+
+    def __init__(self, boundary: bytes):
+        self.content_type = None  # del campo file, apenas llegan sus headers
+        self.chunks = []
+        self._headers = {}
+        self._field = self._value = b""
+        self._in_file = False
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") == b"file" and self.content_type is None:
+            self._in_file = True
+            content_type, _ = parse_options_header(self._headers.get(b"content-type", b""))
+            self.content_type = content_type.decode("latin-1")
+
+    def _on_part_data(self, data, start, end):
+        if self._in_file:
+            self.chunks.append(data[start:end])
+
+    def _on_part_end(self):
+        self._in_file = False
+
+    def write(self, chunk: bytes) -> bytes:
+        """Procesa un pedazo del body y devuelve lo que trajo del archivo"""
+        self.parser.write(chunk)
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _iter_range(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(storage.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _serve(request: Request, path: str, etag: str, content_type: str):
+    headers = {**CACHE_HEADERS, "ETag": f'"{etag}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    size = os.path.getsize(path)
+    range_header = request.headers.get("range")
+    if not range_header:
+        return FileResponse(path, media_type=content_type, headers=headers)
+
+    match = RANGE_RE.match(range_header.strip())
+    if not match or match.groups() == ("", ""):
+        raise HTTPException(status_code=416, detail="Rango inválido", headers={"Content-Range": f"bytes */{size}"})
+
+    first, last = match.groups()
+    if first == "":
+        # bytes=-N: los últimos N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Rango inválido", headers={"Content-Range": f"bytes */{size}"})
+
+    length = end - start + 1
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(length)})
+    return StreamingResponse(_iter_range(path, start, length), status_code=206, media_type=content_type, headers=headers)
+
+
+@router.post("/", response_model=dict, openapi_extra={"requestBody": UPLOAD_BODY})
+async def upload_receipt(request: Request):
+    """
+    Sube un comprobante (multipart, campo `file`); devuelve la URL para guardar
+    en Gasto.comprobante. El archivo va a disco a medida que llega el body.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > storage.MAX_RECEIPT_BYTES + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail="El comprobante supera el tamaño máximo permitido")
+    media_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if media_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Se esperaba multipart/form-data con el campo file")
+
+    part = _FilePart(options[b"boundary"])
+    writer = None
+    try:
+        async for chunk in request.stream():
+            data = part.write(chunk)
+            if writer is None and part.content_type is not None:
+                if part.content_type not in storage.ALLOWED_TYPES:
+                    raise HTTPException(status_code=415, detail="Tipo de archivo no soportado")
+                writer = await run_in_threadpool(storage.ReceiptWriter, part.content_type)
+            if data:
+                await run_in_threadpool(writer.write, data)
+        if writer is None:
+            raise HTTPException(status_code=422, detail="Falta el campo file")
+        name, created = await run_in_threadpool(writer.commit)
+    except storage.ReceiptTooLarge:
+        raise HTTPException(status_code=413, detail="El comprobante supera el tamaño máximo permitido")
+    except MultipartParseError:
+        raise HTTPException(status_code=400, detail="Multipart inválido")
+    finally:
+        if writer is not None:
+            await run_in_threadpool(writer.abort)
+
+    return {
+        "name": name,
+        "url": f"/receipts/{name}",
+        "thumbnail_url": f"/receipts/{name}/thumbnail" if writer.content_type.startswith("image/") else None,
+        "created": created,
+    }
+
+
+@router.get("/{name}/thumbnail")
+def get_receipt_thumbnail(name: str, request: Request):
+    path = storage.ensure_thumbnail(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Miniatura no disponible")
+    return _serve(request, path, f"{name}-thumb", "image/jpeg")
+
+
+@router.get("/{name}")
+def get_receipt(name: str, request: Request):
+    path = storage.receipt_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Comprobante no encontrado")
+    _, ext = os.path.splitext(name)
+    return _serve(request, path, name, storage.CONTENT_TYPES[ext])
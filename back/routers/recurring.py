@@ -0,0 +1,79 @@
+import json
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session, select
+
+from models import GastoRecurrente, GastoRecurrenteCreate, GastoRecurrentePublic
+import membership
+import recurring
+import shards
+import split_engine
+
+router = APIRouter(
+    prefix="/recurring-expenses",
+    tags=["recurring-expenses"]
+)
+
+
+@router.post("/", response_model=GastoRecurrentePublic)
+def create_recurring_expense(plantilla: GastoRecurrenteCreate):
+    """
+    Crea una plantilla de gasto recurrente. La primera ocurrencia es fecha_inicio;
+    si ya pasó, el scheduler crea en su próxima corrida todas las vencidas.
+    """
+    if plantilla.frecuencia not in recurring.FRECUENCIAS:
+        raise HTTPException(status_code=400, detail="La frecuencia debe ser 'semanal' o 'mensual'")
+    if plantilla.intervalo < 1:
+        raise HTTPException(status_code=400, detail="El intervalo debe ser al menos 1")
+    if plantilla.fecha_fin is not None and plantilla.fecha_fin < plantilla.fecha_inicio:
+        raise HTTPException(status_code=400, detail="La fecha de fin es anterior a la de inicio")
+
+    with shards.group_session(plantilla.grupo_id) as session:
+        member_ids = membership.member_ids(session, plantilla.grupo_id)
+        if plantilla.usuario_id not in member_ids:
+            raise HTTPException(status_code=400, detail="El usuario no es miembro del grupo")
+        try:
+            split_engine.split_one(
+                split_engine.to_cents(plantilla.valor), member_ids, split_engine.from_spec(plantilla.reparto)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        db_plantilla = GastoRecurrente(
+            **plantilla.model_dump(exclude={"reparto"}),
+            reparto=json.dumps(plantilla.reparto) if plantilla.reparto else None,
+            proxima_fecha=plantilla.fecha_inicio,
+        )
+        session.add(db_plantilla)
+        session.commit()
+        session.refresh(db_plantilla)
+        return db_plantilla
+
+
+@router.get("/", response_model=List[GastoRecurrentePublic])
+def list_recurring_expenses(
+    grupo_id: int = Query(..., description="ID del grupo"),
+    session: Session = Depends(shards.get_group_session)
+):
+    """Plantillas de gastos recurrentes del grupo, activas e inactivas"""
+    return session.exec(
+        select(GastoRecurrente).where(GastoRecurrente.grupo_id == grupo_id).order_by(GastoRecurrente.id)
+    ).all()
+
+
+@router.delete("/{recurring_id}", response_model=dict)
+def stop_recurring_expense(
+    recurring_id: int,
+    grupo_id: int = Query(..., description="ID del grupo"),
+    session: Session = Depends(shards.get_group_session)
+):
+    """Deja de generar gastos con la plantilla; los ya creados no se tocan"""
+    plantilla = session.get(GastoRecurrente, recurring_id)
+    if not plantilla or plantilla.grupo_id != grupo_id:
+        raise HTTPException(status_code=404, detail="Gasto recurrente no encontrado")
+
+    plantilla.activo = False
+    session.add(plantilla)
+    session.commit()
+    return {"message": f"Gasto recurrente con ID {recurring_id} desactivado"}
@@ -1,7 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from decimal import Decimal
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, union_all
 from sqlmodel import Session, select
 from database import get_session
-from models import Usuario, UsuarioPublic
+from batch_utils import parse_ids
+from models import Deuda, Grupo, Usuario, UsuarioPublic
+import balance_cache
+import shards
 
 router = APIRouter(
     prefix="/users",
@@ -15,10 +21,106 @@ def list_users(session: Session = Depends(get_session)):
     users = session.exec(statement).all()
     return users
 
+@router.get("/batch", response_model=dict)
+def get_users_batch(
+    ids: str = Query(..., description="IDs de usuarios separados por coma"),
+    session: Session = Depends(get_session)
+):
+    """Get several users in one query as an id -> user map, in request order"""
+    user_ids = parse_ids(ids)
+    stmt = select(Usuario.id, Usuario.nombre, Usuario.apellido).where(Usuario.id.in_(user_ids))
+    rows = {row.id: row for row in session.exec(stmt).all()}
+
+    return {
+        str(user_id): {"nombre": rows[user_id].nombre, "apellido": rows[user_id].apellido}
+        for user_id in user_ids
+        if user_id in rows
+    }
+
 @router.get("/{user_id}", response_model=UsuarioPublic)
 def get_user(user_id: int, session: Session = Depends(get_session)):
     """Get user by ID"""
     user = session.get(Usuario, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return user
\ No newline at end of file
+    return user
+
+def _money(value) -> str:
+    return str(Decimal(str(value)).quantize(Decimal("0.01")))
+
+
+@router.get("/{user_id}/balances", response_model=dict)
+def get_user_balances(
+    user_id: int,
+    session: Session = Depends(get_session),
+    shard_sessions: List[Session] = Depends(shards.get_shard_sessions)
+):
+    """
+    Net position of the user per group and per counterparty, over pending debts.
+    A positive net means the counterparty owes the user.
+    """
+    cached = balance_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    user = session.get(Usuario, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    pending = Deuda.estado == 0
+    signed = union_all(
+        select(Deuda.grupo_id, Deuda.deudor_id.label("contraparte_id"), Deuda.monto.label("neto"))
+        .where((Deuda.acreedor_id == user_id) & pending),
+        select(Deuda.grupo_id, Deuda.acreedor_id.label("contraparte_id"), (-Deuda.monto).label("neto"))
+        .where((Deuda.deudor_id == user_id) & pending),
+    ).subquery()
+
+    net = func.sum(signed.c.neto).label("neto")
+    stmt = (
+        select(signed.c.grupo_id, Grupo.nombre, signed.c.contraparte_id, Usuario.nombre, net)
+        .join(Grupo, Grupo.id == signed.c.grupo_id)
+        .join(Usuario, Usuario.id == signed.c.contraparte_id)
+        .group_by(signed.c.grupo_id, Grupo.nombre, signed.c.contraparte_id, Usuario.nombre)
+        .order_by(signed.c.grupo_id, signed.c.contraparte_id)
+    )
+
+    groups = {}
+    total_receive = total_pay = Decimal("0")
+    rows = [row for shard_session in shard_sessions for row in shard_session.exec(stmt).all()]
+    for grupo_id, grupo_nombre, contraparte_id, contraparte_nombre, neto in rows:
+        neto = Decimal(str(neto)).quantize(Decimal("0.01"))
+        if neto == 0:
+            continue
+        group = groups.setdefault(grupo_id, {
+            "grupo_id": grupo_id,
+            "nombre": grupo_nombre,
+            "to_receive": Decimal("0"),
+            "to_pay": Decimal("0"),
+            "counterparties": [],
+        })
+        if neto > 0:
+            group["to_receive"] += neto
+            total_receive += neto
+        else:
+            group["to_pay"] -= neto
+            total_pay -= neto
+        group["counterparties"].append({
+            "usuario_id": contraparte_id,
+            "nombre": contraparte_nombre,
+            "net": _money(neto),
+        })
+
+    for group in groups.values():
+        group["net"] = _money(group["to_receive"] - group["to_pay"])
+        group["to_receive"] = _money(group["to_receive"])
+        group["to_pay"] = _money(group["to_pay"])
+
+    result = {
+        "usuario_id": user_id,
+        "to_receive": _money(total_receive),
+        "to_pay": _money(total_pay),
+        "net": _money(total_receive - total_pay),
+        "groups": list(groups.values()),
+    }
+    balance_cache.put(user_id, result)
+    return result
@@ -0,0 +1,134 @@
+"""
+Asientos de apertura del libro de deudas (ledger.py) para las deudas que ya
+existían antes de que se registraran movimientos. Usa las mismas variables de
+entorno que el backend.
+
+    python scripts/backfill_ledger.py --dry-run
+    python scripts/backfill_ledger.py
+
+Para cada deuda del grupo (incluidas las que ya no existen pero tienen
+movimientos) la suma de sus movimientos tiene que dar lo que tiene pendiente
+hoy: el monto si está pendiente, 0 si se pagó o se borró. Si no da, se agrega
+un movimiento `apertura` por la diferencia con la fecha de alta de la deuda
+(o la de su primer movimiento), así los saldos a cualquier fecha posterior la
+incluyen. Una deuda anterior al libro que después se pagó recibe su monto
+pendiente como apertura y el pago lo descuenta; una pagada antes no cambia
+ningún saldo pendiente y no lleva apertura. Las deudas borradas antes del
+libro no dejaron rastro y no se pueden reconstruir.
+
+Los snapshots de saldos del grupo desde la apertura más vieja se borran: se
+calcularon sin estos movimientos y el worker los vuelve a generar.
+
+Se puede correr más de una vez: después de la primera ya no quedan
+diferencias. Cada grupo se procesa en una transacción con su lock tomado.
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import delete, func, union
+from sqlmodel import Session, select
+
+from database import lock_group
+from models import Deuda, MovimientoDeuda, SaldoSnapshot
+import ledger
+import shards
+from split_engine import to_cents
+
+
+def _openings(session: Session, grupo_id: int) -> list:
+    """Movimientos de apertura que faltan para que el libro cierre con las deudas actuales"""
+    movidas = {}
+    for deuda_id, suma, desde, gasto_id, deudor_id, acreedor_id in session.exec(
+        select(
+            MovimientoDeuda.deuda_id,
+            func.sum(MovimientoDeuda.delta_centavos),
+            func.min(MovimientoDeuda.creado_en),
+            func.max(MovimientoDeuda.gasto_id),
+            func.max(MovimientoDeuda.deudor_id),
+            func.max(MovimientoDeuda.acreedor_id),
+        )
+        .where(MovimientoDeuda.grupo_id == grupo_id)
+        .group_by(MovimientoDeuda.deuda_id)
+    ).all():
+        movidas[deuda_id] = (int(suma), desde, gasto_id, deudor_id, acreedor_id)
+
+    rows = []
+
+    def apertura(deuda_id, gasto_id, deudor_id, acreedor_id, delta, fecha):
+        rows.append({
+            "grupo_id": grupo_id, "deuda_id": deuda_id, "gasto_id": gasto_id,
+            "deudor_id": deudor_id, "acreedor_id": acreedor_id,
+            "tipo": ledger.APERTURA, "delta_centavos": delta, "creado_en": fecha,
+        })
+
+    for deuda in session.exec(select(Deuda).where(Deuda.grupo_id == grupo_id)).all():
+        suma, desde, *_ = movidas.pop(deuda.id, (0, None, None, None, None))
+        delta = (to_cents(deuda.monto) if deuda.estado == 0 else 0) - suma
+        if delta:
+            fecha = min(f for f in (deuda.creado_en, desde) if f is not None)
+            apertura(deuda.id, deuda.gasto_id, deuda.deudor_id, deuda.acreedor_id, delta, fecha)
+
+    # Deudas que ya no existen: lo pendiente es 0
+    for deuda_id, (suma, desde, gasto_id, deudor_id, acreedor_id) in movidas.items():
+        if suma:
+            apertura(deuda_id, gasto_id, deudor_id, acreedor_id, -suma, desde)
+    return rows
+
+
+def backfill_group(session: Session, grupo_id: int, dry_run: bool) -> list:
+    lock_group(session, grupo_id)
+    rows = _openings(session, grupo_id)
+    if rows and not dry_run:
+        session.connection().execute(MovimientoDeuda.__table__.insert(), rows)
+        session.exec(
+            delete(SaldoSnapshot).where(
+                (SaldoSnapshot.grupo_id == grupo_id)
+                & (SaldoSnapshot.hasta >= min(r["creado_en"] for r in rows))
+            )
+        )
+        session.commit()
+    else:
+        session.rollback()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="solo informar las aperturas que faltan")
+    parser.add_argument("--group-id", type=int, default=None, help="procesar solo este grupo")
+    args = parser.parse_args()
+
+    totals = defaultdict(int)
+    for shard, shard_engine in enumerate(shards.engines):
+        with Session(shard_engine) as session:
+            grupos = union(select(Deuda.grupo_id), select(MovimientoDeuda.grupo_id)).subquery()
+            stmt = select(grupos.c.grupo_id).order_by(grupos.c.grupo_id)
+            if args.group_id is not None:
+                stmt = stmt.where(grupos.c.grupo_id == args.group_id)
+            grupo_ids = session.exec(stmt).all()
+            for grupo_id in grupo_ids:
+                rows = backfill_group(session, grupo_id, args.dry_run)
+                if rows:
+                    totals["grupos"] += 1
+                    totals["aperturas"] += len(rows)
+                    totals["centavos"] += sum(r["delta_centavos"] for r in rows)
+                    print(f"shard {shard} grupo {grupo_id}: {len(rows)} aperturas")
+            totals["revisados"] += len(grupo_ids)
+
+    accion = "faltan" if args.dry_run else "agregadas"
+    print(
+        f"{totals['revisados']} grupos revisados: {totals['aperturas']} aperturas {accion} en "
+        f"{totals['grupos']} grupos (suma {totals['centavos']} centavos)"
+    )
+
+
+if __name__ == "__main__":
+    main()
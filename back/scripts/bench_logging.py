@@ -0,0 +1,136 @@
+"""
+Compara el throughput del backend con `echo=True` contra el pipeline de logs
+(logs.py: cola + JSON + SQL muestreado).
+
+Levanta `uvicorn main:app` dos veces (usa las variables DB_* del entorno), con
+su stdout a un archivo como en un contenedor, y en cada una pide una ruta
+caliente desde varios hilos durante unos segundos:
+
+    python scripts/bench_logging.py --user-id 1 --group-id 1 --seconds 20 --threads 16
+
+Corrida de referencia (1 CPU, SQLite con 3 usuarios y 500 gastos en el grupo
+1, DATABASE_URL=sqlite:///bench.db, valores por defecto: 15 s, 16 hilos):
+
+    modo              req/s     p50 ms     p99 ms  errores   log MB
+    echo=True         190.5      77.58     171.08        0     8.25
+    pipeline          203.3      72.54     164.88        0     0.91
+
+Con 8 hilos y 20 s dio 165.8 contra 161.4 req/s (0.97x): con un solo núcleo la
+diferencia de throughput queda dentro del ruido y lo que cambia es el volumen
+de logs (~9x menos). Falta medir contra PostgreSQL con varios núcleos.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "echo=True": {"DB_ECHO": "1", "SQL_LOG_SAMPLE_RATE": "0"},
+    "pipeline": {"DB_ECHO": "0"},
+}
+
+
+def _get(url):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as res:
+            res.read()
+            status = res.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, (time.perf_counter() - started) * 1000
+
+
+def _wait_ready(base, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if _get(f"{base}/ready")[0] == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def _load(url, seconds, threads):
+    latencies, errors = [], []
+    stop = time.monotonic() + seconds
+
+    def worker():
+        while time.monotonic() < stop:
+            status, ms = _get(url)
+            (latencies if status == 200 else errors).append(ms)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, errors
+
+
+def run_mode(name, env_overrides, args):
+    env = {**os.environ, **env_overrides}
+    if name == "pipeline":
+        env["SQL_LOG_SAMPLE_RATE"] = str(args.sql_sample_rate)
+    log_file = tempfile.NamedTemporaryFile(prefix="bench_logging_", suffix=".log", delete=False)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACK_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        if not _wait_ready(base, args.timeout):
+            sys.exit(f"[{name}] el backend no quedó listo; ver {log_file.name}")
+        url = f"{base}/expenses/?grupo_id={args.group_id}&usuario_id={args.user_id}&limit=50"
+        _load(url, 2, args.threads)  # calentamiento
+        latencies, errors = _load(url, args.seconds, args.threads)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        log_file.close()
+
+    latencies.sort()
+    size = os.path.getsize(log_file.name)
+    os.unlink(log_file.name)
+    return {
+        "rps": len(latencies) / args.seconds,
+        "p50": statistics.median(latencies) if latencies else 0,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] if latencies else 0,
+        "errors": len(errors),
+        "log_mb": size / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--group-id", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sql-sample-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    results = {name: run_mode(name, env, args) for name, env in MODES.items()}
+
+    print(f"{'modo':<12} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errores':>8} {'log MB':>8}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['rps']:>10.1f} {r['p50']:>10.2f} {r['p99']:>10.2f} {r['errors']:>8} {r['log_mb']:>8.2f}")
+    base_rps = results["echo=True"]["rps"]
+    if base_rps:
+        print(f"\npipeline / echo=True: {results['pipeline']['rps'] / base_rps:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
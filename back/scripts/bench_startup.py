@@ -0,0 +1,81 @@
+"""
+Mide el tiempo de arranque y la latencia del primer request del backend.
+
+Levanta `uvicorn main:app` como subproceso (usa las variables DB_* del entorno),
+espera a que /ready devuelva 200 y después pide cada ruta caliente dos veces:
+la primera es la latencia que ve el balanceador justo después de un deploy.
+
+    python scripts/bench_startup.py --user-id 1 --group-id 1
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _get(url):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as res:
+            res.read()
+            status = res.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--group-id", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    routes = [
+        f"/expenses/?grupo_id={args.group_id}&usuario_id={args.user_id}",
+        f"/expenses/debts/{args.user_id}?grupo_id={args.group_id}",
+        f"/expenses/credits/{args.user_id}?grupo_id={args.group_id}",
+        f"/expenses/summary?grupo_id={args.group_id}&usuario_id={args.user_id}",
+        f"/groups/{args.group_id}/members",
+    ]
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACK_DIR,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                sys.exit("El servidor terminó antes de estar listo")
+            if time.perf_counter() - started > args.timeout:
+                sys.exit("Timeout esperando /ready")
+            try:
+                status, _ = _get(base + "/ready")
+                if status == 200:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.05)
+        ready_after = time.perf_counter() - started
+        print(f"listo en {ready_after * 1000:.0f} ms")
+
+        print(f"{'ruta':60} {'1er req (ms)':>13} {'2do req (ms)':>13}")
+        for route in routes:
+            _, first = _get(base + route)
+            _, second = _get(base + route)
+            print(f"{route:60} {first:13.1f} {second:13.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Administración de shards (ver shards.py). Usa las mismas variables de entorno
+que el backend (DB_* para la base global y SHARD_URLS).
+
+    python scripts/manage_shards.py init                  # tablas, rangos de ids y copia de usuarios
+    python scripts/manage_shards.py sync-users            # vuelve a copiar usuarios a todos los shards
+    python scripts/manage_shards.py move --group-id 12 --to 2
+
+Prueba local con SQLite:
+
+    SHARD_URLS=sqlite:///shard0.db,sqlite:///shard1.db python scripts/manage_shards.py init
+
+Un move que falla antes de cambiar el shard del grupo en la base global deja
+el grupo donde estaba y borra lo que llegó a copiar al destino; si falla
+después (borrando el origen), el grupo ya quedó movido y volver a correr el
+mismo move termina de borrar las filas viejas del origen.
+
+Los grupos movidos conservan sus ids. En PostgreSQL la secuencia del shard
+destino no se ve afectada; en SQLite el contador salta al id más alto copiado,
+así que ahí los rangos solo son confiables mientras no se muevan grupos.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, select
+
+from database import engine, lock_group
+from models import Cambio, Deuda, DeudaGasto, Gasto, GastoRecurrente, Grupo, MovimientoDeuda, SaldoSnapshot, Usuario, UsuarioGrupo
+import changes
+import ledger
+import shards
+
+# Cada shard genera ids en su propio rango, así siguen siendo únicos al mover grupos
+SHARD_ID_SPAN = 100_000_000
+GROUP_MODELS = (Cambio, SaldoSnapshot, MovimientoDeuda, DeudaGasto, Deuda, Gasto, GastoRecurrente, UsuarioGrupo)
+SHARDED_TABLES = ["gastos_recurrentes", "gastos", "deudas", "usuario_grupos", "deuda_gastos", "movimientos_deuda", "cambios", "saldos_snapshot"]
+COPY_BATCH_SIZE = 1000
+
+
+def _set_id_range(shard: int):
+    shard_engine = shards.engines[shard]
+    start = shard * SHARD_ID_SPAN
+    if start == 0:
+        return
+    with shard_engine.begin() as conn:
+        for table in SHARDED_TABLES:
+            current = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar()
+            if current >= start:
+                continue
+            if shard_engine.dialect.name == "postgresql":
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), :v)"), {"v": start})
+            elif shard_engine.dialect.name == "sqlite":
+                conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :t"), {"t": table})
+                conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:t, :v)"), {"t": table, "v": start})
+
+
+def sync_users():
+    with Session(engine) as session:
+        users = session.exec(select(Usuario)).all()
+    for user in users:
+        shards.replicate(user)
+    print(f"{len(users)} usuarios copiados a {len(shards.engines)} shard(s)")
+
+
+def init():
+    SQLModel.metadata.create_all(engine)
+    for shard, shard_engine in enumerate(shards.engines):
+        SQLModel.metadata.create_all(shard_engine)
+        _set_id_range(shard)
+    sync_users()
+
+
+def _copy(source: Session, target: Session, model, where):
+    copied = 0
+    stmt = select(model).where(where).order_by(model.id).execution_options(yield_per=COPY_BATCH_SIZE)
+    for obj in source.exec(stmt):
+        target.add(model(**obj.model_dump()))
+        copied += 1
+        if copied % COPY_BATCH_SIZE == 0:
+            target.flush()
+    target.flush()
+    return copied
+
+
+def _delete_group_rows(session: Session, group_id: int) -> int:
+    """Borra del shard de la sesión todas las filas del grupo. No hace commit."""
+    deleted = 0
+    for model in GROUP_MODELS:
+        deleted += session.exec(model.__table__.delete().where(model.grupo_id == group_id)).rowcount
+    if session.get_bind() is not engine:
+        session.exec(Grupo.__table__.delete().where(Grupo.id == group_id))
+    return deleted
+
+
+def _purge_leftovers(group_id: int, shard: int):
+    """Borra las filas del grupo que hayan quedado en otros shards por un move interrumpido"""
+    for other, shard_engine in enumerate(shards.engines):
+        if other == shard or shard_engine is shards.engines[shard]:
+            continue
+        with Session(shard_engine, info={ledger.SKIP: True, changes.SKIP: True}) as session:
+            deleted = _delete_group_rows(session, group_id)
+            session.commit()
+        if deleted:
+            print(f"{deleted} filas viejas del grupo {group_id} borradas del shard {other}")
+
+
+def move(group_id: int, to: int, wait: bool):
+    if not 0 <= to < len(shards.engines):
+        sys.exit(f"Shard inexistente: {to}")
+
+    with Session(engine) as session:
+        grupo = session.get(Grupo, group_id)
+        if not grupo:
+            sys.exit("Grupo no encontrado")
+        source = grupo.shard
+        if source == to:
+            print("El grupo ya está en ese shard")
+            _purge_leftovers(group_id, to)
+            return
+        if source == shards.MOVING:
+            sys.exit("El grupo ya se está moviendo")
+        grupo.shard = shards.MOVING
+        session.add(grupo)
+        session.commit()
+
+    source_engine = shards.engines[source]
+    target_engine = shards.engines[to]
+    # La historia (movimientos y cambios) se copia tal cual: las copias no generan entradas nuevas
+    history_copy = {ledger.SKIP: True, changes.SKIP: True}
+    copied = switched = False
+    try:
+        if wait:
+            # Que todas las réplicas vean el grupo como "en migración" antes de copiar
+            time.sleep(shards.ROUTING_TTL_SECONDS)
+
+        with Session(source_engine, info=history_copy) as src, Session(target_engine, info=history_copy) as dst:
+            lock_group(src, group_id)
+            grupo = src.get(Grupo, group_id) or Grupo(**_global_group(group_id))
+            # Restos de un move anterior interrumpido: la copia arranca siempre de cero
+            _delete_group_rows(dst, group_id)
+            dst.merge(Grupo(**{**grupo.model_dump(), "shard": to}))
+            counts = {
+                "usuario_grupos": _copy(src, dst, UsuarioGrupo, UsuarioGrupo.grupo_id == group_id),
+                "gastos_recurrentes": _copy(src, dst, GastoRecurrente, GastoRecurrente.grupo_id == group_id),
+                "gastos": _copy(src, dst, Gasto, Gasto.grupo_id == group_id),
+                "deudas": _copy(src, dst, Deuda, Deuda.grupo_id == group_id),
+                "deuda_gastos": _copy(src, dst, DeudaGasto, DeudaGasto.grupo_id == group_id),
+                "movimientos_deuda": _copy(src, dst, MovimientoDeuda, MovimientoDeuda.grupo_id == group_id),
+                "saldos_snapshot": _copy(src, dst, SaldoSnapshot, SaldoSnapshot.grupo_id == group_id),
+                "cambios": _copy(src, dst, Cambio, Cambio.grupo_id == group_id),
+            }
+            copied = True
+            dst.commit()
+
+            # A partir de acá el grupo vive en el destino: un error ya no lo devuelve al origen
+            _set_global_shard(group_id, to)
+            switched = True
+
+            _delete_group_rows(src, group_id)
+            src.commit()
+    except BaseException as e:
+        if switched:
+            sys.exit(
+                f"Grupo {group_id} movido al shard {to}, pero no se pudieron borrar sus filas del shard "
+                f"{source} ({e!r}); volvé a correr el mismo move para terminar"
+            )
+        if copied:
+            with Session(target_engine, info=history_copy) as dst:
+                _delete_group_rows(dst, group_id)
+                dst.commit()
+        _set_global_shard(group_id, source)
+        raise
+
+    print(f"Grupo {group_id} movido del shard {source} al {to}: {counts}")
+
+
+def _global_group(group_id: int) -> dict:
+    with Session(engine) as session:
+        return session.get(Grupo, group_id).model_dump()
+
+
+def _set_global_shard(group_id: int, shard: int):
+    with Session(engine) as session:
+        grupo = session.get(Grupo, group_id)
+        grupo.shard = shard
+        session.add(grupo)
+        session.commit()
+    shards.forget_route(group_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init")
+    sub.add_parser("sync-users")
+    move_parser = sub.add_parser("move")
+    move_parser.add_argument("--group-id", type=int, required=True)
+    move_parser.add_argument("--to", type=int, required=True)
+    move_parser.add_argument("--no-wait", action="store_true", help="No esperar el TTL del ruteo (una sola réplica)")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        init()
+    elif args.command == "sync-users":
+        sync_users()
+    else:
+        move(args.group_id, args.to, wait=not args.no_wait)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Conciliación nocturna de deudas contra gastos, de todos los grupos de todos
+los shards. Usa las mismas variables de entorno que el backend.
+
+    python scripts/reconcile_debts.py --workers 8 --deadline-minutes 90 --report conciliacion.jsonl
+    python scripts/reconcile_debts.py --repair 12 31
+
+Cada grupo se verifica en un proceso de un pool, que recorre sus gastos y sus
+deudas con cursores del lado del servidor, con el lock del grupo tomado (las
+escrituras del grupo esperan a que termine de leerlo). Se controla:
+
+- que el saldo de cada usuario según todas las deudas (pendientes y saldadas)
+  sea el que sale de repartir cada gasto entre los miembros actuales (y los ex
+  miembros que conserva su reparto, ver split_engine), igual que el recálculo
+  de deudas;
+- que ningún ex miembro deba algo pendiente (la baja se lo reasigna a los que
+  quedan), que solo se le deba a un ex miembro si pagó algún gasto del grupo y
+  que no haya montos <= 0.
+
+Los grupos con diferencias van al reporte (una línea JSON por grupo). La
+reparación no es automática: --repair recibe los grupos a reparar, elegidos
+a mano del reporte, y revisa solo esos. Cada uno se recalcula como POST
+/groups/{id}/recalculate-debts, que regenera las deudas pendientes y conserva
+las pagadas, y se verifica de nuevo.
+
+Los grupos más grandes se procesan primero, así el último en terminar es uno
+chico. Al vencer --deadline-minutes no se empiezan grupos nuevos; los que
+quedaron sin revisar se listan en el resumen.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import numpy as np
+from sqlalchemy import func, union_all
+from sqlmodel import Session, select
+
+from database import lock_group
+from models import Deuda, Gasto
+import membership
+import shards
+import split_engine
+from split_engine import to_cents
+
+BATCH_SIZE = 5000
+
+
+def _expected_net(session: Session, grupo_id: int, member_ids) -> tuple:
+    """
+    Saldo de cada usuario, en centavos, que dejan los gastos del grupo repartidos
+    entre los miembros, más los usuarios que pagaron algún gasto
+    """
+    net = defaultdict(int)
+    members = sorted(member_ids)
+    all_payers = set()
+    count = 0
+    stmt = (
+        select(Gasto.valor, Gasto.reparto, Gasto.usuario_id)
+        .where(Gasto.grupo_id == grupo_id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for rows in session.exec(stmt).partitions():
+        count += len(rows)
+        buckets = defaultdict(list)
+        for valor, reparto, usuario_id in rows:
+            buckets[reparto].append((to_cents(valor), usuario_id))
+        for reparto, gastos in buckets.items():
+            strategy = split_engine.parse(reparto)
+            matrix = split_engine.split_many([c for c, _ in gastos], members, strategy)
+            # Cada participante debe su parte y el que pagó recibe el total (su propia parte se cancela)
+            for member_id, cents in zip(strategy.participants(members), matrix.sum(axis=0).tolist()):
+                net[member_id] -= cents
+            payers, index = np.unique([p for _, p in gastos], return_inverse=True)
+            totals = np.bincount(index, weights=matrix.sum(axis=1))
+            for payer, cents in zip(payers.tolist(), totals.tolist()):
+                net[payer] += int(cents)
+            all_payers.update(payers.tolist())
+    return net, count, all_payers
+
+
+def _actual_net(session: Session, grupo_id: int, member_ids) -> tuple:
+    """Saldo de cada usuario según todas las deudas del grupo, más los problemas de las pendientes"""
+    net = defaultdict(int)
+    invalid = 0
+    outsider_debtors = set()
+    outsider_creditors = set()
+    count = 0
+    members = set(member_ids)
+    stmt = (
+        select(Deuda.deudor_id, Deuda.acreedor_id, Deuda.monto, Deuda.estado)
+        .where(Deuda.grupo_id == grupo_id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for rows in session.exec(stmt).partitions():
+        count += len(rows)
+        for deudor_id, acreedor_id, monto, estado in rows:
+            cents = to_cents(monto)
+            net[deudor_id] -= cents
+            net[acreedor_id] += cents
+            if estado != 0:
+                continue
+            if cents <= 0:
+                invalid += 1
+            if deudor_id not in members:
+                outsider_debtors.add(deudor_id)
+            if acreedor_id not in members:
+                outsider_creditors.add(acreedor_id)
+    return net, count, invalid, outsider_debtors, outsider_creditors
+
+
+def check_group(session: Session, grupo_id: int) -> dict:
+    """Verifica el grupo dentro de la transacción de la sesión (con el lock del grupo tomado)"""
+    lock_group(session, grupo_id)
+    member_ids = membership.member_ids(session, grupo_id)
+    result = {"grupo_id": grupo_id, "miembros": len(member_ids), "problemas": []}
+
+    payers = set()
+    try:
+        expected, result["gastos"], payers = _expected_net(session, grupo_id, member_ids)
+    except ValueError as e:
+        # Reparto que ya no cierra con los miembros actuales: el recálculo tampoco podría
+        result["problemas"].append(f"reparto_invalido: {e}")
+        expected = None
+
+    actual, result["deudas"], invalid, outsider_debtors, outsider_creditors = _actual_net(
+        session, grupo_id, member_ids
+    )
+
+    if expected is not None:
+        diffs = {
+            user_id: actual[user_id] - expected[user_id]
+            for user_id in sorted(set(expected) | set(actual))
+            if actual[user_id] != expected[user_id]
+        }
+        if diffs:
+            result["problemas"].append("saldos_distintos_de_los_gastos")
+            result["diferencias_centavos"] = diffs
+    if outsider_debtors:
+        result["problemas"].append("pendientes_de_no_miembros")
+        result["no_miembros"] = sorted(outsider_debtors)
+    if expected is not None and outsider_creditors - payers:
+        result["problemas"].append("pendientes_con_no_miembros")
+        result["acreedores_no_miembros"] = sorted(outsider_creditors - payers)
+    if invalid:
+        result["problemas"].append("montos_invalidos")
+        result["montos_invalidos"] = invalid
+    return result
+
+
+def _init_worker():
+    # El pool de conexiones heredado del proceso padre no se comparte: cada proceso abre las suyas
+    for shard_engine in shards.engines:
+        shard_engine.dispose(close=False)
+
+
+def reconcile_group(shard: int, grupo_id: int, repair: bool) -> dict:
+    started = time.perf_counter()
+    shard_engine = shards.engines[shard]
+    with Session(shard_engine) as session:
+        result = check_group(session, grupo_id)
+        session.rollback()
+
+        if repair and result["problemas"]:
+            from routers.groups import _recalculate_debts_for_group
+
+            try:
+                _recalculate_debts_for_group(session, grupo_id)
+            except ValueError as e:
+                session.rollback()
+                after = {"problemas": [f"reparto_invalido: {e}"]}
+            else:
+                after = check_group(session, grupo_id)
+                session.rollback()
+            result["reparado"] = not after["problemas"]
+            if after["problemas"]:
+                result["problemas_despues"] = after["problemas"]
+
+    result["shard"] = shard
+    result["segundos"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _groups_by_size(group_ids=None):
+    """(shard, grupo_id, filas) de los grupos con gastos o deudas (todos o `group_ids`), los más grandes primero"""
+    groups = []
+    for shard, shard_engine in enumerate(shards.engines):
+        filas = union_all(
+            select(Gasto.grupo_id.label("grupo_id")),
+            select(Deuda.grupo_id.label("grupo_id")),
+        ).subquery()
+        stmt = select(filas.c.grupo_id, func.count()).group_by(filas.c.grupo_id)
+        if group_ids:
+            stmt = stmt.where(filas.c.grupo_id.in_(group_ids))
+        with Session(shard_engine) as session:
+            groups += [(shard, gid, rows) for gid, rows in session.exec(stmt).all() if gid is not None]
+    return sorted(groups, key=lambda g: -g[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--deadline-minutes", type=float, default=None)
+    parser.add_argument("--report", default=f"conciliacion-{datetime.now():%Y%m%d}.jsonl")
+    parser.add_argument(
+        "--repair", type=int, nargs="+", metavar="GRUPO_ID", default=None,
+        help="revisar solo estos grupos y recalcular los que tengan diferencias",
+    )
+    parser.add_argument("--group-id", type=int, default=None, help="conciliar solo este grupo")
+    args = parser.parse_args()
+    if args.repair and args.group_id is not None:
+        parser.error("--group-id no se combina con --repair: los grupos a reparar se listan en --repair")
+
+    started = time.monotonic()
+    deadline = started + args.deadline_minutes * 60 if args.deadline_minutes else None
+    pending = _groups_by_size(args.repair or ([args.group_id] if args.group_id is not None else None))
+    total = len(pending)
+    pending.reverse()  # se sacan del final: primero los más grandes
+
+    checked = discrepant = repaired = failed = 0
+    with open(args.report, "w", encoding="utf-8") as report, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool:
+        running = {}
+        while pending or running:
+            while pending and len(running) < args.workers and (deadline is None or time.monotonic() < deadline):
+                shard, grupo_id, _ = pending.pop()
+                running[pool.submit(reconcile_group, shard, grupo_id, bool(args.repair))] = (shard, grupo_id)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard, grupo_id = running.pop(future)
+                checked += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    result = {"grupo_id": grupo_id, "shard": shard, "problemas": [f"error: {e}"]}
+                if result["problemas"]:
+                    discrepant += 1
+                    repaired += bool(result.get("reparado"))
+                    report.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    report.flush()
+
+    elapsed = time.monotonic() - started
+    print(
+        f"{checked}/{total} grupos revisados en {elapsed:.1f}s con {args.workers} procesos: "
+        f"{discrepant} con diferencias, {repaired} reparados, {failed} con error"
+    )
+    if pending:
+        print(f"Venció el plazo: {len(pending)} grupos sin revisar, p. ej. {[g for _, g, _ in pending[-10:]]}")
+    print(f"Reporte: {args.report}")
+    if pending or failed or discrepant > repaired:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
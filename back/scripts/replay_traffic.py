@@ -0,0 +1,194 @@
+"""
+Reproduce una captura de tráfico (capture.py, TRAFFIC_CAPTURE_FILE) contra una
+instancia corriendo y reporta latencias y errores por ruta.
+
+Respeta los tiempos entre requests de la captura, acelerados con --speed
+(--speed 0: todo lo más rápido posible), con a lo sumo --concurrency requests
+en vuelo a la vez:
+
+    python scripts/replay_traffic.py trafico.jsonl --url http://localhost:8000 --speed 4 --concurrency 32
+
+Los textos anonimizados del body se rellenan con un texto del mismo largo y
+los parámetros anonimizados se mandan tal cual, así que rutas como el login
+van a fallar: se reportan igual, como errores 4xx. Los códigos de invitación
+de accept/{code} sí se reproducen: para cada código capturado se genera una
+invitación nueva del mismo grupo (POST /groups/{id}/invites) la primera vez
+que aparece, fuera de las mediciones.
+No se reproducen las requests sin ruta (404 en la captura) ni las de body no
+JSON (subida de comprobantes).
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+INVITE_PLACEHOLDER = re.compile(r"invite-(\d+)-anon-[0-9a-f]+")  # ver capture.py
+
+
+def fill_body(shape):
+    """Arma un body con la forma capturada"""
+    if isinstance(shape, dict):
+        if set(shape) == {"$str"}:
+            return "r" * shape["$str"]
+        return {k: fill_body(v) for k, v in shape.items()}
+    if isinstance(shape, list):
+        return [fill_body(v) for v in shape]
+    return shape
+
+
+def load_trace(path):
+    records, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            body = record.get("b")
+            if record.get("p") is None or (isinstance(body, dict) and "$bytes" in body):
+                skipped += 1
+                continue
+            records.append(record)
+    records.sort(key=lambda r: r["t"])
+    return records, skipped
+
+
+class Invites:
+    """Código de invitación real por cada código anonimizado de la captura"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.codes = {}
+        self.lock = threading.Lock()
+
+    def _issue(self, placeholder):
+        group_id = INVITE_PLACEHOLDER.fullmatch(placeholder).group(1)
+        req = urllib.request.Request(f"{self.base_url}/groups/{group_id}/invites", data=b"", method="POST")
+        try:
+            with urllib.request.urlopen(req, timeout=60) as res:
+                return json.loads(res.read())["code"]
+        except (OSError, ValueError, KeyError):
+            # Grupo que no existe en esta base: el accept se manda igual y falla como en la captura
+            return placeholder
+
+    def resolve(self, path):
+        def real(match):
+            with self.lock:
+                if match.group(0) not in self.codes:
+                    self.codes[match.group(0)] = self._issue(match.group(0))
+                return self.codes[match.group(0)]
+        return INVITE_PLACEHOLDER.sub(real, path)
+
+
+def _send(base_url, record, invites=None):
+    path = invites.resolve(record["p"]) if invites else record["p"]
+    url = base_url + path
+    if record.get("q"):
+        url += "?" + urlencode(record["q"])
+    data = None
+    headers = {}
+    if record.get("b") is not None:
+        data = json.dumps(fill_body(record["b"])).encode()
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, method=record["m"], headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as res:
+            res.read()
+            status = res.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0  # conexión rechazada o timeout
+    return status, (time.perf_counter() - started) * 1000
+
+
+def replay(records, base_url, speed, concurrency):
+    results = defaultdict(list)  # (método, ruta) -> [(status, ms)]
+    lock = threading.Lock()
+    slots = threading.Semaphore(concurrency)
+    late = 0
+    invites = Invites(base_url)
+    # Las invitaciones se generan antes de medir
+    for record in records:
+        invites.resolve(record["p"])
+
+    def run(record):
+        try:
+            status, ms = _send(base_url, record, invites)
+            with lock:
+                results[(record["m"], record["r"])].append((status, ms))
+        finally:
+            slots.release()
+
+    t0 = records[0]["t"] if records else 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed > 0:
+                delay = (record["t"] - t0) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            if not slots.acquire(blocking=False):
+                # Todas las conexiones ocupadas: el replay va más lento que la captura
+                late += 1
+                slots.acquire()
+            pool.submit(run, record)
+    return results, time.monotonic() - started, late
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def report(results, records, elapsed, late, skipped):
+    captured = defaultdict(list)
+    for record in records:
+        captured[(record["m"], record["r"])].append(record["ms"])
+
+    total = sum(len(v) for v in results.values())
+    print(f"{total} requests en {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s), "
+          f"{late} demoradas por concurrencia, {skipped} omitidas")
+    print(f"{'ruta':<48} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'4xx':>6} {'5xx':>6} {'p50 cap':>8}")
+    rows = sorted(results.items(), key=lambda item: -len(item[1]))
+    for (method, route), samples in rows:
+        latencies = sorted(ms for _, ms in samples)
+        client_errors = sum(1 for status, _ in samples if 400 <= status < 500)
+        server_errors = sum(1 for status, _ in samples if status >= 500 or status == 0)
+        print(
+            f"{(method + ' ' + route)[:48]:<48} {len(samples):>6} "
+            f"{_percentile(latencies, 0.5):>8.1f} {_percentile(latencies, 0.95):>8.1f} "
+            f"{_percentile(latencies, 0.99):>8.1f} {client_errors / len(samples):>6.1%} "
+            f"{server_errors / len(samples):>6.1%} {statistics.median(captured[(method, route)]):>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tiempo real, 0 = sin esperas")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=None, help="reproducir solo las primeras N requests")
+    args = parser.parse_args()
+
+    records, skipped = load_trace(args.trace)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        sys.exit("La captura no tiene requests para reproducir")
+
+    results, elapsed, late = replay(records, args.url.rstrip("/"), args.speed, args.concurrency)
+    report(results, records, elapsed, late, skipped)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Prueba de estrés de creación concurrente de gastos contra una instancia corriendo.
+
+Crea un grupo con varios miembros, dispara miles de POST /expenses/ en paralelo
+y verifica que las deudas pendientes resultantes coincidan, par por par, con el
+reparto esperado de cada gasto y que ningún par tenga deudas en los dos sentidos.
+
+Con más concurrencia de la que admite el backend (admission.py) parte de los
+POST vuelven con 503: se reintentan después del Retry-After que indica la
+respuesta, hasta --retries veces.
+
+    python scripts/stress_expenses.py --url http://localhost:8000 --expenses 2000 --concurrency 64
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+RETRIES = 20
+_shed = 0
+_shed_lock = threading.Lock()
+
+
+def _request(base_url, method, path, body=None, retries=RETRIES):
+    global _shed
+    data = json.dumps(body).encode() if body is not None else None
+    for attempt in range(retries + 1):
+        req = urllib.request.Request(
+            base_url + path, data=data, method=method, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=60) as res:
+                return json.loads(res.read() or "null")
+        except urllib.error.HTTPError as e:
+            # Un 503 de admisión no llegó a tocar la base: se puede repetir tal cual
+            if e.code != 503 or attempt == retries:
+                raise
+            with _shed_lock:
+                _shed += 1
+            time.sleep(float(e.headers.get("Retry-After") or 1) * random.uniform(1, 1.5))
+
+
+def _setup_group(base_url, members):
+    run = int(time.time() * 1000)
+    users = []
+    for i in range(members):
+        users.append(_request(base_url, "POST", "/auth/register", {
+            "nombre": f"Stress{i}", "apellido": str(run), "mail": f"stress{i}-{run}@example.com", "password": "stress",
+        }))
+
+    group = _request(base_url, "POST", "/groups/", {"name": f"stress-{run}", "email": users[0]["mail"]})
+    code = _request(base_url, "POST", f"/groups/{group['id']}/invites")["code"]
+    for user in users[1:]:
+        _request(base_url, "POST", f"/groups/accept/{code}?user_id={user['id']}")
+    return group["id"], sorted(u["id"] for u in users)
+
+
+def _pair(deudor, acreedor, cents):
+    """(menor, mayor), centavos que el menor le debe al mayor"""
+    return ((deudor, acreedor), cents) if deudor < acreedor else ((acreedor, deudor), -cents)
+
+
+def _expected_pairs(expenses, member_ids):
+    """Neto esperado por par en centavos, con el mismo reparto que el backend"""
+    net = {}
+    total = len(member_ids)
+    for payer, cents in expenses:
+        base, remainder = divmod(cents, total)
+        for idx, uid in enumerate(member_ids):
+            share = base + (1 if idx < remainder else 0)
+            if uid != payer:
+                pair, signed = _pair(uid, payer, share)
+                net[pair] = net.get(pair, 0) + signed
+    return {pair: cents for pair, cents in net.items() if cents}
+
+
+def _actual_pairs(base_url, group_id, member_ids):
+    """Neto pendiente por par en centavos y los sentidos (deudor, acreedor) que aparecen"""
+    net, directions = {}, set()
+    for uid in member_ids:
+        for d in _request(base_url, "GET", f"/expenses/debts/{uid}?grupo_id={group_id}"):
+            if d["estado"] == 0:
+                directions.add((d["deudor_id"], d["acreedor_id"]))
+                pair, signed = _pair(d["deudor_id"], d["acreedor_id"], round(d["monto"] * 100))
+                net[pair] = net.get(pair, 0) + signed
+    return {pair: cents for pair, cents in net.items() if cents}, directions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--expenses", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--retries", type=int, default=RETRIES, help="reintentos por request ante un 503")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    group_id, member_ids = _setup_group(args.url, args.members)
+    # Dejar que termine el recálculo encolado por los ingresos al grupo
+    time.sleep(2)
+
+    expenses = [(rng.choice(member_ids), rng.randint(1, 100000)) for _ in range(args.expenses)]
+
+    def create(item):
+        payer, cents = item
+        _request(args.url, "POST", "/expenses/", {
+            "titulo": "stress", "valor": cents / 100, "fecha": "2024-01-01",
+            "autor": "stress", "usuario_id": payer, "grupo_id": group_id,
+        }, retries=args.retries)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(create, expenses))
+    elapsed = time.perf_counter() - started
+    print(f"{args.expenses} gastos en {elapsed:.2f}s ({args.expenses / elapsed:.0f}/s) en el grupo {group_id}, "
+          f"{_shed} reintentos por 503")
+
+    expected = _expected_pairs(expenses, member_ids)
+    actual, directions = _actual_pairs(args.url, group_id, member_ids)
+    ok = True
+    for pair in sorted(set(expected) | set(actual)):
+        if actual.get(pair, 0) != expected.get(pair, 0):
+            print(f"ERROR: par {pair}: esperado {expected.get(pair, 0)}, obtenido {actual.get(pair, 0)} centavos")
+            ok = False
+    for deudor, acreedor in sorted(directions):
+        if deudor < acreedor and (acreedor, deudor) in directions:
+            print(f"ERROR: deudas pendientes en los dos sentidos entre {deudor} y {acreedor}")
+            ok = False
+
+    print("OK" if ok else "FALLÓ")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
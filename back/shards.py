@@ -0,0 +1,182 @@
+"""
+Ruteo de los datos de cada grupo a una de varias bases (shards).
+
+- La base global (`database.engine`) tiene usuarios, grupos (con la columna
+  `shard` que dice dónde viven sus datos) y tareas.
+- Cada shard tiene gastos, deudas y usuario_grupos de sus grupos, más una copia
+  de usuarios y de sus filas de grupos para poder hacer joins localmente.
+
+SHARD_URLS es una lista de URLs separadas por coma; el índice de cada URL es el
+número de shard. Sin configurar, el único shard es la base global y todo se
+comporta como antes.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Generator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy import func
+from sqlmodel import Session, create_engine, select
+
+from database import DATABASE_URL, engine, engine_options
+from models import Deuda, Gasto, Grupo
+
+MOVING = -1  # Grupo.shard mientras se mueve de shard; las escrituras esperan
+ROUTING_TTL_SECONDS = float(os.getenv("SHARD_ROUTING_TTL", "30"))
+MOVING_RETRY_SECONDS = 2
+
+
+def _load_engines():
+    urls = [u.strip() for u in os.getenv("SHARD_URLS", "").split(",") if u.strip()]
+    if not urls:
+        return [engine]
+    return [
+        engine if url == DATABASE_URL else create_engine(url, **engine_options(url))
+        for url in urls
+    ]
+
+
+engines = _load_engines()
+
+_routes: Dict[int, Tuple[float, int]] = {}  # grupo_id -> (expira, shard)
+_routes_lock = threading.Lock()
+
+
+def is_sharded() -> bool:
+    return len(engines) > 1 or engines[0] is not engine
+
+
+def shard_for_group(grupo_id: int) -> int:
+    """
+    Número de shard del grupo según la tabla global de grupos (con cache). Un
+    grupo en migración no se cachea: se consulta de nuevo en cada request, así
+    deja de responder 503 apenas termina de moverse.
+    """
+    if not is_sharded():
+        return 0
+
+    now = time.monotonic()
+    with _routes_lock:
+        cached = _routes.get(grupo_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    with Session(engine) as session:
+        shard = session.exec(select(Grupo.shard).where(Grupo.id == grupo_id)).first()
+    if shard is None:
+        # Grupo inexistente: la ruta responde 404 al no encontrarlo en el shard 0
+        return 0
+    if shard == MOVING:
+        raise HTTPException(
+            status_code=503,
+            detail="El grupo se está migrando, reintentá en unos segundos",
+            headers={"Retry-After": str(MOVING_RETRY_SECONDS)},
+        )
+    with _routes_lock:
+        _routes[grupo_id] = (now + ROUTING_TTL_SECONDS, shard)
+    return shard
+
+
+def forget_route(grupo_id: int):
+    with _routes_lock:
+        _routes.pop(grupo_id, None)
+
+
+def engine_for_group(grupo_id: int):
+    return engines[shard_for_group(grupo_id)]
+
+
+def pick_shard_for_new_group() -> int:
+    """Shard con menos grupos, para repartir los grupos nuevos"""
+    if not is_sharded():
+        return 0
+    with Session(engine) as session:
+        counts = dict(session.exec(
+            select(Grupo.shard, func.count(Grupo.id)).group_by(Grupo.shard)
+        ).all())
+    return min(range(len(engines)), key=lambda shard: counts.get(shard, 0))
+
+
+def replicate(obj, shards: Optional[List[int]] = None):
+    """
+    Copia una fila de datos de referencia (usuario o grupo) a los shards que no
+    son la base global, conservando su id.
+    """
+    targets = range(len(engines)) if shards is None else shards
+    data = obj.model_dump()
+    for shard in targets:
+        shard_engine = engines[shard]
+        if shard_engine is engine:
+            continue
+        with Session(shard_engine) as session:
+            session.merge(type(obj)(**data))
+            session.commit()
+
+
+@contextmanager
+def group_session(grupo_id: int) -> Generator[Session, None, None]:
+    with Session(engine_for_group(grupo_id)) as session:
+        yield session
+
+
+# Dependencias de FastAPI
+
+def get_group_session(request: Request) -> Generator[Session, None, None]:
+    """Sesión del shard del grupo tomado de {group_id} en el path o ?grupo_id="""
+    raw = request.path_params.get("group_id") or request.query_params.get("grupo_id")
+    try:
+        grupo_id = int(raw)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="Falta grupo_id")
+    with group_session(grupo_id) as session:
+        yield session
+
+
+def get_shard_sessions(request: Request) -> Generator[List[Session], None, None]:
+    """
+    Sesiones a consultar: solo la del shard del grupo si viene ?grupo_id=,
+    si no una por shard (scatter-gather).
+    """
+    raw = request.query_params.get("grupo_id")
+    if raw is not None:
+        try:
+            selected = [engine_for_group(int(raw))]
+        except ValueError:
+            raise HTTPException(status_code=422, detail="grupo_id inválido")
+    else:
+        selected = engines
+    sessions = [Session(e) for e in selected]
+    try:
+        yield sessions
+    finally:
+        for session in sessions:
+            session.close()
+
+
+def _locate(model, obj_id: int) -> Generator[Session, None, None]:
+    """
+    Sesión del shard del grupo de la fila `obj_id` de `model` (o del shard 0 si
+    no está). El shard sale de la tabla global, no de dónde se encontró la
+    fila: durante un move puede estar en los dos, y con el grupo en migración
+    responde 503 como las demás rutas del grupo.
+    """
+    shard = 0
+    if is_sharded():
+        for index, shard_engine in enumerate(engines):
+            with Session(shard_engine) as session:
+                found = session.exec(select(model.id, model.grupo_id).where(model.id == obj_id)).first()
+            if found is not None:
+                shard = index if found.grupo_id is None else shard_for_group(found.grupo_id)
+                break
+    with Session(engines[shard]) as session:
+        yield session
+
+
+def get_expense_session(expense_id: int) -> Generator[Session, None, None]:
+    yield from _locate(Gasto, expense_id)
+
+
+def get_debt_session(debt_id: int) -> Generator[Session, None, None]:
+    yield from _locate(Deuda, debt_id)
@@ -0,0 +1,207 @@
+"""
+Reparto de gastos entre los miembros de un grupo, en centavos enteros.
+
+Cada estrategia convierte el monto de uno o muchos gastos en una matriz de
+shares (gastos x miembros) con operaciones de arrays, así recalcular miles de
+gastos es una sola pasada. Los centavos que sobran del redondeo se asignan por
+mayor resto y, a igual resto, por id de miembro ascendente: el reparto
+igualitario da exactamente lo mismo que base + resto por id ordenado.
+
+El reparto de un gasto se guarda en `Gasto.reparto` como JSON:
+
+    {"tipo": "igual", "excluidos": [4]}
+    {"tipo": "ponderado", "pesos": {"3": 2, "5": 1}}
+    {"tipo": "fijo", "montos": {"3": "12.50", "5": "7.50"}}
+    {"tipo": "fijo", "montos": {"3": "12.50", "9": "7.50"}, "ex_miembros": [9]}
+
+Sin reparto, el gasto se divide en partes iguales entre todos los miembros.
+`ex_miembros` solo lo escribe la baja de un miembro (routers/groups.py): esos
+usuarios ya no están en el grupo pero conservan su monto en el gasto, así un
+recálculo reproduce lo que dejó la baja. Un reparto nuevo no puede traerlo.
+"""
+import json
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+def to_cents(x) -> int:
+    """Monto (Decimal, float o str) a centavos enteros, redondeando la mitad hacia arriba"""
+    d = x if isinstance(x, Decimal) else Decimal(str(x))
+    return int((d * Decimal("100")).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_cents(c: int) -> Decimal:
+    return (Decimal(c) / Decimal("100")).quantize(Decimal("0.01"))
+
+
+def _apportion(amounts: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Reparte cada monto según los pesos; los centavos sobrantes van por mayor resto"""
+    total = int(weights.sum())
+    raw = amounts[:, None] * weights[None, :]
+    shares = raw // total
+    fractions = raw % total
+    missing = amounts - shares.sum(axis=1)
+
+    # Un centavo extra para los `missing` miembros de mayor resto (estable: a igual resto, menor id)
+    order = np.argsort(-fractions, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(weights.shape[0])[None, :], axis=1)
+    return shares + (ranks < missing[:, None])
+
+
+class SplitStrategy:
+    """
+    Estrategia de reparto; `member_ids` siempre llega ordenado.
+
+    Con `strict` (reparto nuevo que manda un usuario) nombrar a alguien que no
+    es miembro es un error. Sin `strict` (reparto guardado que se recalcula)
+    se asume que esa persona dejó el grupo: se ignora su exclusión o su peso,
+    y su monto fijo se reparte entre los demás.
+    """
+
+    strict = True
+
+    def participants(self, member_ids: Sequence[int]) -> List[int]:
+        """Usuarios entre los que se reparte (columnas de split_many), ordenados"""
+        return sorted(member_ids)
+
+    def split(self, amounts: np.ndarray, member_ids: Sequence[int]) -> np.ndarray:
+        raise NotImplementedError
+
+    def _check_members(self, named: Iterable[int], member_ids: Sequence[int]) -> set:
+        unknown = set(named) - set(member_ids)
+        if unknown and self.strict:
+            raise ValueError(f"Usuarios que no son miembros del grupo: {sorted(unknown)}")
+        return unknown
+
+
+class WeightedSplit(SplitStrategy):
+    def __init__(self, weights: Dict[int, int], excluded: Iterable[int] = (), strict: bool = True):
+        if any(w < 0 for w in weights.values()):
+            raise ValueError("Los pesos no pueden ser negativos")
+        self.weights = weights
+        self.excluded = set(excluded)
+        self.strict = strict
+
+    def _weight_vector(self, member_ids: Sequence[int]) -> np.ndarray:
+        self._check_members(set(self.weights) | self.excluded, member_ids)
+        weights = np.array(
+            [0 if m in self.excluded else self.weights.get(m, 0) for m in member_ids],
+            dtype=np.int64,
+        )
+        if not self.strict and weights.sum() == 0 and self.weights:
+            # Solo tenían peso los que se fueron: se reparte en partes iguales entre los que quedan
+            weights = np.array([0 if m in self.excluded else 1 for m in member_ids], dtype=np.int64)
+        return weights
+
+    def split(self, amounts: np.ndarray, member_ids: Sequence[int]) -> np.ndarray:
+        weights = self._weight_vector(member_ids)
+        if int(weights.sum()) == 0:
+            raise ValueError("El reparto no incluye a ningún miembro")
+        return _apportion(amounts, weights)
+
+
+class EqualSplit(WeightedSplit):
+    def __init__(self, excluded: Iterable[int] = (), strict: bool = True):
+        super().__init__({}, excluded, strict)
+
+    def _weight_vector(self, member_ids: Sequence[int]) -> np.ndarray:
+        self._check_members(self.excluded, member_ids)
+        return np.array([0 if m in self.excluded else 1 for m in member_ids], dtype=np.int64)
+
+
+class FixedSplit(SplitStrategy):
+    def __init__(self, amounts: Dict[int, int], strict: bool = True, kept: Iterable[int] = ()):
+        if any(a < 0 for a in amounts.values()):
+            raise ValueError("Los montos no pueden ser negativos")
+        self.amounts = amounts
+        self.strict = strict
+        # Ex miembros que conservan su monto (ver `ex_miembros` arriba)
+        self.kept = set(kept) & set(amounts)
+
+    def participants(self, member_ids: Sequence[int]) -> List[int]:
+        return sorted(set(member_ids) | self.kept)
+
+    def split(self, amounts: np.ndarray, member_ids: Sequence[int]) -> np.ndarray:
+        unknown = self._check_members(self.amounts, member_ids)
+        if np.any(amounts != sum(self.amounts.values())):
+            raise ValueError("Los montos fijos no suman el valor del gasto")
+        row = np.array([self.amounts.get(m, 0) for m in member_ids], dtype=np.int64)
+        result = np.tile(row, (len(amounts), 1))
+        orphan = sum(self.amounts[m] for m in unknown)
+        if orphan:
+            # Lo de los que se fueron, proporcional a lo que ya paga cada uno (o en partes iguales)
+            weights = row if row.sum() > 0 else np.ones(len(member_ids), dtype=np.int64)
+            result += _apportion(np.full(len(amounts), orphan, dtype=np.int64), weights)
+        return result
+
+
+def from_spec(spec: Optional[dict], strict: bool = True) -> SplitStrategy:
+    """
+    Construye la estrategia a partir del JSON de Gasto.reparto. Por defecto
+    valida contra los miembros actuales, como corresponde a un reparto nuevo.
+    """
+    if not spec:
+        return EqualSplit(strict=strict)
+    try:
+        tipo = spec.get("tipo", "igual")
+        excluded = [int(m) for m in spec.get("excluidos", [])]
+        if tipo == "igual":
+            return EqualSplit(excluded, strict)
+        if tipo == "ponderado":
+            return WeightedSplit({int(m): int(w) for m, w in spec["pesos"].items()}, excluded, strict)
+        if tipo == "fijo":
+            kept = [int(m) for m in spec.get("ex_miembros", [])]
+            if kept and strict:
+                raise ValueError("ex_miembros solo lo puede escribir la baja de un miembro")
+            return FixedSplit({int(m): to_cents(a) for m, a in spec["montos"].items()}, strict, kept)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f"Reparto inválido: {e}")
+    raise ValueError(f"Tipo de reparto desconocido: {tipo}")
+
+
+def parse(reparto: Optional[str], strict: bool = False) -> SplitStrategy:
+    """Estrategia de un reparto guardado; tolera miembros que ya dejaron el grupo"""
+    return from_spec(json.loads(reparto) if reparto else None, strict)
+
+
+def split_many(amounts_cents: Sequence[int], member_ids: Sequence[int], strategy: SplitStrategy) -> np.ndarray:
+    """
+    Matriz (gastos x participantes) de centavos; cada fila suma exactamente su
+    monto. Los participantes son `strategy.participants(member_ids)`: los
+    miembros, más los ex miembros que conserva un reparto fijo.
+    """
+    members = strategy.participants(member_ids)
+    amounts = np.asarray(amounts_cents, dtype=np.int64)
+    if len(amounts) == 0 or not members:
+        return np.zeros((len(amounts), len(members)), dtype=np.int64)
+    return strategy.split(amounts, members)
+
+
+def split_one(amount_cents: int, member_ids: Sequence[int], strategy: SplitStrategy) -> Dict[int, int]:
+    """Shares de un solo gasto: {usuario_id: centavos}"""
+    members = strategy.participants(member_ids)
+    row = split_many([amount_cents], members, strategy)[0]
+    return {m: int(c) for m, c in zip(members, row)}
+
+
+def split_expenses(expenses: Sequence, member_ids: Sequence[int]) -> List[Dict[int, int]]:
+    """
+    Shares de muchos gastos (objetos con `valor` y `reparto`), agrupados por
+    reparto para hacer una pasada vectorizada por cada reparto distinto.
+    """
+    members = sorted(member_ids)
+    result: List[Optional[Dict[int, int]]] = [None] * len(expenses)
+    buckets: Dict[Optional[str], List[int]] = {}
+    for idx, gasto in enumerate(expenses):
+        buckets.setdefault(gasto.reparto, []).append(idx)
+
+    for reparto, indexes in buckets.items():
+        strategy = parse(reparto)
+        matrix = split_many([to_cents(expenses[i].valor) for i in indexes], members, strategy)
+        columns = strategy.participants(members)
+        for i, row in zip(indexes, matrix.tolist()):
+            result[i] = dict(zip(columns, row))
+    return result
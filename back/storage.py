@@ -0,0 +1,193 @@
+"""
+Almacenamiento de comprobantes en el filesystem local.
+
+Los archivos se guardan direccionados por contenido (sha256), así un mismo
+comprobante subido varias veces ocupa espacio una sola vez. Las miniaturas se
+generan en un pool de procesos, fuera del request: `start` lo crea al arrancar
+la app, con procesos nuevos (spawn) en vez de fork, que desde un servidor con
+hilos puede copiar locks tomados. Si una miniatura falta (falló al generarse,
+se borró), se vuelve a pedir al subir de nuevo el comprobante o al pedirla.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Dict, Optional, Tuple
+
+RECEIPTS_DIR = os.getenv("RECEIPTS_DIR", os.path.join(os.path.dirname(__file__), "uploads", "comprobantes"))
+MAX_RECEIPT_BYTES = int(os.getenv("MAX_RECEIPT_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Cuánto espera un GET de una miniatura que falta a que se genere
+THUMBNAIL_TIMEOUT_SECONDS = float(os.getenv("THUMBNAIL_TIMEOUT_SECONDS", "10"))
+
+# content type -> extensión
+ALLOWED_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "application/pdf": ".pdf",
+}
+CONTENT_TYPES = {ext: content_type for content_type, ext in ALLOWED_TYPES.items()}
+
+_thumbnail_pool: Optional[ProcessPoolExecutor] = None
+_pending: Dict[str, Future] = {}  # miniatura -> su generación en curso
+_pending_lock = threading.Lock()
+
+logger = logging.getLogger("gestionapp.storage")
+
+
+class ReceiptTooLarge(Exception):
+    pass
+
+
+def _path_for(name: str) -> str:
+    # Dos niveles de directorios para no juntar miles de archivos en uno solo
+    return os.path.join(RECEIPTS_DIR, name[:2], name[2:4], name)
+
+
+def _thumbnail_name(name: str) -> str:
+    digest, _ = os.path.splitext(name)
+    return f"{digest}.thumb.jpg"
+
+
+def receipt_path(name: str) -> Optional[str]:
+    """Ruta en disco del comprobante `name` (<sha256><ext>), o None si no existe"""
+    digest, ext = os.path.splitext(name)
+    if ext not in CONTENT_TYPES or len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        return None
+    path = _path_for(name)
+    return path if os.path.isfile(path) else None
+
+
+def ensure_thumbnail(name: str) -> Optional[str]:
+    """
+    Ruta de la miniatura del comprobante `name`; si falta, la genera y espera
+    hasta THUMBNAIL_TIMEOUT_SECONDS. None si no es una imagen o no se pudo.
+    """
+    src = receipt_path(name)
+    if src is None or not CONTENT_TYPES[os.path.splitext(name)[1]].startswith("image/"):
+        return None
+    dst = _path_for(_thumbnail_name(name))
+    if os.path.isfile(dst):
+        return dst
+
+    future = _schedule_thumbnail(src, dst)
+    try:
+        if future is None:
+            _make_thumbnail(src, dst)
+        else:
+            future.result(timeout=THUMBNAIL_TIMEOUT_SECONDS)
+    except Exception:
+        logger.exception("No se pudo generar la miniatura de %s", name)
+        return None
+    return dst if os.path.isfile(dst) else None
+
+
+class ReceiptWriter:
+    """
+    Escribe un comprobante a disco a medida que llega, calculando el hash en el
+    camino. Corta con ReceiptTooLarge apenas se pasa de MAX_RECEIPT_BYTES; el
+    archivo parcial se borra con `abort`.
+    """
+
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+        self.ext = ALLOWED_TYPES[content_type]
+        self.size = 0
+        self._digest = hashlib.sha256()
+        os.makedirs(RECEIPTS_DIR, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=RECEIPTS_DIR, suffix=".part")
+        self._tmp = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > MAX_RECEIPT_BYTES:
+            raise ReceiptTooLarge()
+        self._digest.update(chunk)
+        self._tmp.write(chunk)
+
+    def commit(self) -> Tuple[str, bool]:
+        """Mueve el archivo a su ruta final; devuelve (nombre, creado)"""
+        self._tmp.close()
+        name = self._digest.hexdigest() + self.ext
+        path = _path_for(name)
+        created = not os.path.exists(path)
+        if created:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        else:
+            os.remove(self._tmp_path)
+
+        thumbnail = _path_for(_thumbnail_name(name))
+        if self.content_type.startswith("image/") and not os.path.isfile(thumbnail):
+            # También al volver a subir uno existente cuya miniatura falta
+            _schedule_thumbnail(path, thumbnail)
+        return name, created
+
+    def abort(self):
+        self._tmp.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def save_receipt(source: BinaryIO, content_type: str) -> Tuple[str, bool]:
+    """
+    Copia `source` a disco de a chunks (ver ReceiptWriter).
+    Devuelve (nombre, creado); si el contenido ya existía no se vuelve a guardar.
+    """
+    writer = ReceiptWriter(content_type)
+    try:
+        while chunk := source.read(CHUNK_SIZE):
+            writer.write(chunk)
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _make_thumbnail(src: str, dst: str):
+    from PIL import Image
+
+    with Image.open(src) as img:
+        img.thumbnail(THUMBNAIL_SIZE)
+        tmp = dst + ".part"
+        img.convert("RGB").save(tmp, "JPEG", quality=80)
+        os.replace(tmp, dst)
+
+
+def _schedule_thumbnail(src: str, dst: str) -> Optional[Future]:
+    """Encola la miniatura en el pool (una sola vez aunque se pida de a varios); None si no hay pool"""
+    if _thumbnail_pool is None:
+        # Sin la app arrancada (scripts, tests): se genera cuando se pide
+        return None
+    with _pending_lock:
+        future = _pending.get(dst)
+        submitted = future is None
+        if submitted:
+            future = _pending[dst] = _thumbnail_pool.submit(_make_thumbnail, src, dst)
+    if submitted:
+        # Fuera del lock: si ya terminó, el callback corre en este mismo hilo
+        future.add_done_callback(lambda _: _pending.pop(dst, None))
+    return future
+
+
+def start():
+    """Crea el pool de miniaturas; llamar al arrancar la app"""
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        _thumbnail_pool = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+
+
+def shutdown():
+    global _thumbnail_pool
+    if _thumbnail_pool is not None:
+        _thumbnail_pool.shutdown(wait=False)
+        _thumbnail_pool = None
+    _pending.clear()
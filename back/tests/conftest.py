@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Los módulos del backend se importan como en la app: desde back/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Base SQLite descartable: los tests nunca tocan la base configurada en el entorno
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="gestionapp-tests-"), "test.db")
+os.environ.pop("SHARD_URLS", None)
+
+
+@pytest.fixture
+def engine():
+    """Tablas vacías y caches en proceso vacíos para cada test"""
+    from sqlmodel import SQLModel
+
+    import balance_cache
+    import database
+    import membership
+    import models  # noqa: F401 (registra las tablas)
+
+    SQLModel.metadata.drop_all(database.engine)
+    SQLModel.metadata.create_all(database.engine)
+    membership.clear()
+    balance_cache.clear()
+    return database.engine
+
+
+@pytest.fixture
+def client(engine):
+    """Cliente HTTP de la app, sin el ciclo de vida (no arranca el worker de jobs)"""
+    from fastapi.testclient import TestClient
+
+    from main import create_app
+
+    return TestClient(create_app())
@@ -0,0 +1,77 @@
+import asyncio
+
+import admission
+
+
+def test_connections_per_route():
+    key = [(b"idempotency-key", b"abc")]
+    assert admission.connections("GET", "/expenses/", []) == 1
+    assert admission.connections("GET", "/users/3/balances", []) == 2
+    assert admission.connections("POST", "/groups/accept/xyz", []) == 2
+    assert admission.connections("POST", "/expenses/", key) == 2
+    assert admission.connections("GET", "/expenses/", key) == 1
+
+
+def test_capacity_is_counted_in_connections():
+    async def scenario():
+        controller = admission.AdmissionController(capacity=3)
+        assert await controller.acquire(admission.LECTURA, 2)
+        # Queda una sola conexión: la siguiente de dos espera a que se libere
+        waiting = asyncio.ensure_future(controller.acquire(admission.LECTURA, 2))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        # Y una de una conexión no se le adelanta
+        assert controller.stats()["classes"][admission.LECTURA]["queued"] == 1
+        later = asyncio.ensure_future(controller.acquire(admission.LECTURA, 1))
+        await asyncio.sleep(0)
+        assert not later.done()
+
+        controller.release(admission.LECTURA, 2)
+        assert await waiting
+        assert await later
+        assert controller.stats()["in_flight"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_shed_write_gets_retry_after_and_a_later_retry_is_admitted():
+    async def scenario():
+        open_gate = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await open_gate.wait()
+            await send({"type": "http.response.start", "status": 201, "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        controller = admission.AdmissionController(capacity=4)
+        middleware = admission.AdmissionMiddleware(app, controller=controller)
+        escritura = controller.classes[admission.ESCRITURA]
+
+        async def post():
+            scope = {"type": "http", "method": "POST", "path": "/expenses/", "headers": []}
+            sent = []
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                sent.append(message)
+
+            await middleware(scope, receive, send)
+            return sent[0]
+
+        # Se llenan los lugares de escritura y su cola
+        held = [asyncio.ensure_future(post()) for _ in range(escritura.max_in_flight + escritura.max_queued)]
+        await asyncio.sleep(0)
+
+        shed = await post()
+        assert shed["status"] == 503
+        assert (b"retry-after", str(escritura.retry_after).encode()) in shed["headers"]
+
+        open_gate.set()
+        assert [r["status"] for r in await asyncio.gather(*held)] == [201] * len(held)
+        retry = await post()
+        assert retry["status"] == 201
+        assert controller.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+import ledger
+from models import Deuda, Gasto, Grupo, MovimientoDeuda, Usuario
+from scripts import backfill_ledger
+
+
+def test_backfill_opens_debts_that_predate_the_ledger(engine):
+    antes = datetime.now() - timedelta(days=10)
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in (1, 2, 3):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+        session.add(Gasto(id=1, titulo="Super", valor=30.0, fecha=antes.date(), autor="a", usuario_id=1, grupo_id=1))
+        session.commit()
+
+    # Deudas cargadas antes de que existiera el libro: sin movimientos
+    with Session(engine, info={ledger.SKIP: True}) as session:
+        session.add(Deuda(id=1, gasto_id=1, deudor_id=2, acreedor_id=1, grupo_id=1, monto=10.0, creado_en=antes))
+        session.add(Deuda(id=2, gasto_id=1, deudor_id=3, acreedor_id=1, grupo_id=1, monto=10.0, creado_en=antes))
+        session.add(Deuda(id=3, gasto_id=1, deudor_id=3, acreedor_id=2, grupo_id=1, monto=4.0, estado=1, creado_en=antes))
+        session.commit()
+
+    # Después del libro se paga una de las viejas: queda un "saldada" sin su alta
+    with Session(engine) as session:
+        deuda = session.get(Deuda, 2)
+        deuda.estado = 1
+        session.add(deuda)
+        session.commit()
+
+    with Session(engine) as session:
+        rows = backfill_ledger.backfill_group(session, 1, dry_run=False)
+        assert sorted((r["deuda_id"], r["delta_centavos"]) for r in rows) == [(1, 1000), (2, 1000)]
+
+        assert ledger.balances_as_of(session, 1, datetime.now()) == {1: 1000, 2: -1000, 3: 0}
+        assert ledger.balances_as_of(session, 1, antes - timedelta(days=1)) == {}
+        tipos = session.exec(select(MovimientoDeuda.tipo).where(MovimientoDeuda.deuda_id == 1)).all()
+        assert tipos == [ledger.APERTURA]
+
+        assert backfill_ledger.backfill_group(session, 1, dry_run=False) == []
@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+import capture
+import warmup
+from main import create_app
+from models import Grupo, Usuario, UsuarioGrupo
+from scripts import replay_traffic
+
+
+def _group(engine):
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in (1, 2):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+        session.add(UsuarioGrupo(usuario_id=1, grupo_id=1))
+        session.commit()
+
+
+def test_invite_code_is_captured_as_a_placeholder_the_replay_reissues(engine, client):
+    _group(engine)
+    code = client.post("/groups/1/invites").json()["code"]
+
+    placeholder = capture._anonymize_param("code", code)
+    assert placeholder.startswith("invite-1-anon-")
+    assert code.split("-", 1)[1] not in placeholder
+    assert capture._anonymize_param("code", code) == placeholder
+
+    invites = replay_traffic.Invites("")
+    issued = []
+
+    def issue(placeholder):
+        issued.append(placeholder)
+        return client.post("/groups/1/invites").json()["code"]
+
+    invites._issue = issue
+    path = invites.resolve(f"/groups/accept/{placeholder}")
+    assert invites.resolve(f"/groups/accept/{placeholder}") == path
+    assert issued == [placeholder]
+
+    assert client.post(path, params={"user_id": 2}).json()["joined"]
+
+
+def test_only_the_internal_warmup_skips_capture(engine, tmp_path, monkeypatch):
+    trace = tmp_path / "trafico.jsonl"
+    monkeypatch.setattr(capture, "CAPTURE_FILE", str(trace))
+    app = create_app()
+
+    TestClient(app).get("/users/-1", headers={"x-warmup": "1"})
+    asyncio.run(warmup._request(app, "/users/-2"))
+    capture.shutdown()
+
+    paths = [json.loads(line)["p"] for line in trace.read_text().splitlines()]
+    assert paths == ["/users/-1"]
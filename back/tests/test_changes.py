@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, update
+
+import changes
+from models import Cambio, Grupo, Usuario, UsuarioGrupo
+
+GASTO = {"titulo": "Super", "descripcion": "", "fecha": "2026-01-01", "autor": "a", "grupo_id": 1, "usuario_id": 1}
+
+
+def test_sync_after_purge_returns_snapshot_of_current_rows(engine, client):
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in (1, 2):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+            session.add(UsuarioGrupo(usuario_id=i, grupo_id=1))
+        session.commit()
+    primero = client.post("/expenses/", json={**GASTO, "valor": 10.0}).json()["id"]
+    viejo = client.get("/groups/1/changes", params={"since": 1}).json()["cursor"]
+    client.post("/expenses/", json={**GASTO, "valor": 4.0})
+
+    with Session(engine) as session:
+        session.exec(update(Cambio).values(creado_en=datetime.now() - changes.RETENTION - timedelta(days=1)))
+        session.commit()
+    changes.purge_old()
+
+    for since in (0, viejo):
+        res = client.get("/groups/1/changes", params={"since": since, "limit": 1}).json()
+        assert res["snapshot"] is True
+        assert primero in {g["id"] for g in res["gastos"]}
+        assert len(res["gastos"]) == 2 and len(res["miembros"]) == 2 and len(res["deudas"]) == 2
+        assert res["has_more"] is False
+
+    incremental = client.get("/groups/1/changes", params={"since": res["cursor"]}).json()
+    assert incremental["snapshot"] is False
+    assert incremental["gastos"] == [] and incremental["cursor"] == res["cursor"]
@@ -0,0 +1,60 @@
+from sqlmodel import Session, select
+
+import compaction
+from models import Deuda, DeudaGasto, Grupo, Usuario, UsuarioGrupo
+
+GASTO = {"titulo": "Super", "descripcion": "", "fecha": "2026-01-01", "autor": "a", "grupo_id": 1}
+
+
+def _consolidated_debt(engine, client):
+    """U2 le debe a U1 la mitad de tres gastos de 20, compactados en una sola deuda de 30"""
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in (1, 2):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+            session.add(UsuarioGrupo(usuario_id=i, grupo_id=1))
+        session.commit()
+    ids = [client.post("/expenses/", json={**GASTO, "valor": 20.0, "usuario_id": 1}).json()["id"] for _ in range(3)]
+    with Session(engine) as session:
+        assert compaction.compact_group(session, 1, min_rows=2) == 2
+    return ids
+
+
+def _state(engine):
+    with Session(engine) as session:
+        debts = sorted((d.deudor_id, d.acreedor_id, round(d.monto, 2)) for d in session.exec(select(Deuda)))
+        parts = sorted((p.gasto_id, round(p.monto, 2)) for p in session.exec(select(DeudaGasto)))
+    return debts, parts
+
+
+def test_netting_keeps_parts_in_sync(engine, client):
+    ids = _consolidated_debt(engine, client)
+
+    client.post("/expenses/", json={**GASTO, "valor": 50.0, "usuario_id": 2})
+
+    # El neteo de 25 se descuenta de las partes más viejas
+    assert _state(engine) == ([(2, 1, 5.0)], [(ids[2], 5.0)])
+
+
+def test_detach_after_netting_keeps_other_expenses_shares(engine, client):
+    ids = _consolidated_debt(engine, client)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 2})
+    assert _state(engine) == ([(2, 1, 15.0)], [(ids[1], 5.0), (ids[2], 10.0)])
+
+    assert client.delete(f"/expenses/{ids[2]}").status_code == 200
+
+    assert _state(engine) == ([(2, 1, 5.0)], [(ids[1], 5.0)])
+
+
+def test_detach_fixes_parts_left_out_of_sync(engine, client):
+    ids = _consolidated_debt(engine, client)
+    with Session(engine) as session:
+        # Como la dejaba el neteo antes de ajustar las partes
+        deuda = session.exec(select(Deuda)).one()
+        deuda.monto = 5.0
+        session.add(deuda)
+        session.commit()
+
+    assert client.delete(f"/expenses/{ids[0]}").status_code == 200
+
+    assert _state(engine) == ([(2, 1, 5.0)], [(ids[2], 5.0)])
@@ -0,0 +1,79 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel import Session, select
+
+import split_engine
+from models import Deuda, Grupo, Usuario, UsuarioGrupo
+
+GASTO = {"titulo": "Super", "descripcion": "", "fecha": "2026-01-01", "autor": "a", "grupo_id": 1, "usuario_id": 1}
+
+
+def _group_with_expenses(engine, client, count, members=2):
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in range(1, members + 1):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+            session.add(UsuarioGrupo(usuario_id=i, grupo_id=1))
+        session.commit()
+    for _ in range(count):
+        assert client.post("/expenses/", json={**GASTO, "valor": 10.0}).status_code == 200
+
+
+def test_list_without_limit_or_cursor_returns_everything(engine, client):
+    _group_with_expenses(engine, client, 60)
+
+    res = client.get("/expenses/", params={"grupo_id": 1, "usuario_id": 1})
+
+    assert len(res.json()) == 60
+    assert "X-Next-Cursor" not in res.headers
+
+
+def test_list_pages_with_limit_and_cursor(engine, client):
+    _group_with_expenses(engine, client, 60)
+    params = {"grupo_id": 1, "usuario_id": 1}
+
+    first = client.get("/expenses/", params={**params, "limit": 40})
+    second = client.get("/expenses/", params={**params, "cursor": first.headers["X-Next-Cursor"]})
+
+    assert len(first.json()) == 40
+    assert len(second.json()) == 20
+    assert "X-Next-Cursor" not in second.headers
+    ids = [g["id"] for g in first.json() + second.json()]
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_concurrent_expenses_net_like_a_serial_run(engine, client):
+    members = [1, 2, 3, 4]
+    _group_with_expenses(engine, client, 0, members=len(members))
+    rng = random.Random(7)
+    expenses = [(rng.choice(members), rng.randint(1, 20000)) for _ in range(120)]
+
+    def create(item):
+        payer, cents = item
+        return client.post("/expenses/", json={**GASTO, "usuario_id": payer, "valor": cents / 100}).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert set(pool.map(create, expenses)) == {200}
+
+    # Lo mismo de a uno: cuánto le debe el menor de cada par al mayor, en centavos
+    expected = {}
+    for payer, cents in expenses:
+        for member, share in split_engine.split_one(cents, members, split_engine.EqualSplit()).items():
+            if member != payer:
+                pair, sign = ((member, payer), 1) if member < payer else ((payer, member), -1)
+                expected[pair] = expected.get(pair, 0) + sign * share
+
+    with Session(engine) as session:
+        pending = session.exec(select(Deuda).where(Deuda.estado == 0)).all()
+    actual, directions = {}, set()
+    for deuda in pending:
+        directions.add((deuda.deudor_id, deuda.acreedor_id))
+        pair, sign = (
+            ((deuda.deudor_id, deuda.acreedor_id), 1) if deuda.deudor_id < deuda.acreedor_id
+            else ((deuda.acreedor_id, deuda.deudor_id), -1)
+        )
+        actual[pair] = actual.get(pair, 0) + sign * split_engine.to_cents(deuda.monto)
+
+    assert {p: c for p, c in actual.items() if c} == {p: c for p, c in expected.items() if c}
+    assert not [(d, a) for d, a in directions if (a, d) in directions]
@@ -0,0 +1,213 @@
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from models import Deuda, Grupo, Usuario, UsuarioGrupo
+
+GASTO = {"titulo": "Super", "descripcion": "", "fecha": "2026-01-01", "autor": "a", "grupo_id": 1}
+
+
+def _group_with_members(engine, n):
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in range(1, n + 1):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+            session.add(UsuarioGrupo(usuario_id=i, grupo_id=1))
+        session.commit()
+
+
+def _pending(engine):
+    with Session(engine) as session:
+        return sorted(
+            (d.deudor_id, d.acreedor_id, round(d.monto, 2))
+            for d in session.exec(select(Deuda).where(Deuda.estado == 0))
+        )
+
+
+def _net_pending(engine):
+    """Saldo pendiente neto por par {(menor, mayor): centavos que menor le debe a mayor}"""
+    net = {}
+    for deudor, acreedor, monto in _pending(engine):
+        par, signo = ((deudor, acreedor), 1) if deudor < acreedor else ((acreedor, deudor), -1)
+        net[par] = round(net.get(par, 0) + signo * monto, 2)
+    return {par: monto for par, monto in net.items() if monto}
+
+
+def _one_direction_per_pair(engine):
+    pares = {(d, a) for d, a, _ in _pending(engine)}
+    return not any((a, d) in pares for d, a in pares)
+
+
+def test_member_removal_nets_reassigned_debts(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    client.post("/expenses/", json={**GASTO, "valor": 60.0, "usuario_id": 2})
+    assert _pending(engine) == [(1, 2, 10.0), (3, 1, 10.0), (3, 2, 20.0)]
+
+    assert client.delete("/groups/1/members/3").status_code == 200
+
+    # Lo que debía 3 lo absorben 1 y 2 a medias (la parte del propio acreedor se cancela)
+    assert _net_pending(engine) == {(1, 2): 15.0}
+    assert _one_direction_per_pair(engine)
+
+
+def test_recalculate_after_member_removal_reproduces_the_reassignment(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    client.post("/expenses/", json={**GASTO, "valor": 60.0, "usuario_id": 2})
+    client.post("/expenses/", json={**GASTO, "valor": 12.0, "usuario_id": 3})
+    assert client.delete("/groups/1/members/3").status_code == 200
+    after_removal = _net_pending(engine)
+
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+
+    assert _net_pending(engine) == after_removal
+    assert _one_direction_per_pair(engine)
+
+
+def test_member_removal_keeps_what_is_owed_to_the_member(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 3})
+
+    assert client.delete("/groups/1/members/3").status_code == 200
+    assert _pending(engine) == [(1, 3, 10.0), (2, 3, 10.0)]
+
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+    assert _pending(engine) == [(1, 3, 10.0), (2, 3, 10.0)]
+
+
+def test_member_removal_keeps_settled_shares(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    with Session(engine) as session:
+        deuda = session.exec(select(Deuda).where(Deuda.deudor_id == 3)).one()
+    client.patch(f"/expenses/debts/{deuda.id}/settle")
+
+    assert client.delete("/groups/1/members/3").status_code == 200
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+
+    assert _pending(engine) == [(2, 1, 10.0)]
+
+
+def test_removing_the_only_debtor_of_a_two_member_group_is_refused(engine, client):
+    _group_with_members(engine, 2)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+
+    assert client.delete("/groups/1/members/2").status_code == 409
+    assert _pending(engine) == [(2, 1, 15.0)]
+
+    # El acreedor sí se puede ir: lo que le deben sigue pendiente
+    assert client.delete("/groups/1/members/1").status_code == 200
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+    assert _pending(engine) == [(2, 1, 15.0)]
+
+
+def test_new_member_after_a_removal_is_charged_for_existing_expenses(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    client.delete("/groups/1/members/3")
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    code = client.post("/groups/1/invites").json()["code"]
+    with Session(engine) as session:
+        session.add(Usuario(id=4, nombre="U4", apellido="A", mail="u4@mail.com", password="x"))
+        session.commit()
+
+    res = client.post(f"/groups/accept/{code}", params={"user_id": 4})
+
+    assert res.json()["job_id"] is not None
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+    # El gasto de antes de la baja quedó fijo entre 1 y 2; el de después se reparte con 4
+    assert _net_pending(engine) == {(1, 2): -25.0, (1, 4): -10.0}
+
+
+def test_recalculate_without_removals_rebuilds_debts(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    with Session(engine) as session:
+        session.add(Usuario(id=4, nombre="U4", apellido="A", mail="u4@mail.com", password="x"))
+        session.add(UsuarioGrupo(usuario_id=4, grupo_id=1))
+        session.commit()
+
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+    assert _pending(engine) == [(2, 1, 7.5), (3, 1, 7.5), (4, 1, 7.5)]
+
+
+def test_recalculate_matches_the_incremental_netting_with_constant_queries(engine, client):
+    _group_with_members(engine, 4)
+    for i in range(24):
+        client.post("/expenses/", json={**GASTO, "valor": 10.0 + i * 3.17, "usuario_id": i % 4 + 1})
+    incremental = _net_pending(engine)
+    selects = []
+
+    def count(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM deudas" in statement:
+            selects.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        assert client.post("/groups/1/recalculate-debts").status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert _net_pending(engine) == incremental
+    assert _one_direction_per_pair(engine)
+    # Pendientes y pagadas una vez cada una, no una consulta por deuda
+    assert len(selects) <= 2
+
+
+def test_recalculate_keeps_settled_debts_and_discounts_them(engine, client):
+    _group_with_members(engine, 3)
+    client.post("/expenses/", json={**GASTO, "valor": 30.0, "usuario_id": 1})
+    with Session(engine) as session:
+        deuda = session.exec(select(Deuda).where(Deuda.deudor_id == 2)).one()
+    assert client.patch(f"/expenses/debts/{deuda.id}/settle").status_code == 200
+    with Session(engine) as session:
+        session.add(Usuario(id=4, nombre="U4", apellido="A", mail="u4@mail.com", password="x"))
+        session.add(UsuarioGrupo(usuario_id=4, grupo_id=1))
+        session.commit()
+
+    assert client.post("/groups/1/recalculate-debts").status_code == 200
+
+    with Session(engine) as session:
+        pagada = session.get(Deuda, deuda.id)
+        assert (pagada.estado, pagada.deudor_id, pagada.acreedor_id, round(pagada.monto, 2)) == (1, 2, 1, 10.0)
+    # 2 ya pagó 10 de los 7.50 que ahora le tocan: 1 le devuelve la diferencia
+    assert _pending(engine) == [(1, 2, 2.5), (3, 1, 7.5), (4, 1, 7.5)]
+
+
+def test_members_show_current_user_data_with_cached_membership(engine, client):
+    _group_with_members(engine, 2)
+    assert [m["nombre"] for m in client.get("/groups/1/members").json()] == ["U1", "U2"]
+
+    with Session(engine) as session:
+        usuario = session.get(Usuario, 2)
+        usuario.nombre = "Ana"
+        usuario.mail = "ana@mail.com"
+        session.add(usuario)
+        session.commit()
+
+    members = client.get("/groups/1/members").json()
+    assert [(m["nombre"], m["correo"]) for m in members] == [("U1", "u1@mail.com"), ("Ana", "ana@mail.com")]
+
+
+def test_only_cached_user_fields_bump_the_membership_version(engine, client):
+    _group_with_members(engine, 2)
+    client.get("/groups/1/members")
+
+    def version():
+        with Session(engine) as session:
+            return session.get(Grupo, 1).version_miembros
+
+    before = version()
+    with Session(engine) as session:
+        usuario = session.get(Usuario, 2)
+        usuario.password = "otra"
+        session.add(usuario)
+        session.commit()
+    assert version() == before
+
+    with Session(engine) as session:
+        usuario = session.get(Usuario, 2)
+        usuario.mail = "nuevo@mail.com"
+        session.add(usuario)
+        session.commit()
+    assert version() == before + 1
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+import idempotency
+from models import ClaveAplicada, ClaveIdempotencia, Gasto, Grupo, Usuario, UsuarioGrupo
+
+GASTO = {"titulo": "Super", "descripcion": "", "fecha": "2026-01-01", "autor": "a", "grupo_id": 1, "usuario_id": 1, "valor": 10.0}
+
+
+def _setup(engine):
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in (1, 2):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+            session.add(UsuarioGrupo(usuario_id=i, grupo_id=1))
+        session.commit()
+
+
+def _gastos(engine):
+    with Session(engine) as session:
+        return len(session.exec(select(Gasto)).all())
+
+
+def _reserve(engine, clave, latido, **kwargs):
+    """Clave reservada por un request "en curso" con el cuerpo de GASTO"""
+    import json
+
+    request_hash = idempotency._request_hash("POST", "/expenses/", "", json.dumps(GASTO).encode())
+    now = datetime.now()
+    with Session(engine) as session:
+        session.add(ClaveIdempotencia(
+            clave=clave, request_hash=request_hash, creado_en=now - timedelta(hours=1),
+            latido_en=latido, expira_en=now + timedelta(hours=1), **kwargs,
+        ))
+        session.commit()
+
+
+def _post(client, clave):
+    import json
+
+    return client.post(
+        "/expenses/", content=json.dumps(GASTO),
+        headers={"Content-Type": "application/json", "Idempotency-Key": clave},
+    )
+
+
+def test_retry_replays_response_and_marks_key_in_the_write_transaction(engine, client):
+    _setup(engine)
+
+    primero = _post(client, "k1")
+    segundo = _post(client, "k1")
+
+    assert primero.status_code == segundo.status_code == 200
+    assert segundo.headers["Idempotent-Replayed"] == "true"
+    assert segundo.json() == primero.json()
+    assert _gastos(engine) == 1
+    with Session(engine) as session:
+        assert session.get(ClaveAplicada, "k1") is not None
+
+
+def test_slow_request_with_heartbeat_is_not_executed_again(engine, client):
+    _setup(engine)
+    _reserve(engine, "k2", latido=datetime.now())
+
+    res = _post(client, "k2")
+
+    assert res.status_code == 409 and res.headers["Retry-After"] == "1"
+    assert _gastos(engine) == 0
+
+
+def test_abandoned_key_that_already_wrote_is_not_executed_again(engine, client):
+    _setup(engine)
+    _reserve(engine, "k3", latido=datetime.now() - idempotency.STALE_AFTER * 2)
+    with Session(engine) as session:
+        session.add(ClaveAplicada(clave="k3", expira_en=datetime.now() + timedelta(hours=1)))
+        session.commit()
+
+    res = _post(client, "k3")
+
+    assert res.status_code == 409 and "Retry-After" not in res.headers
+    assert _gastos(engine) == 0
+
+
+def test_abandoned_key_without_write_is_taken_over(engine, client):
+    _setup(engine)
+    _reserve(engine, "k4", latido=datetime.now() - idempotency.STALE_AFTER * 2)
+
+    assert _post(client, "k4").status_code == 200
+    assert _post(client, "k4").headers["Idempotent-Replayed"] == "true"
+    assert _gastos(engine) == 1
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from sqlmodel import Session
+
+import jobs
+from models import Tarea
+
+
+def _en_curso(engine, worker_id, latido):
+    with Session(engine) as session:
+        # Tipos distintos: dos interrumpidas del mismo tipo y grupo se cubren entre sí
+        tarea = Tarea(tipo=f"prueba-{worker_id}", estado=jobs.EN_CURSO, worker_id=worker_id, latido_en=latido)
+        session.add(tarea)
+        session.commit()
+        return tarea.id
+
+
+def _estado(engine, tarea_id):
+    with Session(engine) as session:
+        return session.get(Tarea, tarea_id).estado
+
+
+def test_requeue_leaves_jobs_of_live_replicas_alone(engine):
+    viva = _en_curso(engine, "otra-replica", datetime.now())
+    caida = _en_curso(engine, "replica-caida", datetime.now() - jobs.LEASE * 2)
+    propia = _en_curso(engine, jobs.WORKER_ID, datetime.now())
+
+    jobs._requeue_interrupted(own=True)
+
+    assert _estado(engine, viva) == jobs.EN_CURSO
+    assert _estado(engine, caida) == jobs.PENDIENTE
+    assert _estado(engine, propia) == jobs.PENDIENTE
+
+
+def test_periodic_requeue_only_takes_expired_leases(engine):
+    propia = _en_curso(engine, jobs.WORKER_ID, datetime.now())
+
+    jobs._requeue_interrupted()
+
+    assert _estado(engine, propia) == jobs.EN_CURSO
+
+
+def test_worker_does_not_overwrite_a_job_taken_over_by_another(engine):
+    tarea_id = _en_curso(engine, "otra-replica", datetime.now())
+
+    jobs._update(tarea_id, estado=jobs.COMPLETADA)
+
+    assert _estado(engine, tarea_id) == jobs.EN_CURSO
+
+
+def test_worker_starts_without_the_database_and_requeues_once_it_answers(engine, monkeypatch):
+    propia = _en_curso(engine, jobs.WORKER_ID, datetime.now())
+    requeue = jobs._requeue_interrupted
+    intentos = []
+
+    def caida_al_principio(own=False):
+        intentos.append(own)
+        if len(intentos) == 1:
+            raise OperationalError("SELECT 1", {}, Exception("connection refused"))
+        requeue(own=own)
+
+    monkeypatch.setattr(jobs, "_requeue_interrupted", caida_al_principio)
+    monkeypatch.setattr(jobs, "run_pending", lambda: None)
+
+    jobs.start_worker()  # no toca la base: no puede fallar aunque esté caída
+    try:
+        for _ in range(100):
+            if _estado(engine, propia) == jobs.PENDIENTE:
+                break
+            jobs._stop.wait(0.05)
+    finally:
+        jobs.stop_worker()
+
+    assert intentos[:2] == [True, True]
+    assert _estado(engine, propia) == jobs.PENDIENTE
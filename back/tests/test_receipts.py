@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+import pytest
+
+import storage
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 5000
+
+
+@pytest.fixture
+def receipts_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "RECEIPTS_DIR", str(tmp_path))
+    monkeypatch.setattr(storage, "MAX_RECEIPT_BYTES", 4096)
+    return tmp_path
+
+
+def _multipart(content, content_type="image/png", boundary="limite"):
+    head = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="ticket.png"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    return head + content + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def _files(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, fs in os.walk(root) for f in fs)
+
+
+def test_upload_streams_the_file_to_its_content_address(receipts_dir, client):
+    content = PNG[:3000]
+    body, content_type = _multipart(content)
+
+    def chunked():
+        for i in range(0, len(body), 100):
+            yield body[i:i + 100]
+
+    res = client.post("/receipts/", content=chunked(), headers={"Content-Type": content_type})
+
+    assert res.status_code == 200
+    name = hashlib.sha256(content).hexdigest() + ".png"
+    assert res.json()["name"] == name and res.json()["created"]
+    with open(storage.receipt_path(name), "rb") as f:
+        assert f.read() == content
+    assert not [f for f in _files(receipts_dir) if f.endswith(".part")]
+
+
+def test_upload_is_rejected_by_content_length_before_reading_the_body(receipts_dir, client):
+    body, content_type = _multipart(PNG * 10)
+
+    res = client.post("/receipts/", content=body, headers={"Content-Type": content_type})
+
+    assert res.status_code == 413
+    assert _files(receipts_dir) == []
+
+
+def test_upload_without_content_length_stops_once_over_the_limit(receipts_dir, client):
+    body, content_type = _multipart(PNG)
+
+    def chunked():
+        for i in range(0, len(body), 1024):
+            yield body[i:i + 1024]
+
+    res = client.post("/receipts/", content=chunked(), headers={"Content-Type": content_type})
+
+    assert res.status_code == 413
+    assert _files(receipts_dir) == []
+
+
+def test_upload_of_unsupported_type_is_rejected(receipts_dir, client):
+    body, content_type = _multipart(b"hola", content_type="text/plain")
+
+    res = client.post("/receipts/", content=body, headers={"Content-Type": content_type})
+
+    assert res.status_code == 415
+    assert _files(receipts_dir) == []
@@ -0,0 +1,40 @@
+import json
+from datetime import date
+
+from sqlmodel import Session, select
+
+import recurring
+from models import Deuda, Gasto, GastoRecurrente, Grupo, Usuario, UsuarioGrupo
+
+
+def _plantilla(**kwargs):
+    datos = dict(
+        grupo_id=1, usuario_id=1, titulo="Alquiler", valor=30.0, autor="a",
+        frecuencia=recurring.MENSUAL, fecha_inicio=date(2026, 1, 1), proxima_fecha=date(2026, 1, 1),
+    )
+    datos.update(kwargs)
+    return GastoRecurrente(**datos)
+
+
+def test_materialize_nets_debts_and_skips_broken_templates(engine):
+    with Session(engine) as session:
+        session.add(Grupo(id=1, nombre="Casa"))
+        for i in (1, 2):
+            session.add(Usuario(id=i, nombre=f"U{i}", apellido="A", mail=f"u{i}@mail.com", password="x"))
+            session.add(UsuarioGrupo(usuario_id=i, grupo_id=1))
+        session.add(_plantilla(usuario_id=1, valor=30.0))
+        session.add(_plantilla(usuario_id=2, valor=10.0))
+        # Montos fijos que no suman el valor: no se puede repartir
+        session.add(_plantilla(reparto=json.dumps({"tipo": "fijo", "montos": {"1": "1.00", "2": "1.00"}})))
+        session.commit()
+
+        creados = recurring.materialize_group(session, 1, today=date(2026, 2, 15))
+
+        assert creados == 4
+        assert session.exec(select(Gasto)).all()
+        pendientes = session.exec(select(Deuda).where(Deuda.estado == 0)).all()
+        # 2 debe 15 por mes y 1 debe 5 por mes: neteado, una sola dirección
+        assert {(d.deudor_id, d.acreedor_id) for d in pendientes} == {(2, 1)}
+        assert round(sum(d.monto for d in pendientes), 2) == 20.0
+        rota = session.exec(select(GastoRecurrente).where(GastoRecurrente.reparto.is_not(None))).one()
+        assert not rota.activo and "no suman" in rota.error
@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+import shards
+from models import Deuda, Grupo
+
+
+@pytest.fixture
+def two_shards(engine, tmp_path, monkeypatch):
+    """La base de los tests como shard 0 y otro SQLite como shard 1"""
+    other = create_engine(f"sqlite:///{tmp_path / 'shard1.db'}")
+    SQLModel.metadata.create_all(other)
+    monkeypatch.setattr(shards, "engines", [engine, other])
+    monkeypatch.setattr(shards, "_routes", {})
+    return engine, other
+
+
+def _debt(shard_engine):
+    with Session(shard_engine) as session:
+        deuda = Deuda(id=7, gasto_id=1, grupo_id=1, deudor_id=2, acreedor_id=1, monto=Decimal("5.00"), estado=0)
+        session.add(deuda)
+        session.commit()
+
+
+def _set_shard(engine, shard):
+    with Session(engine) as session:
+        grupo = session.get(Grupo, 1) or Grupo(id=1, nombre="Casa")
+        grupo.shard = shard
+        session.add(grupo)
+        session.commit()
+    shards.forget_route(1)
+
+
+def test_debt_of_a_moving_group_answers_503(two_shards, client):
+    source, target = two_shards
+    # A mitad del move la deuda está copiada en los dos shards
+    _set_shard(source, shards.MOVING)
+    _debt(source)
+    _debt(target)
+
+    res = client.patch("/expenses/debts/7/settle")
+
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == str(shards.MOVING_RETRY_SECONDS)
+
+
+def test_debt_is_read_from_the_shard_its_group_routes_to(two_shards, client):
+    source, target = two_shards
+    _set_shard(source, 1)
+    # Resto en el shard de origen de un move ya terminado
+    _debt(source)
+    _debt(target)
+
+    assert client.patch("/expenses/debts/7/settle").status_code == 200
+
+    with Session(target) as session:
+        assert session.get(Deuda, 7).estado == 1
+    with Session(source) as session:
+        assert session.get(Deuda, 7).estado == 0
@@ -0,0 +1,171 @@
+"""
+Propiedades del reparto, sobre casos aleatorios con semilla fija: cada gasto
+se reparte exactamente (las shares suman el monto) y los repartos y saldos
+coinciden con una implementación de referencia en Decimal, con cualquier
+estrategia.
+"""
+import json
+from collections import defaultdict
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import split_engine
+from split_engine import from_cents
+
+CASES = 200
+
+
+def _members(rng):
+    return sorted(rng.choice(np.arange(1, 50), size=rng.integers(2, 9), replace=False).tolist())
+
+
+def _spec(rng, members, amount):
+    tipo = rng.choice(["igual", "ponderado", "fijo"])
+    if tipo == "igual":
+        excluded = rng.choice(members, size=rng.integers(0, len(members)), replace=False).tolist()
+        return {"tipo": "igual", "excluidos": excluded}
+    if tipo == "ponderado":
+        weights = {str(m): int(rng.integers(0, 5)) for m in members}
+        weights[str(members[0])] += 1  # al menos un peso positivo
+        return {"tipo": "ponderado", "pesos": weights}
+    cuts = np.sort(rng.integers(0, amount + 1, size=len(members) - 1))
+    parts = np.diff(np.concatenate([[0], cuts, [amount]]))
+    return {"tipo": "fijo", "montos": {str(m): str(from_cents(int(p))) for m, p in zip(members, parts)}}
+
+
+@pytest.mark.parametrize("seed", range(CASES))
+def test_shares_sum_to_amount(seed):
+    rng = np.random.default_rng(seed)
+    members = _members(rng)
+    amount = int(rng.integers(1, 10_000_000))
+    spec = _spec(rng, members, amount)
+
+    shares = split_engine.split_one(amount, members, split_engine.from_spec(spec))
+
+    assert sum(shares.values()) == amount
+    assert all(c >= 0 for c in shares.values())
+    for m in spec.get("excluidos", []):
+        assert shares[m] == 0
+
+
+@pytest.mark.parametrize("seed", range(CASES))
+def test_split_many_matches_split_one(seed):
+    rng = np.random.default_rng(seed)
+    members = _members(rng)
+    amounts = rng.integers(1, 100_000, size=20).tolist()
+    strategy = split_engine.from_spec({"tipo": "ponderado", "pesos": {str(m): int(rng.integers(1, 7)) for m in members}})
+
+    matrix = split_engine.split_many(amounts, members, strategy)
+
+    assert matrix.sum(axis=1).tolist() == amounts
+    for amount, row in zip(amounts, matrix.tolist()):
+        assert split_engine.split_one(amount, members, strategy) == dict(zip(members, row))
+
+
+@pytest.mark.parametrize("seed", range(CASES))
+def test_equal_split_is_base_plus_remainder_by_id(seed):
+    rng = np.random.default_rng(seed)
+    members = _members(rng)
+    amount = int(rng.integers(0, 1_000_000))
+
+    shares = split_engine.split_one(amount, list(reversed(members)), split_engine.EqualSplit())
+
+    base, remainder = divmod(amount, len(members))
+    assert shares == {m: base + (1 if i < remainder else 0) for i, m in enumerate(members)}
+
+
+def _reference_shares(amount, members, spec):
+    """Mayor resto escrito a mano con Decimal: piso de cada cuota y un centavo a los de mayor resto"""
+    spec = spec or {"tipo": "igual"}
+    if spec["tipo"] == "fijo":
+        return {m: int(Decimal(spec["montos"][str(m)]) * 100) for m in members}
+    if spec["tipo"] == "igual":
+        weights = {m: 0 if m in spec.get("excluidos", []) else 1 for m in members}
+    else:
+        weights = {m: spec["pesos"].get(str(m), 0) for m in members}
+    total = sum(weights.values())
+    # divmod exacto: dividir y tomar la parte fraccionaria redondea a 28 dígitos y desempata mal
+    quotas = {m: divmod(Decimal(amount) * weights[m], total) for m in members}
+    shares = {m: int(whole) for m, (whole, _) in quotas.items()}
+    missing = amount - sum(shares.values())
+    by_remainder = sorted(members, key=lambda m: (-quotas[m][1], m))
+    for m in by_remainder[:missing]:
+        shares[m] += 1
+    return shares
+
+
+@pytest.mark.parametrize("seed", range(CASES))
+def test_balances_match_a_decimal_reference(seed):
+    rng = np.random.default_rng(seed)
+    members = _members(rng)
+    gastos, specs = [], []
+    for _ in range(int(rng.integers(1, 30))):
+        amount = int(rng.integers(1, 1_000_000))
+        spec = _spec(rng, members, amount) if rng.random() < 0.7 else None
+        if spec and spec["tipo"] == "igual" and set(spec["excluidos"]) == set(members):
+            spec = None
+        specs.append(spec)
+        gastos.append(SimpleNamespace(
+            valor=from_cents(amount),
+            reparto=json.dumps(spec) if spec else None,
+            usuario_id=int(rng.choice(members)),
+        ))
+
+    net, expected_net = defaultdict(int), defaultdict(int)
+    for gasto, spec, shares in zip(gastos, specs, split_engine.split_expenses(gastos, members)):
+        expected = _reference_shares(split_engine.to_cents(gasto.valor), members, spec)
+        assert shares == expected
+        for member_id in members:
+            if member_id != gasto.usuario_id:
+                net[member_id] -= shares[member_id]
+                net[gasto.usuario_id] += shares[member_id]
+                expected_net[member_id] -= expected[member_id]
+                expected_net[gasto.usuario_id] += expected[member_id]
+
+    assert net == expected_net
+
+
+@pytest.mark.parametrize("seed", range(CASES))
+def test_stored_split_survives_member_removal(seed):
+    rng = np.random.default_rng(seed)
+    members = _members(rng)
+    amount = int(rng.integers(1, 10_000_000))
+    spec = _spec(rng, members, amount)
+    reparto = json.dumps(spec)
+    gone = int(rng.choice(members))
+    remaining = [m for m in members if m != gone]
+
+    named = {int(m) for m in (*spec.get("excluidos", []), *spec.get("pesos", {}), *spec.get("montos", {}))}
+    if gone in named:
+        with pytest.raises(ValueError, match="no son miembros"):
+            split_engine.split_one(amount, remaining, split_engine.from_spec(spec))
+
+    try:
+        shares = split_engine.split_one(amount, remaining, split_engine.parse(reparto))
+    except ValueError:
+        # Solo si quedaron excluidos todos los que siguen en el grupo
+        assert set(json.loads(reparto).get("excluidos", [])) >= set(remaining)
+        return
+    assert set(shares) == set(remaining)
+    assert sum(shares.values()) == amount
+    assert all(c >= 0 for c in shares.values())
+
+
+def test_fixed_amount_of_removed_member_goes_to_the_rest_proportionally():
+    strategy = split_engine.parse(json.dumps({"tipo": "fijo", "montos": {"1": "30.00", "2": "10.00", "3": "20.00"}}))
+
+    assert split_engine.split_one(6000, [1, 2], strategy) == {1: 4500, 2: 1500}
+
+
+def test_weighted_falls_back_to_equal_when_only_removed_members_had_weight():
+    strategy = split_engine.parse(json.dumps({"tipo": "ponderado", "pesos": {"1": 0, "2": 0, "3": 4}}))
+
+    assert split_engine.split_one(1001, [1, 2], strategy) == {1: 501, 2: 500}
+
+
+def test_new_split_naming_a_non_member_is_rejected():
+    with pytest.raises(ValueError, match="no son miembros"):
+        split_engine.split_one(100, [1, 2], split_engine.from_spec({"tipo": "igual", "excluidos": [9]}))
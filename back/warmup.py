@@ -0,0 +1,110 @@
+"""
+Precalentamiento del backend antes de declararse listo.
+
+Abre las conexiones del pool, configura los mappers y pide una vez las rutas
+más usadas (con IDs que no existen) a través de la app completa, con sus
+dependencias y middlewares, para que SQLAlchemy ya tenga su SQL compilado en
+cache cuando llegue el primer request real. Corre una sola vez, en segundo
+plano desde el arranque (main.py); /ready solo informa si terminó.
+
+Los requests del precalentamiento llevan WARMUP_STATE en el estado del scope
+(request.state), que solo puede poner el propio proceso: la captura de tráfico
+no los guarda, y un cliente no puede saltearse la captura con un header.
+"""
+import time
+from decimal import Decimal
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+from sqlmodel import Session
+
+from database import engine
+import shards
+
+NO_ID = -1
+WARMUP_STATE = "warmup"
+
+# Rutas calientes; las que no reciben grupo_id consultan todos los shards
+HOT_ROUTES = [
+    f"/expenses/?grupo_id={NO_ID}&usuario_id={NO_ID}&limit=1",
+    f"/expenses/debts/{NO_ID}",
+    f"/expenses/credits/{NO_ID}",
+    f"/expenses/summary?grupo_id={NO_ID}&usuario_id={NO_ID}",
+    f"/expenses/settlements?grupo_id={NO_ID}",
+    f"/expenses/group/{NO_ID}",
+    f"/expenses/{NO_ID}",
+    f"/groups/{NO_ID}/members",
+    f"/users/{NO_ID}",
+]
+
+
+def _open_pool(pool_engine):
+    size = pool_engine.pool.size() if hasattr(pool_engine.pool, "size") else 1
+    connections = [pool_engine.connect() for _ in range(size)]
+    for conn in connections:
+        conn.execute(text("SELECT 1"))
+    for conn in connections:
+        conn.close()
+
+
+def _prepare():
+    configure_mappers()
+    for pool_engine in {id(e): e for e in [engine, *shards.engines]}.values():
+        _open_pool(pool_engine)
+
+
+def _compile_write_path():
+    # El neteo corre dentro de las escrituras, que no se pueden pedir sin escribir;
+    # el rollback descarta la deuda agregada
+    import debts
+
+    for shard_engine in shards.engines:
+        with Session(shard_engine) as session:
+            debts.net_or_create_debt(
+                session=session, grupo_id=NO_ID, deudor_id=NO_ID, acreedor_id=NO_ID,
+                monto=Decimal("0.01"),
+            )
+            session.rollback()
+
+
+async def _request(app, url: str) -> int:
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"warmup")],
+        "state": {WARMUP_STATE: True},
+        "client": ("127.0.0.1", 0),
+        "server": ("warmup", 80),
+    }
+    status = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status.get("code", 500)
+
+
+async def run(app) -> float:
+    """Ejecuta el precalentamiento y devuelve cuánto tardó en segundos"""
+    started = time.perf_counter()
+    await run_in_threadpool(_prepare)
+    for url in HOT_ROUTES:
+        status = await _request(app, url)
+        if status >= 500:
+            raise RuntimeError(f"{url} respondió {status} durante el precalentamiento")
+    await run_in_threadpool(_compile_write_path)
+    return time.perf_counter() - started
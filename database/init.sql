@@ -18,6 +18,8 @@ CREATE TABLE IF NOT EXISTS grupos (
     nombre VARCHAR(255) NOT NULL,
     direccion TEXT,
     descripcion TEXT,
+    shard INTEGER NOT NULL DEFAULT 0,
+    version_miembros INTEGER NOT NULL DEFAULT 0,
     creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -42,6 +44,8 @@ CREATE TABLE IF NOT EXISTS gastos (
     usuario_id INTEGER NOT NULL,
     grupo_id INTEGER REFERENCES grupos(id),
     comprobante VARCHAR(500),
+    reparto TEXT,
+    recurrente_id INTEGER,
     creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -51,6 +55,31 @@ ALTER TABLE gastos
     ADD CONSTRAINT fk_gastos_grupo_id
     FOREIGN KEY (grupo_id) REFERENCES grupos(id);
 
+-- Crear tabla gastos_recurrentes (plantillas de gastos que se repiten)
+CREATE TABLE IF NOT EXISTS gastos_recurrentes (
+    id SERIAL PRIMARY KEY,
+    grupo_id INTEGER NOT NULL REFERENCES grupos(id) ON DELETE CASCADE,
+    usuario_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+    titulo VARCHAR(255) NOT NULL,
+    descripcion TEXT,
+    valor DECIMAL(10,2) NOT NULL,
+    autor VARCHAR(100) NOT NULL,
+    reparto TEXT,
+    frecuencia VARCHAR(10) NOT NULL,
+    intervalo INTEGER NOT NULL DEFAULT 1,
+    fecha_inicio DATE NOT NULL,
+    fecha_fin DATE,
+    proxima_fecha DATE NOT NULL,
+    activo BOOLEAN NOT NULL DEFAULT TRUE,
+    error TEXT,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE gastos
+    ADD CONSTRAINT fk_gastos_recurrente_id
+    FOREIGN KEY (recurrente_id) REFERENCES gastos_recurrentes(id) ON DELETE SET NULL;
+
 -- Crear tabla deudas
 CREATE TABLE IF NOT EXISTS deudas (
     id SERIAL PRIMARY KEY,
@@ -64,6 +93,85 @@ CREATE TABLE IF NOT EXISTS deudas (
     actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Crear tabla deuda_gastos (parte de cada gasto en una deuda consolidada)
+CREATE TABLE IF NOT EXISTS deuda_gastos (
+    id SERIAL PRIMARY KEY,
+    deuda_id INTEGER NOT NULL REFERENCES deudas(id) ON DELETE CASCADE,
+    gasto_id INTEGER NOT NULL REFERENCES gastos(id) ON DELETE CASCADE,
+    grupo_id INTEGER NOT NULL REFERENCES grupos(id) ON DELETE CASCADE,
+    monto DECIMAL(10,2) NOT NULL
+);
+
+-- Crear tabla tareas (trabajos en segundo plano)
+CREATE TABLE IF NOT EXISTS tareas (
+    id SERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    grupo_id INTEGER REFERENCES grupos(id) ON DELETE CASCADE,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    progreso INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    solicitudes INTEGER NOT NULL DEFAULT 1,
+    worker_id VARCHAR(255),
+    latido_en TIMESTAMP,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Un solo trabajo pendiente por tipo y grupo
+CREATE UNIQUE INDEX IF NOT EXISTS uq_tareas_pendiente ON tareas(tipo, grupo_id) WHERE estado = 'pendiente';
+
+-- Crear tabla claves_idempotencia (respuestas guardadas por Idempotency-Key)
+CREATE TABLE IF NOT EXISTS claves_idempotencia (
+    clave VARCHAR(255) PRIMARY KEY,
+    request_hash VARCHAR(64) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'en_curso',
+    status_code INTEGER,
+    respuesta TEXT,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    latido_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expira_en TIMESTAMP NOT NULL
+);
+
+-- Crear tabla claves_aplicadas (en cada shard: la Idempotency-Key se marca en la transacción de la escritura)
+CREATE TABLE IF NOT EXISTS claves_aplicadas (
+    clave VARCHAR(255) PRIMARY KEY,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expira_en TIMESTAMP NOT NULL
+);
+
+-- Crear tabla movimientos_deuda (libro de eventos de deudas, solo inserciones)
+CREATE TABLE IF NOT EXISTS movimientos_deuda (
+    id SERIAL PRIMARY KEY,
+    grupo_id INTEGER NOT NULL REFERENCES grupos(id) ON DELETE CASCADE,
+    deuda_id INTEGER NOT NULL,
+    gasto_id INTEGER,
+    deudor_id INTEGER NOT NULL,
+    acreedor_id INTEGER NOT NULL,
+    tipo VARCHAR(20) NOT NULL,
+    delta_centavos BIGINT NOT NULL,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Crear tabla cambios (registro de cambios por grupo para sincronización incremental)
+CREATE TABLE IF NOT EXISTS cambios (
+    id SERIAL PRIMARY KEY,
+    grupo_id INTEGER NOT NULL REFERENCES grupos(id) ON DELETE CASCADE,
+    seq BIGINT NOT NULL,
+    entidad VARCHAR(20) NOT NULL,
+    entidad_id INTEGER NOT NULL,
+    operacion VARCHAR(10) NOT NULL,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Crear tabla saldos_snapshot (saldos por usuario de un grupo a una fecha)
+CREATE TABLE IF NOT EXISTS saldos_snapshot (
+    id SERIAL PRIMARY KEY,
+    grupo_id INTEGER NOT NULL REFERENCES grupos(id) ON DELETE CASCADE,
+    usuario_id INTEGER NOT NULL,
+    hasta TIMESTAMP NOT NULL,
+    saldo_centavos BIGINT NOT NULL
+);
+
 -- Agregar restricciones de clave foránea
 ALTER TABLE usuario_grupos
     ADD CONSTRAINT fk_usuario_grupos_usuario_id
@@ -103,6 +211,21 @@ CREATE INDEX IF NOT EXISTS idx_gastos_autor ON gastos(autor);
 CREATE INDEX IF NOT EXISTS idx_gastos_usuario_id ON gastos(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_gastos_valor ON gastos(valor);
 CREATE INDEX IF NOT EXISTS idx_gastos_grupo_id ON gastos(grupo_id);
+CREATE INDEX IF NOT EXISTS idx_gastos_grupo_fecha_id ON gastos(grupo_id, fecha DESC, id DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_gastos_recurrente_fecha ON gastos(recurrente_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_gastos_recurrentes_proxima ON gastos_recurrentes(proxima_fecha) WHERE activo;
+CREATE INDEX IF NOT EXISTS idx_deudas_gasto_deudor ON deudas(gasto_id, deudor_id);
+CREATE INDEX IF NOT EXISTS idx_deudas_grupo_par_pendiente ON deudas(grupo_id, deudor_id, acreedor_id) WHERE estado = 0;
+CREATE INDEX IF NOT EXISTS idx_deuda_gastos_deuda_id ON deuda_gastos(deuda_id);
+CREATE INDEX IF NOT EXISTS idx_deuda_gastos_gasto_id ON deuda_gastos(gasto_id);
+CREATE INDEX IF NOT EXISTS idx_deuda_gastos_grupo_id ON deuda_gastos(grupo_id);
+CREATE INDEX IF NOT EXISTS idx_tareas_estado ON tareas(estado);
+CREATE INDEX IF NOT EXISTS idx_claves_idempotencia_expira_en ON claves_idempotencia(expira_en);
+CREATE INDEX IF NOT EXISTS idx_claves_aplicadas_expira_en ON claves_aplicadas(expira_en);
+CREATE INDEX IF NOT EXISTS ix_movimientos_deuda_grupo_creado ON movimientos_deuda(grupo_id, creado_en);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cambios_grupo_seq ON cambios(grupo_id, seq);
+CREATE INDEX IF NOT EXISTS ix_cambios_creado_en ON cambios(creado_en);
+CREATE INDEX IF NOT EXISTS ix_saldos_snapshot_grupo_hasta ON saldos_snapshot(grupo_id, hasta);
 
 -- Crear función para actualizar timestamp actualizado_en
 CREATE OR REPLACE FUNCTION actualizar_timestamp()
@@ -127,4 +250,14 @@ CREATE TRIGGER actualizar_grupos_timestamp
 CREATE TRIGGER actualizar_gastos_timestamp
     BEFORE UPDATE ON gastos
     FOR EACH ROW
+    EXECUTE FUNCTION actualizar_timestamp();
+
+CREATE TRIGGER actualizar_gastos_recurrentes_timestamp
+    BEFORE UPDATE ON gastos_recurrentes
+    FOR EACH ROW
+    EXECUTE FUNCTION actualizar_timestamp();
+
+CREATE TRIGGER actualizar_tareas_timestamp
+    BEFORE UPDATE ON tareas
+    FOR EACH ROW
     EXECUTE FUNCTION actualizar_timestamp();
\ No newline at end of file
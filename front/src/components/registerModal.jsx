@@ -1,5 +1,5 @@
 import React, { useEffect, useRef, useState } from "react";
-import { sendExpenseToBackend } from "../utils/expensesUtils";
+import { newIdempotencyKey, sendExpenseToBackend, uploadReceipt } from "../utils/expensesUtils";
 import "../styles/registerModal.css";
 
 function Dialog({ open, type = "info", title, message, onClose, onPrimary, primaryText = "OK" }) {
@@ -25,7 +25,7 @@ export default function RegisterExpenseModal({ onRegister, groupId }) {
   const [monto, setMonto] = useState("");
   const [descripcion, setDescripcion] = useState("");
   const [fileName, setFileName] = useState("");
-  const [filePath, setFilePath] = useState("");
+  const [file, setFile] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
 
   const [dlgSuccess, setDlgSuccess] = useState(false);
@@ -33,6 +33,13 @@ export default function RegisterExpenseModal({ onRegister, groupId }) {
   const [dlgWarn, setDlgWarn] = useState(false);
 
   const fileInputRef = useRef(null);
+  // Clave y comprobante del envío en curso: si falla y se vuelve a enviar el mismo
+  // formulario se reusan, así el backend reconoce el reintento y no duplica el gasto
+  const pendingSubmit = useRef(null);
+
+  useEffect(() => {
+    pendingSubmit.current = null;
+  }, [nombre, monto, descripcion, file, groupId]);
 
   useEffect(() => {
     const onKey = (e) => e.key === "Escape" && setIsOpen(false);
@@ -47,16 +54,16 @@ export default function RegisterExpenseModal({ onRegister, groupId }) {
     const f = e.target.files?.[0];
     if (f) {
       setFileName(f.name);
-      setFilePath("src/data/comprobantes/" + f.name);
+      setFile(f);
     } else {
       setFileName("");
-      setFilePath("");
+      setFile(null);
     }
   };
 
 const handleSubmit = async (e, groupId) => {
   e.preventDefault();
-  if (!filePath) { setDlgWarn(true); return; }
+  if (!file) { setDlgWarn(true); return; }
   if (!nombre.trim() || !monto) { setDlgError({ open: true, msg: "Nombre y monto son obligatorios." }); return; }
 
   setIsLoading(true);
@@ -66,24 +73,32 @@ const handleSubmit = async (e, groupId) => {
     const usuario_id = user.id;
     if (!usuario_id) throw new Error("Usuario no autenticado");
 
+    if (!pendingSubmit.current) {
+      pendingSubmit.current = { key: newIdempotencyKey(), comprobante: null, fecha: new Date().toISOString().slice(0, 10) };
+    }
+    const pending = pendingSubmit.current;
+    if (!pending.comprobante) pending.comprobante = await uploadReceipt(file);
+    const comprobante = pending.comprobante;
+
     const expenseData = {
       titulo: nombre.trim(),
       descripcion: descripcion?.trim() || null,
       valor: parseFloat(monto),
-      fecha: new Date().toISOString().slice(0, 10),
+      fecha: pending.fecha,
       autor: `${user.nombre} ${user.apellido}`,
       usuario_id: Number(usuario_id),
       grupo_id: Number(groupId),
-      comprobante: filePath,
+      comprobante,
     };
     console.log("JSON enviado al backend:", expenseData);
 
-    const created = await sendExpenseToBackend(expenseData); // <-- usamos la util
+    const created = await sendExpenseToBackend(expenseData, pending.key); // <-- usamos la util
+    pendingSubmit.current = null;
     onRegister?.(created);
 
     setDlgSuccess(true);
     setIsOpen(false);
-    setNombre(""); setMonto(""); setDescripcion(""); setFileName(""); setFilePath("");
+    setNombre(""); setMonto(""); setDescripcion(""); setFileName(""); setFile(null);
 
   } catch (err) {
     setDlgError({ open: true, msg: err?.message || "Error inesperado." });
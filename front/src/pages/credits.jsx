@@ -2,6 +2,7 @@ import React, { useEffect, useState } from "react";
 import "../styles/details.css"; // reutiliza estilos existentes
 import DatePicker from "react-datepicker";
 import { isSameDay, parseISO } from "date-fns";
+import { fetchBatch } from "../utils/batchUtils";
 
 export default function Credits({ group }) {
   const [credits, setCredits] = useState([]);
@@ -10,7 +11,6 @@ export default function Credits({ group }) {
   const [search, setSearch] = useState("");
   const [fecha, setFecha] = useState(null);
   const [estadoFilter, setEstadoFilter] = useState("all"); // all | pending | paid
-  const [usersMap, setUsersMap] = useState({});
   const baseUrl = "http://localhost:8000";
 
   const getCurrentUser = () => {
@@ -28,63 +28,10 @@ export default function Credits({ group }) {
   const currentUserId = currentUser?.id ?? (Number(localStorage.getItem("userId")) || 1);
 
   useEffect(() => {
-    fetchUsers();
+    // refetch credits when user or group changes so el grupo aplicado se refleje
+    fetchCredits();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [currentUserId]);
-
-  useEffect(() => {
-    // refetch credits when usersMap or group changes so nombres se resuelvan y el grupo aplicado
-    if (Object.keys(usersMap).length > 0) {
-      fetchCredits();
-    }
-    // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [usersMap, group]);
-
-  const fetchUsers = async () => {
-    try {
-      const res = await fetch(`${baseUrl}/users`);
-      if (!res.ok) {
-        console.warn("fetchUsers: respuesta no OK", res.status);
-        setUsersMap({});
-        return;
-      }
-      const data = await res.json();
-      if (!Array.isArray(data)) {
-        console.warn("fetchUsers: formato inesperado", data);
-        setUsersMap({});
-        return;
-      }
-
-      const map = {};
-      data.forEach((u) => {
-        map[String(u.id)] = u.nombre ?? u.name ?? `${u.id}`;
-      });
-      setUsersMap(map);
-    } catch (err) {
-      console.warn("fetchUsers error:", err);
-      setUsersMap({});
-    }
-  };
-
-  const fetchExpenseDetails = async (gastoIds = []) => {
-    const map = {};
-    const unique = Array.from(new Set(gastoIds.filter((id) => id != null)));
-    if (unique.length === 0) return map;
-
-    await Promise.all(
-      unique.map(async (gid) => {
-        try {
-          const r = await fetch(`${baseUrl}/expenses/${gid}`);
-          if (!r.ok) return;
-          const exp = await r.json();
-          map[String(gid)] = exp;
-        } catch (e) {
-          console.warn("fetchExpenseDetails error for", gid, e);
-        }
-      })
-    );
-    return map;
-  };
+  }, [currentUserId, group]);
 
   const fetchCredits = async () => {
     setLoading(true);
@@ -107,7 +54,11 @@ export default function Credits({ group }) {
       const data = await res.json();
 
       const gastoIds = (Array.isArray(data) ? data : []).map((it) => it?.gasto_id ?? it?.gasto?.id).filter(Boolean);
-      const expenseMap = await fetchExpenseDetails(gastoIds);
+      const userIds = (Array.isArray(data) ? data : []).map((it) => it?.deudor_id).filter(Boolean);
+      const [expenseMap, usersMap] = await Promise.all([
+        fetchBatch(baseUrl, "expenses", gastoIds),
+        fetchBatch(baseUrl, "users", userIds),
+      ]);
 
       const normalized = (Array.isArray(data) ? data : []).map((it, idx) => {
         const deudor_id = it?.deudor_id ?? it?.usuario_id ?? null;
@@ -122,7 +73,7 @@ export default function Credits({ group }) {
           estado: Number(it?.estado ?? 0), // 1 = pago
           creado_en: exp?.fecha ?? it?.creado_en ?? it?.fecha ?? null,
           deudor_id,
-          deudor_nombre: usersMap[String(deudor_id)] ?? deudor_nombre_fallback,
+          deudor_nombre: usersMap[String(deudor_id)]?.nombre ?? deudor_nombre_fallback,
           descripcion: exp?.descripcion ?? exp?.detalle ?? it?.descripcion ?? ""
         };
       });
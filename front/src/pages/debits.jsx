@@ -2,6 +2,7 @@ import React, { useEffect, useState } from "react";
 import "../styles/details.css";
 import DatePicker from "react-datepicker";
 import { isSameDay, parseISO } from "date-fns";
+import { fetchBatch } from "../utils/batchUtils";
 
 export default function Debts({ group }) {
   const [debts, setDebts] = useState([]);
@@ -10,7 +11,6 @@ export default function Debts({ group }) {
   const [search, setSearch] = useState("");
   const [fecha, setFecha] = useState(null);
   const [estadoFilter, setEstadoFilter] = useState("all"); // all | pending | paid
-  const [usersMap, setUsersMap] = useState({});
   const baseUrl = "http://localhost:8000";
 
   const getCurrentUser = () => {
@@ -24,43 +24,6 @@ export default function Debts({ group }) {
     }
   };
 
-  const fetchUsers = async () => {
-    try {
-      const res = await fetch(`${baseUrl}/users`);
-      if (!res.ok) throw new Error("No users endpoint");
-      const data = await res.json();
-      if (Array.isArray(data)) {
-        const map = {};
-        data.forEach((u) => {
-          if (u?.id) map[String(u.id)] = u.nombre ?? u.name ?? `${u.id}`;
-        });
-        setUsersMap(map);
-      }
-    } catch (err) {
-      console.warn("fetchUsers failed:", err);
-      setUsersMap({});
-    }
-  };
-
-  const fetchExpenseDetails = async (gastoIds = []) => {
-    const map = {};
-    const unique = Array.from(new Set(gastoIds.filter((id) => id != null)));
-    if (unique.length === 0) return map;
-    await Promise.all(
-      unique.map(async (gid) => {
-        try {
-          const r = await fetch(`${baseUrl}/expenses/${gid}`);
-          if (!r.ok) return;
-          const exp = await r.json();
-          map[String(gid)] = exp;
-        } catch (e) {
-          console.warn("fetchExpenseDetails error for", gid, e);
-        }
-      })
-    );
-    return map;
-  };
-
   const fetchDebts = async () => {
     setLoading(true);
     setError("");
@@ -81,7 +44,11 @@ export default function Debts({ group }) {
       }
       const data = await res.json();
       const gastoIds = (Array.isArray(data) ? data : []).map((it) => it?.gasto_id ?? it?.gasto?.id).filter(Boolean);
-      const expenseMap = await fetchExpenseDetails(gastoIds);
+      const userIds = (Array.isArray(data) ? data : []).map((it) => it?.acreedor_id).filter(Boolean);
+      const [expenseMap, usersMap] = await Promise.all([
+        fetchBatch(baseUrl, "expenses", gastoIds),
+        fetchBatch(baseUrl, "users", userIds),
+      ]);
 
       const normalized = (Array.isArray(data) ? data : []).map((it, idx) => {
         const acreedor_id = it?.acreedor_id ?? null;
@@ -96,7 +63,7 @@ export default function Debts({ group }) {
           estado: Number(it?.estado ?? 0), // 1 = pago
           creado_en: exp?.fecha ?? it?.creado_en ?? it?.fecha ?? null,
           acreedor_id,
-          acreedor_nombre: usersMap[String(acreedor_id)] ?? acreedor_nombre_fallback,
+          acreedor_nombre: usersMap[String(acreedor_id)]?.nombre ?? acreedor_nombre_fallback,
           descripcion: exp?.descripcion ?? exp?.detalle ?? it?.descripcion ?? ""
         };
       });
@@ -112,14 +79,10 @@ export default function Debts({ group }) {
   };
 
   useEffect(() => {
-    fetchUsers();
-  }, []);
-
-  useEffect(() => {
-    // refetch debts when group or usersMap changes (so nombres se resuelvan)
+    // refetch debts when group changes
     fetchDebts();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [group, usersMap]);
+  }, [group]);
 
   const filtered = debts
     .filter((d) => {
@@ -0,0 +1,19 @@
+// Debe coincidir con MAX_BATCH_IDS del backend (batch_utils.py)
+const MAX_BATCH_IDS = 200;
+
+// Trae varios recursos por id (/expenses/batch, /users/batch) y devuelve un mapa id -> datos
+export async function fetchBatch(baseUrl, resource, ids = []) {
+  const unique = Array.from(new Set(ids.filter((id) => id != null).map(String)));
+  const map = {};
+  for (let i = 0; i < unique.length; i += MAX_BATCH_IDS) {
+    const chunk = unique.slice(i, i + MAX_BATCH_IDS);
+    try {
+      const res = await fetch(`${baseUrl}/${resource}/batch?ids=${chunk.join(",")}`);
+      if (!res.ok) continue;
+      Object.assign(map, await res.json());
+    } catch (e) {
+      console.warn(`fetchBatch ${resource} error:`, e);
+    }
+  }
+  return map;
+}
@@ -1,11 +1,37 @@
 const API_URL = "http://127.0.0.1:8000";
 
-export async function sendExpenseToBackend(expenseData) {
-  const res = await fetch(`${API_URL}/expenses/`, {
+const MAX_ATTEMPTS = 3;
+
+const wait = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// `idempotencyKey` se crea una vez por envío del formulario (newIdempotencyKey) y se
+// reusa en cada reintento: así el backend devuelve el gasto ya creado en vez de duplicarlo
+export function newIdempotencyKey() {
+  return crypto.randomUUID();
+}
+
+export async function sendExpenseToBackend(expenseData, idempotencyKey) {
+  const request = {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers: { "Content-Type": "application/json", "Idempotency-Key": idempotencyKey },
     body: JSON.stringify(expenseData)
-  });
+  };
+
+  let res;
+  for (let attempt = 1; ; attempt++) {
+    try {
+      res = await fetch(`${API_URL}/expenses/`, request);
+    } catch (err) {
+      // Sin respuesta (corte de red): el gasto pudo haberse creado, se reintenta con la misma clave
+      if (attempt >= MAX_ATTEMPTS) throw err;
+      await wait(500 * attempt);
+      continue;
+    }
+    // 409 con Retry-After: el primer intento con esta clave todavía se está procesando
+    const retryAfter = res.status === 409 && res.headers.get("Retry-After");
+    if (!retryAfter || attempt >= MAX_ATTEMPTS) break;
+    await wait(Number(retryAfter) * 1000);
+  }
 
   if (!res.ok) {
     let msg = "Error al crear el gasto.";
@@ -16,4 +42,20 @@ export async function sendExpenseToBackend(expenseData) {
   }
 
   return await res.json();
-}
\ No newline at end of file
+}
+export async function uploadReceipt(file) {
+  const form = new FormData();
+  form.append("file", file);
+  const res = await fetch(`${API_URL}/receipts/`, { method: "POST", body: form });
+
+  if (!res.ok) {
+    let msg = "Error al subir el comprobante.";
+    try {
+      msg = (await res.json())?.detail || msg;
+    } catch {}
+    throw new Error(msg);
+  }
+
+  const data = await res.json();
+  return `${API_URL}${data.url}`;
+}